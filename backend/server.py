@@ -1,22 +1,42 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Response, Query, Request, Header
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional, Dict, Any, Tuple
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 import requests
 import aiohttp
 import asyncio
 import httpx
 from geopy.geocoders import Nominatim
 import json
+import csv
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import codecs
+import re
+import sys
+import unicodedata
+import time
+import random
+import secrets
+import pstats
+import tracemalloc
+import gc
 import io
 import base64
+from functools import lru_cache, wraps
+from collections import OrderedDict, deque
+import numpy as np
 
 # PDF Generation imports
 from reportlab.lib import colors
@@ -29,6 +49,7 @@ from reportlab.graphics.shapes import Drawing
 from reportlab.graphics.charts.piecharts import Pie
 from reportlab.graphics.charts.linecharts import HorizontalLineChart
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import matplotlib.patches as mpatches
 
 ROOT_DIR = Path(__file__).parent
@@ -48,7 +69,302 @@ api_router = APIRouter(prefix="/api")
 # PVGIS Configuration
 PVGIS_BASE_URL = "https://re.jrc.ec.europa.eu/api/v5_2"
 
+# Instrumentation: in-process metrics exported in the Prometheus text format on /api/metrics
+METRICS_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CACHE_HIT_RESULTS = ["memory", "mongo"]  # Lookup results counted as hits
+
+metrics_lock = threading.Lock()  # PDF renders run in worker threads
+request_latency: Dict[Tuple[str, str, str], List[float]] = {}  # (method, route, status) -> buckets + [sum, count]
+stage_latency: Dict[str, List[float]] = {}  # stage -> buckets + [sum, count]
+cache_lookups: Dict[Tuple[str, str], int] = {}  # (cache, result) -> count
+upstream_in_flight: Dict[str, int] = {}  # provider -> calls in progress
+upstream_calls: Dict[Tuple[str, str], int] = {}  # (provider, outcome) -> count
+
+def observe_histogram(histograms: Dict[Any, List[float]], labels: Any, value: float, buckets: Tuple[float, ...] = METRICS_LATENCY_BUCKETS):
+    """Add an observation to a histogram (latency in seconds unless other buckets are given)"""
+    with metrics_lock:
+        histogram = histograms.setdefault(labels, [0.0] * (len(buckets) + 2))
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[index] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+# Tracing: span trees per request, logged as JSON and summarized in a Server-Timing header
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', '1') == '1'
+TRACE_LOG_MIN_DURATION_MS = float(os.environ.get('TRACE_LOG_MIN_DURATION_MS', 500))  # Only slower requests are logged
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', '0') == '1'
+
+current_span: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_span", default=None)
+trace_logger = logging.getLogger("trace")
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Record a span under the current one, nothing is recorded outside a traced request
+    Child tasks started inside the span (asyncio.gather, create_task) attach to it
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    record = {"name": name, "started": time.perf_counter(), "attributes": attributes, "children": []}
+    parent["children"].append(record)
+    token = current_span.set(record)
+    try:
+        yield record
+    except BaseException as e:
+        record["attributes"]["error"] = type(e).__name__
+        raise
+    finally:
+        record["duration"] = time.perf_counter() - record["started"]
+        current_span.reset(token)
+
+def traced(name: Optional[str] = None):
+    """Decorator recording a span around each call of a function (sync or async)"""
+    def decorator(function):
+        span_name = name or function.__name__
+        if asyncio.iscoroutinefunction(function):
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+        
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def serialize_span(record: Dict[str, Any], origin: float) -> Dict[str, Any]:
+    """Span tree as JSON-friendly dict, times in ms relative to the request start"""
+    return {
+        "name": record["name"],
+        "start_ms": round((record["started"] - origin) * 1000, 2),
+        "duration_ms": round(record.get("duration", time.perf_counter() - record["started"]) * 1000, 2),
+        **record["attributes"],
+        "children": [serialize_span(child, origin) for child in record["children"]]
+    }
+
+def server_timing(record: Dict[str, Any]) -> str:
+    """Server-Timing header value: total time of each span name, plus the whole request"""
+    totals: Dict[str, float] = {}
+    pending = list(record["children"])
+    while pending:
+        child = pending.pop()
+        totals[child["name"]] = totals.get(child["name"], 0) + child.get("duration", 0)
+        pending.extend(child["children"])
+    entries = [f"{re.sub(r'[^A-Za-z0-9_]', '_', name)};dur={seconds * 1000:.1f}" for name, seconds in sorted(totals.items())]
+    return ", ".join(entries + [f"total;dur={record['duration'] * 1000:.1f}"])
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a stage of the calculation pipeline (works around awaits too), also recorded as a span"""
+    started = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    finally:
+        observe_histogram(stage_latency, stage, time.perf_counter() - started)
+
+async def timed(stage: str, awaitable):
+    """Await a single call, e.g. a Mongo query, as a pipeline stage"""
+    with stage_timer(stage):
+        return await awaitable
+
+def record_cache_lookup(cache: str, result: str):
+    """Count a cache lookup: memory, mongo, stale or miss"""
+    with metrics_lock:
+        cache_lookups[(cache, result)] = cache_lookups.get((cache, result), 0) + 1
+
+@contextmanager
+def upstream_call(provider: str):
+    """Track an external call: in-flight gauge and outcome counter"""
+    with metrics_lock:
+        upstream_in_flight[provider] = upstream_in_flight.get(provider, 0) + 1
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        with metrics_lock:
+            upstream_in_flight[provider] -= 1
+            upstream_calls[(provider, outcome)] = upstream_calls.get((provider, outcome), 0) + 1
+
+# Render memory accounting: tracemalloc peak and retained bytes of each chart and PDF render
+# Off by default, tracing every allocation slows the renders down
+MEMORY_PROFILING = os.environ.get('MEMORY_PROFILING', '0') == '1'
+MEMORY_LEAK_THRESHOLD_BYTES = int(os.environ.get('MEMORY_LEAK_THRESHOLD_BYTES', 512 * 1024))  # Retained by a single render
+MEMORY_BUCKETS_BYTES = tuple(float(2 ** power * 1024 * 1024) for power in range(10))  # 1 MiB to 512 MiB
+
+render_peak_memory: Dict[str, List[float]] = {}  # render -> buckets + [sum, count]
+render_retained_bytes: Dict[str, int] = {}  # render -> bytes still allocated after the last render
+render_leaks: Dict[Tuple[str, str], int] = {}  # (render, reason) -> count
+render_memory_stack = threading.local()  # Renders in progress on this thread, charts nest inside PDFs
+render_memory_lock = threading.Lock()  # Serializes the accounted renders
+
+@contextmanager
+def render_memory(render: str):
+    """
+    Account the memory of a chart or PDF render: peak allocation above the starting point and bytes
+    still allocated at the end. Renders leaving pyplot figures open or retaining more than
+    MEMORY_LEAK_THRESHOLD_BYTES are counted as leaks, except the first one of each kind which fills
+    the font and glyph caches. Garbage is collected around each render, closed figures are reference
+    cycles that would otherwise show up as retained until the next collection
+    While enabled, renders running in worker threads are accounted one at a time
+    """
+    if not MEMORY_PROFILING:
+        yield
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    stack = render_memory_stack.__dict__.setdefault("records", [])
+    # tracemalloc counters are process wide: renders in other threads wait for the outermost one to finish
+    with render_memory_lock if not stack else nullcontext():
+        if stack:
+            # reset_peak() below discards the peak the outer render reached so far
+            stack[-1]["peak"] = max(stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+        gc.collect()
+        figures = len(plt.get_fignums())
+        current, _ = tracemalloc.get_traced_memory()
+        record = {"start": current, "peak": current}
+        tracemalloc.reset_peak()
+        stack.append(record)
+        try:
+            yield
+        finally:
+            stack.pop()
+            gc.collect()
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, record["peak"])
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            retained = current - record["start"]
+            open_figures = len(plt.get_fignums()) - figures
+            first_render = render not in render_peak_memory
+            observe_histogram(render_peak_memory, render, peak - record["start"], MEMORY_BUCKETS_BYTES)
+            reasons = (["figures"] if open_figures > 0 else []) + (["retained"] if retained > MEMORY_LEAK_THRESHOLD_BYTES and not first_render else [])
+            with metrics_lock:
+                render_retained_bytes[render] = retained
+                for reason in reasons:
+                    render_leaks[(render, reason)] = render_leaks.get((render, reason), 0) + 1
+            if reasons:
+                logging.warning(f"Possible leak in {render} render: {retained} bytes retained, {open_figures} pyplot figures left open")
+
+def format_labels(**labels) -> str:
+    """Prometheus label set"""
+    escaped = {name: str(value).replace('\\', '\\\\').replace('"', '\\"') for name, value in labels.items()}
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+def format_histogram(name: str, histograms: Dict[Any, List[float]], label_names: List[str],
+                     buckets: Tuple[float, ...] = METRICS_LATENCY_BUCKETS) -> List[str]:
+    """Prometheus text lines of a histogram family"""
+    lines = []
+    for labels, histogram in sorted(histograms.items()):
+        labels = dict(zip(label_names, labels if isinstance(labels, tuple) else (labels,)))
+        for bound, count in zip(buckets, histogram):
+            lines.append(f"{name}_bucket{format_labels(**labels, le=bound)} {count:g}")
+        lines.append(f"{name}_bucket{format_labels(**labels, le='+Inf')} {histogram[-1]:g}")
+        lines.append(f"{name}_sum{format_labels(**labels)} {histogram[-2]:.6f}")
+        lines.append(f"{name}_count{format_labels(**labels)} {histogram[-1]:g}")
+    return lines
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    with metrics_lock:
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by route",
+            "# TYPE http_request_duration_seconds histogram",
+            *format_histogram("http_request_duration_seconds", request_latency, ["method", "route", "status"]),
+            "# HELP pipeline_stage_duration_seconds Time spent in each stage of the calculation and report pipeline",
+            "# TYPE pipeline_stage_duration_seconds histogram",
+            *format_histogram("pipeline_stage_duration_seconds", stage_latency, ["stage"]),
+            "# HELP cache_lookups_total Cache lookups by result (memory, mongo, stale, miss)",
+            "# TYPE cache_lookups_total counter",
+            *[f"cache_lookups_total{format_labels(cache=cache, result=result)} {count}"
+              for (cache, result), count in sorted(cache_lookups.items())],
+            "# HELP cache_hit_ratio Share of lookups served from memory or Mongo",
+            "# TYPE cache_hit_ratio gauge"
+        ]
+        for cache in sorted({cache for cache, _ in cache_lookups}):
+            total = sum(count for (name, _), count in cache_lookups.items() if name == cache)
+            hits = sum(cache_lookups.get((cache, result), 0) for result in CACHE_HIT_RESULTS)
+            lines.append(f"cache_hit_ratio{format_labels(cache=cache)} {hits / total:.4f}")
+        lines += [
+            "# HELP upstream_in_flight External calls in progress",
+            "# TYPE upstream_in_flight gauge",
+            *[f"upstream_in_flight{format_labels(provider=provider)} {count}" for provider, count in sorted(upstream_in_flight.items())],
+            "# HELP upstream_calls_total External calls by outcome",
+            "# TYPE upstream_calls_total counter",
+            *[f"upstream_calls_total{format_labels(provider=provider, outcome=outcome)} {count}"
+              for (provider, outcome), count in sorted(upstream_calls.items())],
+            "# HELP pyplot_open_figures Matplotlib figures still open in this worker",
+            "# TYPE pyplot_open_figures gauge",
+            f"pyplot_open_figures {len(plt.get_fignums())}"
+        ]
+        if MEMORY_PROFILING:
+            lines += [
+                "# HELP render_peak_memory_bytes Peak allocation of each chart and PDF render (tracemalloc)",
+                "# TYPE render_peak_memory_bytes histogram",
+                *format_histogram("render_peak_memory_bytes", render_peak_memory, ["render"], MEMORY_BUCKETS_BYTES),
+                "# HELP render_retained_bytes Bytes still allocated after the last render",
+                "# TYPE render_retained_bytes gauge",
+                *[f"render_retained_bytes{format_labels(render=render)} {retained}" for render, retained in sorted(render_retained_bytes.items())],
+                "# HELP render_leaks_total Renders leaving pyplot figures open or retaining memory",
+                "# TYPE render_leaks_total counter",
+                *[f"render_leaks_total{format_labels(render=render, reason=reason)} {count}"
+                  for (render, reason), count in sorted(render_leaks.items())],
+                "# HELP tracemalloc_traced_bytes Memory currently allocated by Python objects",
+                "# TYPE tracemalloc_traced_bytes gauge",
+                f"tracemalloc_traced_bytes {tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0}"
+            ]
+    return "\n".join(lines) + "\n"
+
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    """
+    Request latency by route template (so that ids do not explode the label set) and request trace
+    The request ID is taken from X-Request-ID when given and returned in the response
+    """
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    root = {"name": "request", "started": time.perf_counter(), "attributes": {}, "children": []}
+    token = current_span.set(root) if TRACING_ENABLED else None
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        response.headers["X-Request-ID"] = request_id
+        if TRACING_ENABLED and SERVER_TIMING_HEADER:
+            root["duration"] = time.perf_counter() - root["started"]
+            response.headers["Server-Timing"] = server_timing(root)
+        return response
+    finally:
+        root["duration"] = time.perf_counter() - root["started"]
+        route = request.scope.get("route")
+        route_path = route.path if route else "unmatched"
+        observe_histogram(request_latency, (request.method, route_path, status), root["duration"])
+        if token is not None:
+            current_span.reset(token)
+            if root["duration"] * 1000 >= TRACE_LOG_MIN_DURATION_MS:
+                trace_logger.info(json.dumps({
+                    "request_id": request_id,
+                    "method": request.method,
+                    "route": route_path,
+                    "path": request.url.path,
+                    "status": int(status),
+                    "duration_ms": round(root["duration"] * 1000, 2),
+                    "spans": [serialize_span(child, root["started"]) for child in root["children"]]
+                }))
+
 # Define Models for Solar Calculator
+class RoofSection(BaseModel):
+    name: Optional[str] = None
+    surface: float  # Usable surface for panels (m²)
+    tilt: float = 35  # Degrees from horizontal
+    aspect: float = 0  # PVGIS convention: 0 = south, -90 = east, 90 = west
+
 class ClientInfo(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     # Personal Info
@@ -60,6 +376,9 @@ class ClientInfo(BaseModel):
     roof_surface: float
     roof_orientation: str
     velux_count: int
+    roof_sections: Optional[List[RoofSection]] = None  # Split roofs, replaces surface/orientation when set
+    roof_aspect: Optional[float] = None  # Precise azimuth (PVGIS convention), overrides roof_orientation
+    roof_tilt: Optional[float] = None  # Precise tilt in degrees, defaults to PANEL_TILT
     
     # Heating System
     heating_system: str
@@ -76,6 +395,9 @@ class ClientInfo(BaseModel):
     # Location data from geocoding
     latitude: Optional[float] = None
     longitude: Optional[float] = None
+    geocode_provider: Optional[str] = None  # geocode.maps.co, gazetteer, gazetteer_fallback, fallback_city or default_paris
+    geocode_key: Optional[str] = None  # Normalized address, key of the geocode cache
+    geocode_status: Optional[str] = None  # pending, done or failed with deferred geocoding
     
     # Calculation Results
     recommended_kit_power: Optional[int] = None
@@ -92,6 +414,9 @@ class ClientInfoCreate(BaseModel):
     roof_surface: float
     roof_orientation: str
     velux_count: int
+    roof_sections: Optional[List[RoofSection]] = None
+    roof_aspect: Optional[float] = None
+    roof_tilt: Optional[float] = None
     heating_system: str
     water_heating_system: str
     water_heating_capacity: Optional[int] = None
@@ -100,6 +425,7 @@ class ClientInfoCreate(BaseModel):
     annual_edf_payment: float
 
 class SolarCalculation(BaseModel):
+    calculation_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     client_id: str
     kit_power: int
     panel_count: int
@@ -467,6 +793,10 @@ ANNUAL_RATE_INCREASE = 0.05  # 5% per year
 SURPLUS_SALE_RATE = 0.076  # €/kWh for surplus sold to EDF (particuliers)
 SURPLUS_SALE_RATE_PROFESSIONNELS = 0.0761  # €/kWh for surplus sold to EDF (professionnels)
 
+# Credit rates
+TAEG_CREDIT = 0.0496  # 4.96% TAEG
+TAEG_CREDIT_WITH_AIDS = 0.0325  # 3.25% TAEG (taux réduit avec aides)
+
 # Autoconsumption rates
 AUTOCONSUMPTION_RATE_PARTICULIERS = 0.95  # 95% autoconsommation
 AUTOCONSUMPTION_RATE_PROFESSIONNELS = 0.80  # 80% autoconsommation
@@ -489,11 +819,291 @@ ORIENTATION_ASPECTS = {
     "Ouest": 90
 }
 
-async def geocode_address(address: str) -> Tuple[float, float]:
+# Approximate coordinates of major French cities, used as geocoding fallback
+FALLBACK_CITY_COORDINATES = {
+    "paris": (48.8566, 2.3522),
+    "marseille": (43.2965, 5.3698),
+    "lyon": (45.7640, 4.8357),
+    "toulouse": (43.6047, 1.4442),
+    "nice": (43.7102, 7.2620),
+    "nantes": (47.2184, -1.5536),
+    "strasbourg": (48.5734, 7.7521),
+    "montpellier": (43.6110, 3.8767),
+    "bordeaux": (44.8378, -0.5792),
+    "lille": (50.6292, 3.0573)
+}
+
+def normalize_text(text: str) -> str:
+    """Lowercase ASCII text without accents or punctuation, words separated by single spaces"""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+# Offline gazetteer: memory-mapped index of French communes and postcodes with their centroids
+# Built with: python server.py build-gazetteer <La Poste base officielle des codes postaux CSV>
+GAZETTEER_DIR = Path(os.environ.get('GAZETTEER_DIR', ROOT_DIR / 'data' / 'gazetteer'))
+GAZETTEER_FIRST = os.environ.get('GAZETTEER_FIRST', '1') == '1'  # Resolve confident matches before the provider
+GAZETTEER_MIN_SCORE = 0.45  # Trigram similarity below which fuzzy matches are rejected
+GAZETTEER_ARRAYS = [
+    "names", "name_offsets", "labels", "label_offsets", "latitude", "longitude",
+    "postcodes", "postcode_communes", "trigram_keys", "trigram_offsets", "trigram_postings", "trigram_counts"
+]
+GAZETTEER_ABBREVIATIONS = {"st": "saint", "ste": "sainte", "s": "sur"}
+TRIGRAM_ALPHABET = {char: code for code, char in enumerate(" abcdefghijklmnopqrstuvwxyz0123456789")}
+
+gazetteer: Optional[Dict[str, np.ndarray]] = None
+gazetteer_checked = False  # A missing index is only reported once
+
+def normalize_commune_name(name: str) -> str:
+    """Normalized commune name used as gazetteer key, common abbreviations expanded"""
+    return " ".join(GAZETTEER_ABBREVIATIONS.get(word, word) for word in normalize_text(name).split())
+
+def name_trigrams(name: str) -> np.ndarray:
+    """Distinct trigram codes of a normalized name, padded like pg_trgm"""
+    padded = f"  {name} "
+    codes = {
+        TRIGRAM_ALPHABET[padded[i]] * 1369 + TRIGRAM_ALPHABET[padded[i + 1]] * 37 + TRIGRAM_ALPHABET[padded[i + 2]]
+        for i in range(len(padded) - 2)
+    }
+    return np.array(sorted(codes), dtype=np.int32)
+
+def build_gazetteer(source_path: Path, target_dir: Path = GAZETTEER_DIR) -> Dict[str, Any]:
+    """
+    Build the gazetteer index from the La Poste postcode CSV (semicolon separated)
+    Reads the commune, postcode and coordinates columns (coordonnees_gps or latitude / longitude),
+    communes are keyed by INSEE code and their coordinates averaged over postcodes
+    """
+    global gazetteer, gazetteer_checked
+    communes: Dict[str, Dict[str, Any]] = {}
+    with open(source_path, newline='', encoding='utf-8-sig') as source:
+        reader = csv.DictReader(source, delimiter=';')
+        for row in reader:
+            row = {key.strip().lower(): (value or "").strip() for key, value in row.items() if key}
+            name = row.get('nom_de_la_commune') or row.get('nom_commune') or row.get('libelle_d_acheminement')
+            postcode = row.get('code_postal', '')
+            if row.get('coordonnees_gps'):
+                coordinates = row['coordonnees_gps'].split(',')
+            else:
+                coordinates = [row.get('latitude', ''), row.get('longitude', '')]
+            try:
+                lat, lon = float(coordinates[0]), float(coordinates[1])
+            except (ValueError, IndexError):
+                continue
+            if not name or not postcode.isdigit():
+                continue
+            commune = communes.setdefault(row.get('code_commune_insee') or f"{name}:{postcode}", {
+                "name": normalize_commune_name(name), "label": name.title(), "coordinates": [], "postcodes": set()
+            })
+            commune["coordinates"].append((lat, lon))
+            commune["postcodes"].add(int(postcode))
+    
+    # Communes sorted by normalized name so that exact and prefix lookups are binary searches
+    ordered = sorted(communes.values(), key=lambda commune: commune["name"])
+    names = [commune["name"].encode('ascii') for commune in ordered]
+    labels = [commune["label"].encode('utf-8') for commune in ordered]
+    coordinates = np.array([np.mean(commune["coordinates"], axis=0) for commune in ordered], dtype=np.float64)
+    
+    postcode_pairs = sorted((postcode, index) for index, commune in enumerate(ordered) for postcode in commune["postcodes"])
+    trigram_pairs = sorted(
+        (int(code), index) for index, commune in enumerate(ordered) for code in name_trigrams(commune["name"])
+    )
+    trigram_codes = np.array([code for code, _ in trigram_pairs], dtype=np.int32)
+    trigram_keys, trigram_starts = np.unique(trigram_codes, return_index=True)
+    
+    arrays = {
+        "names": np.frombuffer(b"".join(names), dtype=np.uint8),
+        "name_offsets": np.concatenate(([0], np.cumsum([len(name) for name in names]))).astype(np.int64),
+        "labels": np.frombuffer(b"".join(labels), dtype=np.uint8),
+        "label_offsets": np.concatenate(([0], np.cumsum([len(label) for label in labels]))).astype(np.int64),
+        "latitude": coordinates[:, 0].astype(np.float32),
+        "longitude": coordinates[:, 1].astype(np.float32),
+        "postcodes": np.array([postcode for postcode, _ in postcode_pairs], dtype=np.int32),
+        "postcode_communes": np.array([index for _, index in postcode_pairs], dtype=np.int32),
+        "trigram_keys": trigram_keys.astype(np.int32),
+        "trigram_offsets": np.append(trigram_starts, len(trigram_codes)).astype(np.int64),
+        "trigram_postings": np.array([index for _, index in trigram_pairs], dtype=np.int32),
+        "trigram_counts": np.array([len(name_trigrams(commune["name"])) for commune in ordered], dtype=np.int16)
+    }
+    target_dir.mkdir(parents=True, exist_ok=True)
+    for array_name, array in arrays.items():
+        temporary_path = target_dir / f"{array_name}.npy.tmp"
+        with open(temporary_path, 'wb') as array_file:
+            np.save(array_file, array)
+        os.replace(temporary_path, target_dir / f"{array_name}.npy")
+    gazetteer, gazetteer_checked = None, False
+    
+    logging.info(f"Gazetteer written to {target_dir} ({len(ordered)} communes, {len(postcode_pairs)} postcodes)")
+    return {"path": str(target_dir), "communes": len(ordered), "postcodes": len(postcode_pairs)}
+
+def load_gazetteer() -> Optional[Dict[str, np.ndarray]]:
+    """
+    Memory-map the gazetteer arrays, None when the index has not been built
+    """
+    global gazetteer, gazetteer_checked
+    if gazetteer is None and not gazetteer_checked:
+        gazetteer_checked = True
+        try:
+            gazetteer = {name: np.load(GAZETTEER_DIR / f"{name}.npy", mmap_mode='r') for name in GAZETTEER_ARRAYS}
+        except FileNotFoundError:
+            logging.warning(f"Gazetteer not found in {GAZETTEER_DIR}, geocoding without it")
+    return gazetteer
+
+def gazetteer_name(index: int) -> str:
+    """Normalized name of a commune"""
+    offsets = gazetteer["name_offsets"]
+    return gazetteer["names"][offsets[index]:offsets[index + 1]].tobytes().decode('ascii')
+
+def gazetteer_commune(index: int) -> Dict[str, Any]:
+    """Commune of the gazetteer as a dict"""
+    offsets = gazetteer["label_offsets"]
+    return {
+        "commune": gazetteer["labels"][offsets[index]:offsets[index + 1]].tobytes().decode('utf-8'),
+        "latitude": float(gazetteer["latitude"][index]),
+        "longitude": float(gazetteer["longitude"][index])
+    }
+
+def gazetteer_name_position(name: str) -> int:
+    """First commune whose normalized name is not lower than name (binary search)"""
+    low, high = 0, len(gazetteer["name_offsets"]) - 1
+    while low < high:
+        middle = (low + high) // 2
+        if gazetteer_name(middle) < name:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+def gazetteer_lookup_commune(name: str) -> List[int]:
+    """Communes with exactly this name (homonyms included)"""
+    if not load_gazetteer():
+        return []
+    name = normalize_commune_name(name)
+    count = len(gazetteer["name_offsets"]) - 1
+    index = gazetteer_name_position(name)
+    matches = []
+    while index < count and gazetteer_name(index) == name:
+        matches.append(index)
+        index += 1
+    return matches
+
+def gazetteer_prefix(prefix: str, limit: int = 10) -> List[int]:
+    """Communes whose name starts with prefix, in alphabetical order"""
+    if not load_gazetteer():
+        return []
+    prefix = normalize_commune_name(prefix)
+    count = len(gazetteer["name_offsets"]) - 1
+    index = gazetteer_name_position(prefix)
+    matches = []
+    while index < count and len(matches) < limit and gazetteer_name(index).startswith(prefix):
+        matches.append(index)
+        index += 1
+    return matches
+
+def gazetteer_lookup_postcode(postcode: str) -> List[int]:
+    """Communes served by a postcode"""
+    if not load_gazetteer() or not postcode.isdigit():
+        return []
+    postcodes = gazetteer["postcodes"]
+    start, end = np.searchsorted(postcodes, int(postcode), side='left'), np.searchsorted(postcodes, int(postcode), side='right')
+    return gazetteer["postcode_communes"][start:end].tolist()
+
+def gazetteer_fuzzy(text: str, candidates: Optional[List[int]] = None, limit: int = 5) -> List[Tuple[int, float]]:
+    """
+    Communes ranked by trigram similarity with text (shared / union of trigrams)
+    candidates restricts the search, e.g. to the communes of a postcode
+    """
+    if not load_gazetteer():
+        return []
+    query = name_trigrams(normalize_commune_name(text))
+    keys = gazetteer["trigram_keys"]
+    positions = np.searchsorted(keys, query)
+    found = positions[(positions < len(keys)) & (keys[np.minimum(positions, len(keys) - 1)] == query)]
+    if len(found) == 0:
+        return []
+    offsets = gazetteer["trigram_offsets"]
+    postings = np.concatenate([gazetteer["trigram_postings"][offsets[position]:offsets[position + 1]] for position in found])
+    if candidates is not None:
+        postings = postings[np.isin(postings, candidates)]
+    communes, shared = np.unique(postings, return_counts=True)
+    scores = shared / (len(query) + gazetteer["trigram_counts"][communes] - shared)
+    best = np.argsort(-scores, kind="stable")[:limit]
+    return [(int(communes[index]), float(scores[index])) for index in best]
+
+def gazetteer_resolve(address: str) -> Optional[Dict[str, Any]]:
+    """
+    Resolve an address to a commune centroid with the gazetteer
+    confident is set for unambiguous matches: single commune of the postcode,
+    commune named in the address within its postcode, or unique commune name
+    """
+    if not load_gazetteer():
+        return None
+    key, postcode = normalize_address(address)
+    words = normalize_commune_name(key[len(postcode):] if postcode else key).split()
+    text = f" {' '.join(words)} "
+    
+    if postcode:
+        communes = gazetteer_lookup_postcode(postcode)
+        if len(communes) == 1:
+            return {**gazetteer_commune(communes[0]), "postcode": postcode, "confident": True}
+        named = [index for index in communes if f" {gazetteer_name(index)} " in text]
+        if named:
+            best = max(named, key=lambda index: len(gazetteer_name(index)))
+            return {**gazetteer_commune(best), "postcode": postcode, "confident": True}
+        if communes:
+            matches = gazetteer_fuzzy(" ".join(words[-4:]), communes, limit=1)
+            best = matches[0][0] if matches else communes[0]
+            return {**gazetteer_commune(best), "postcode": postcode, "confident": False}
+    
+    # Commune names are usually at the end of the address, longest names first
+    for length in range(min(5, len(words)), 0, -1):
+        matches = gazetteer_lookup_commune(" ".join(words[-length:]))
+        if matches:
+            return {**gazetteer_commune(matches[0]), "postcode": postcode, "confident": len(matches) == 1}
+    
+    # Misspelt names: best trigram match over the last words
+    matches = [match for length in range(1, min(3, len(words)) + 1) for match in gazetteer_fuzzy(" ".join(words[-length:]), limit=1)]
+    if matches:
+        best, score = max(matches, key=lambda match: match[1])
+        if score >= GAZETTEER_MIN_SCORE:
+            return {**gazetteer_commune(best), "postcode": postcode, "confident": False}
+    return None
+
+# Geocode cache: in-process LRU in front of the geocode_cache collection
+GEOCODE_CACHE_SIZE = 10000
+GEOCODE_FALLBACK_RETRY_HOURS = 24  # Fallback results are resolved again after this delay
+GEOCODE_PROVIDER = "geocode.maps.co"
+GEOCODE_GAZETTEER = "gazetteer"  # Confident commune match, as reliable as the provider for PVGIS
+GEOCODE_GAZETTEER_FALLBACK = "gazetteer_fallback"  # Ambiguous or fuzzy commune match
+GEOCODE_RELIABLE_PROVIDERS = [GEOCODE_PROVIDER, GEOCODE_GAZETTEER]
+GEOCODE_FALLBACK_CITY = "fallback_city"
+GEOCODE_DEFAULT = "default_paris"
+
+geocode_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+def normalize_address(address: str) -> Tuple[str, Optional[str]]:
+    """
+    Normalize an address for the geocode cache: lowercase, no accents, punctuation or extra spaces
+    The postcode is extracted and put first so that "1 rue X, Paris 75001" and "1 Rue X 75001 PARIS" match
+    Returns the cache key and the postcode
+    """
+    text = normalize_text(address)
+    postcode_match = re.search(r"\b\d{5}\b", text)
+    postcode = postcode_match.group(0) if postcode_match else None
+    if postcode:
+        text = text[:postcode_match.start()] + text[postcode_match.end():]
+    words = " ".join(text.split())
+    return (f"{postcode} {words}" if postcode else words), postcode
+
+async def geocode_with_provider(address: str) -> Dict[str, Any]:
     """
     Geocode an address to get latitude and longitude coordinates
-    Uses multiple fallback services for reliability
+    Uses multiple fallback services for reliability, the provider field tells which one answered
+    Confident gazetteer matches are used first, without network call
     """
+    local_match = gazetteer_resolve(address)
+    if GAZETTEER_FIRST and local_match and local_match['confident']:
+        return {"latitude": local_match['latitude'], "longitude": local_match['longitude'],
+                "provider": GEOCODE_GAZETTEER, "fallback_city": local_match['commune']}
+    
     try:
         # Try geocode.maps.co (free service that works in containers)
         geocode_url = "https://geocode.maps.co/search"
@@ -504,8 +1114,9 @@ async def geocode_address(address: str) -> Tuple[float, float]:
             "countrycode": "fr"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(geocode_url, params=geocode_params, timeout=10)
+        with stage_timer("geocode"), upstream_call("geocode.maps.co"):
+            async with httpx.AsyncClient() as client:
+                response = await client.get(geocode_url, params=geocode_params, timeout=10)
             if response.status_code == 200:
                 data = response.json()
                 if data and len(data) > 0:
@@ -513,36 +1124,252 @@ async def geocode_address(address: str) -> Tuple[float, float]:
                     lat = float(result["lat"])
                     lon = float(result["lon"])
                     logging.info(f"Geocoded address '{address}' to ({lat}, {lon}) using geocode.maps.co")
-                    return lat, lon
+                    return {"latitude": lat, "longitude": lon, "provider": GEOCODE_PROVIDER, "fallback_city": None}
     except Exception as e:
         logging.warning(f"Geocode.maps.co geocoding failed: {e}")
     
-    # Fallback: use approximate coordinates for major French cities
-    city_coordinates = {
-        "paris": (48.8566, 2.3522),
-        "marseille": (43.2965, 5.3698),
-        "lyon": (45.7640, 4.8357),
-        "toulouse": (43.6047, 1.4442),
-        "nice": (43.7102, 7.2620),
-        "nantes": (47.2184, -1.5536),
-        "strasbourg": (48.5734, 7.7521),
-        "montpellier": (43.6110, 3.8767),
-        "bordeaux": (44.8378, -0.5792),
-        "lille": (50.6292, 3.0573)
-    }
+    # Fallback: commune centroid from the gazetteer
+    if local_match:
+        logging.info(f"Using gazetteer coordinates for '{address}': {local_match['commune']}")
+        return {"latitude": local_match['latitude'], "longitude": local_match['longitude'],
+                "provider": GEOCODE_GAZETTEER if local_match['confident'] else GEOCODE_GAZETTEER_FALLBACK,
+                "fallback_city": local_match['commune']}
     
+    # Fallback: use approximate coordinates for major French cities
     address_lower = address.lower()
-    for city, coords in city_coordinates.items():
+    for city, coords in FALLBACK_CITY_COORDINATES.items():
         if city in address_lower:
             lat, lon = coords
             logging.info(f"Using fallback coordinates for '{address}': ({lat}, {lon})")
-            return lat, lon
+            return {"latitude": lat, "longitude": lon, "provider": GEOCODE_FALLBACK_CITY, "fallback_city": city}
     
     # Ultimate fallback: use Paris coordinates
     lat, lon = 48.8566, 2.3522
     logging.warning(f"Could not geocode '{address}', using Paris coordinates: ({lat}, {lon})")
-    return lat, lon
+    return {"latitude": lat, "longitude": lon, "provider": GEOCODE_DEFAULT, "fallback_city": None}
+
+def is_geocode_entry_fresh(entry: Dict[str, Any]) -> bool:
+    """Provider and confident gazetteer results are kept, fallback results are retried after GEOCODE_FALLBACK_RETRY_HOURS"""
+    return (entry['provider'] in GEOCODE_RELIABLE_PROVIDERS
+            or entry['resolved_at'] > datetime.utcnow() - timedelta(hours=GEOCODE_FALLBACK_RETRY_HOURS))
+
+def remember_geocode(key: str, entry: Dict[str, Any]):
+    """Add an entry to the in-process LRU"""
+    geocode_cache[key] = entry
+    geocode_cache.move_to_end(key)
+    if len(geocode_cache) > GEOCODE_CACHE_SIZE:
+        geocode_cache.popitem(last=False)
+
+@traced()
+async def resolve_address(address: str) -> Dict[str, Any]:
+    """
+    Geocode an address through the cache
+    Returns latitude, longitude, provider, fallback_city, key (normalized address) and cached
+    """
+    key, postcode = normalize_address(address)
+    
+    entry = geocode_cache.get(key)
+    if entry and is_geocode_entry_fresh(entry):
+        record_cache_lookup("geocode", "memory")
+        geocode_cache.move_to_end(key)
+        return {**entry, "cached": True}
+    
+    # The Mongo cache is an optimisation: when it fails the provider result is still returned
+    try:
+        entry = await timed("mongo_read", db.geocode_cache.find_one({"key": key}, {"_id": 0}))
+    except Exception as e:
+        logging.warning(f"Geocode cache read failed for {key}: {e}")
+        entry = None
+    if entry and is_geocode_entry_fresh(entry):
+        record_cache_lookup("geocode", "mongo")
+        remember_geocode(key, entry)
+        return {**entry, "cached": True}
+    
+    record_cache_lookup("geocode", "miss")
+    entry = {
+        **await geocode_with_provider(address),
+        "key": key,
+        "address": address,
+        "postcode": postcode,
+        "resolved_at": datetime.utcnow()
+    }
+    remember_geocode(key, entry)
+    try:
+        await db.geocode_cache.update_one({"key": key}, {"$set": entry}, upsert=True)
+    except Exception as e:
+        logging.warning(f"Geocode cache write failed for {key}: {e}")
+    return {**entry, "cached": False}
+
+@traced()
+async def geocode_address(address: str) -> Tuple[float, float]:
+    """
+    Geocode an address to get latitude and longitude coordinates, see resolve_address
+    """
+    result = await resolve_address(address)
+    return result['latitude'], result['longitude']
+
+# Deferred geocoding: clients are inserted first and located in the background
+# Off by default: POST /clients then returns the coordinates like before, callers opt in with ?deferred_geocoding=true
+DEFERRED_GEOCODING = os.environ.get('DEFERRED_GEOCODING', '0') == '1'
+GEOCODE_PENDING = "pending"
+GEOCODE_DONE = "done"
+GEOCODE_FAILED = "failed"
+
+client_geocode_tasks: Dict[str, asyncio.Task] = {}  # Running geocodings by client id
+geocode_resume_task: Optional[asyncio.Task] = None
+
+def client_location_fields(location: Dict[str, Any]) -> Dict[str, Any]:
+    """Client fields set from a resolve_address result"""
+    return {
+        "latitude": location['latitude'],
+        "longitude": location['longitude'],
+        "geocode_provider": location['provider'],
+        "geocode_key": location['key'],
+        "geocode_status": GEOCODE_DONE
+    }
+
+async def geocode_client(client_id: str, address: str) -> Optional[Dict[str, Any]]:
+    """
+    Geocode a stored client and save its location
+    Returns the location fields, None when geocoding failed (the client is marked failed)
+    """
+    try:
+        fields = client_location_fields(await resolve_address(address))
+        await db.clients.update_one({"id": client_id}, {"$set": fields, "$unset": {"geocode_error": ""}})
+        return fields
+    except Exception as e:
+        logging.error(f"Deferred geocoding of client {client_id} failed: {e}")
+        await db.clients.update_one({"id": client_id}, {"$set": {"geocode_status": GEOCODE_FAILED, "geocode_error": str(e)}})
+        return None
+
+def schedule_client_geocoding(client_id: str, address: str) -> asyncio.Task:
+    """Start the background geocoding of a client, or return the one already running"""
+    task = client_geocode_tasks.get(client_id)
+    if task is None:
+        task = asyncio.create_task(geocode_client(client_id, address))
+        client_geocode_tasks[client_id] = task
+        task.add_done_callback(lambda _: client_geocode_tasks.pop(client_id, None))
+    return task
+
+async def ensure_client_location(client: dict) -> dict:
+    """
+    Make sure a client document has coordinates, waiting for its deferred geocoding when needed
+    The document is updated in place and returned
+    """
+    if client.get('latitude') is not None and client.get('longitude') is not None:
+        return client
+    # Shielded so that a cancelled request does not cancel the geocoding shared with others
+    with stage_timer("geocode_wait"):
+        fields = await asyncio.shield(schedule_client_geocoding(client['id'], client['address']))
+    if fields is None:
+        raise HTTPException(status_code=503, detail="Client address could not be geocoded")
+    client.update(fields)
+    return client
+
+async def resume_pending_geocodings():
+    """Geocode the clients left pending by a previous process, one at a time"""
+    async for client in db.clients.find({"geocode_status": GEOCODE_PENDING}, {"id": 1, "address": 1}):
+        await schedule_client_geocoding(client['id'], client['address'])
+
+GEOCODE_RERESOLVE_MAX_LIMIT = 1000  # Entries per re-resolution call, each one is a provider request
+
+async def reresolve_geocode_fallbacks(limit: int = 100) -> Dict[str, int]:
+    """
+    Try the geocoding provider again for cached fallback results
+    Clients created from a corrected entry get the new coordinates
+    """
+    counts = {"checked": 0, "resolved": 0, "clients_updated": 0}
+    entries = await db.geocode_cache.find({"provider": {"$nin": GEOCODE_RELIABLE_PROVIDERS}}, {"_id": 0}).to_list(limit)
+    for entry in entries:
+        counts["checked"] += 1
+        result = await geocode_with_provider(entry['address'])
+        entry = {**entry, **result, "resolved_at": datetime.utcnow()}
+        await db.geocode_cache.update_one({"key": entry['key']}, {"$set": entry})
+        remember_geocode(entry['key'], entry)
+        if result['provider'] not in GEOCODE_RELIABLE_PROVIDERS:
+            continue
+        counts["resolved"] += 1
+        update = await db.clients.update_many(
+            {"geocode_key": entry['key'], "geocode_provider": {"$nin": GEOCODE_RELIABLE_PROVIDERS}},
+            {"$set": {"latitude": result['latitude'], "longitude": result['longitude'], "geocode_provider": result['provider']}}
+        )
+        counts["clients_updated"] += update.modified_count
+    return counts
+
+# PVGIS resilience: per-call timeout, capped exponential retries and circuit breaker
+PVGIS_TIMEOUT_SECONDS = float(os.environ.get('PVGIS_TIMEOUT_SECONDS', 8))  # Per attempt
+PVGIS_TOTAL_BUDGET_SECONDS = float(os.environ.get('PVGIS_TOTAL_BUDGET_SECONDS', 15))  # All attempts included
+PVGIS_MAX_RETRIES = int(os.environ.get('PVGIS_MAX_RETRIES', 2))
+PVGIS_RETRY_BASE_DELAY_SECONDS = 0.5
+PVGIS_RETRY_MAX_DELAY_SECONDS = 4
+PVGIS_BREAKER_FAILURE_THRESHOLD = 5  # Consecutive failed calls before opening the circuit
+PVGIS_BREAKER_RESET_SECONDS = 60  # Open duration before a probe call is let through
+
+pvgis_breaker = {"failures": 0, "opened_until": 0.0}
+
+def pvgis_circuit_open() -> bool:
+    """
+    Whether PVGIS calls should be short-circuited
+    Once the open period is over a single probe call goes through, the others stay short-circuited
+    """
+    if pvgis_breaker["failures"] < PVGIS_BREAKER_FAILURE_THRESHOLD:
+        return False
+    now = time.monotonic()
+    if now < pvgis_breaker["opened_until"]:
+        return True
+    pvgis_breaker["opened_until"] = now + PVGIS_BREAKER_RESET_SECONDS
+    return False
+
+def record_pvgis_result(success: bool):
+    """Update the circuit breaker after a PVGIS call"""
+    if success:
+        if pvgis_breaker["failures"] >= PVGIS_BREAKER_FAILURE_THRESHOLD:
+            logging.info("PVGIS circuit closed")
+        pvgis_breaker.update(failures=0, opened_until=0.0)
+        return
+    pvgis_breaker["failures"] += 1
+    if pvgis_breaker["failures"] == PVGIS_BREAKER_FAILURE_THRESHOLD:
+        pvgis_breaker["opened_until"] = time.monotonic() + PVGIS_BREAKER_RESET_SECONDS
+        logging.warning(f"PVGIS circuit opened for {PVGIS_BREAKER_RESET_SECONDS}s")
+
+async def pvgis_request(endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    GET a PVGIS endpoint and return its JSON
+    Timeouts, connection errors, 429 and 5xx are retried with capped exponential backoff
+    within PVGIS_TOTAL_BUDGET_SECONDS, other errors are raised right away
+    """
+    if pvgis_circuit_open():
+        raise HTTPException(status_code=503, detail="PVGIS unavailable (circuit open)")
+    
+    deadline = time.monotonic() + PVGIS_TOTAL_BUDGET_SECONDS
+    error = None
+    for attempt in range(PVGIS_MAX_RETRIES + 1):
+        timeout = min(PVGIS_TIMEOUT_SECONDS, deadline - time.monotonic())
+        if timeout <= 0:
+            break
+        try:
+            with stage_timer("pvgis"), upstream_call("pvgis"):
+                async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+                    async with session.get(f"{PVGIS_BASE_URL}/{endpoint}", params=params) as response:
+                        if response.status == 200:
+                            data = await response.json()
+                            record_pvgis_result(True)
+                            return data
+                        if response.status < 500 and response.status != 429:
+                            # Invalid request, retrying would not help and PVGIS itself is up
+                            raise HTTPException(status_code=500, detail=f"PVGIS API error: {response.status}")
+                        error = f"PVGIS API error: {response.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = f"{type(e).__name__}: {e}"
+        
+        if attempt < PVGIS_MAX_RETRIES:
+            delay = min(PVGIS_RETRY_MAX_DELAY_SECONDS, PVGIS_RETRY_BASE_DELAY_SECONDS * 2 ** attempt)
+            await asyncio.sleep(min(delay * random.uniform(0.5, 1), max(0, deadline - time.monotonic())))
+    
+    record_pvgis_result(False)
+    raise HTTPException(status_code=503, detail=f"PVGIS unavailable: {error or 'time budget exceeded'}")
 
+@traced()
 async def get_pvgis_data(lat: float, lon: float, orientation: str, kit_power: int) -> Dict[str, Any]:
     """
     Get solar production data from PVGIS API
@@ -565,146 +1392,1186 @@ async def get_pvgis_data(lat: float, lon: float, orientation: str, kit_power: in
             "browser": 0
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{PVGIS_BASE_URL}/PVcalc", params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    
-                    # Extract relevant data
-                    outputs = data.get("outputs", {})
-                    totals = outputs.get("totals", {})
-                    monthly = outputs.get("monthly", [])
-                    
-                    return {
-                        "annual_production": totals.get("fixed", {}).get("E_y", 0),  # kWh/year
-                        "monthly_data": monthly,
-                        "specific_production": totals.get("fixed", {}).get("E_y", 0) / kit_power if kit_power > 0 else 0,  # kWh/kW/year
-                        "raw_pvgis_data": data
-                    }
-                else:
-                    raise HTTPException(status_code=500, detail=f"PVGIS API error: {response.status}")
-                    
+        data = await pvgis_request("PVcalc", params)
+        
+        # Extract relevant data
+        outputs = data.get("outputs", {})
+        totals = outputs.get("totals", {})
+        monthly = outputs.get("monthly", [])
+        
+        return {
+            "annual_production": totals.get("fixed", {}).get("E_y", 0),  # kWh/year
+            "monthly_data": monthly,
+            "specific_production": totals.get("fixed", {}).get("E_y", 0) / kit_power if kit_power > 0 else 0,  # kWh/kW/year
+            "raw_pvgis_data": data
+        }
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"PVGIS API error: {e}")
         raise HTTPException(status_code=500, detail=f"Error fetching PVGIS data: {str(e)}")
 
-def get_solar_kits_by_mode(client_mode: str = "particuliers"):
+# Hourly production profiles (PVGIS seriescalc)
+HOURS_PER_YEAR = 8760
+PVGIS_SERIES_YEAR = 2019  # Reference year for hourly series (not a leap year)
+PANEL_TILT = 35  # Optimal tilt angle for France
+SYSTEM_LOSS = 14  # 14% system losses (standard)
+PRODUCTION_CACHE_TTL_DAYS = 90  # PVGIS radiation databases change rarely
+
+# Arbitrary aspect / tilt values are interpolated between cached grid nodes
+YIELD_GRID_ASPECT_STEP = 15  # Degrees, the named orientations are grid nodes
+YIELD_GRID_TILT_STEP = 5  # Degrees, PANEL_TILT is a grid node
+
+# Calendar helpers shared by the hourly simulations
+# Hourly arrays hold the 8760 hours of a non-leap year in local civil time (wall clock, DST included):
+# load profiles are built that way, PVGIS series (UTC) and the synthetic model (solar time) are converted
+DAYS_PER_MONTH = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+HOUR_OF_DAY = np.arange(HOURS_PER_YEAR) % 24
+DAY_OF_YEAR = np.arange(HOURS_PER_YEAR) // 24
+MONTH_START_HOURS = np.concatenate(([0], np.cumsum(DAYS_PER_MONTH)[:-1])) * 24
+LOCAL_TIMEZONE = os.environ.get('LOCAL_TIMEZONE', 'Europe/Paris')
+
+def civil_hour_slots(year: int = PVGIS_SERIES_YEAR, tz_name: str = LOCAL_TIMEZONE) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Get solar kits based on client mode
+    Local civil hour slot (0-8759) of every UTC hour of a year, and the UTC offset (hours) of every civil slot
+    The last UTC hours of the year fall on the next local new year and wrap to the first slots
+    Slots skipped by the spring DST change get no UTC hour, the repeated autumn hour gets two
     """
-    if client_mode == "professionnels":
-        return SOLAR_KITS_PROFESSIONNELS
-    else:
-        return SOLAR_KITS_PARTICULIERS
+    tz = ZoneInfo(tz_name)
+    start = datetime(year, 1, 1, tzinfo=timezone.utc)
+    slots = np.empty(HOURS_PER_YEAR, dtype=np.int64)
+    for hour in range(HOURS_PER_YEAR):
+        local = (start + timedelta(hours=hour)).astimezone(tz)
+        slots[hour] = ((local.timetuple().tm_yday - 1) * 24 + local.hour) % HOURS_PER_YEAR
+    offsets = np.array([
+        (datetime(year, 1, 1) + timedelta(hours=hour)).replace(tzinfo=tz).utcoffset().total_seconds() / 3600
+        for hour in range(HOURS_PER_YEAR)
+    ])
+    return slots, offsets
 
-def get_professional_kit_price(kit_info: dict, price_level: str = "base") -> float:
+UTC_CIVIL_SLOTS, CIVIL_UTC_OFFSETS = civil_hour_slots()
+
+def utc_to_civil_profile(profile: np.ndarray) -> np.ndarray:
     """
-    Get professional kit price based on price level
-    price_level: "base", "remise", "remise_max"
+    Move an hourly series indexed by UTC hours onto local civil hours, keeping its total
     """
-    if price_level == "remise":
-        return kit_info.get('tarif_remise_ht', kit_info.get('tarif_base_ht', 0))
-    elif price_level == "remise_max":
-        return kit_info.get('tarif_remise_max_ht', kit_info.get('tarif_base_ht', 0))
-    else:  # base
-        return kit_info.get('tarif_base_ht', 0)
+    civil = np.zeros(HOURS_PER_YEAR)
+    np.add.at(civil, UTC_CIVIL_SLOTS, profile)
+    return civil
 
-def get_professional_commission(kit_info: dict, price_level: str = "base") -> float:
+# Share of the annual consumption used for heating and hot water, by system
+HEATING_LOAD_SHARES = {
+    "Radiateurs électriques": 0.45,
+    "Chaudière électrique": 0.45,
+    "Pompe à chaleur Air-Air": 0.30,
+    "Pompe à chaleur Air-Eau": 0.30
+}
+WATER_HEATING_LOAD_SHARES = {
+    "Ballon électrique standard": 0.15,
+    "Ballon thermodynamique": 0.06
+}
+
+# Typical household consumption shape over a day (0h-23h)
+BASE_LOAD_DAILY_SHAPE = np.array([
+    0.55, 0.50, 0.48, 0.47, 0.48, 0.55, 0.80, 1.10, 1.05, 0.90, 0.85, 0.90,
+    1.00, 0.95, 0.85, 0.80, 0.85, 1.05, 1.35, 1.50, 1.45, 1.25, 0.95, 0.70
+])
+# Heating runs mostly in the morning and the evening
+HEATING_DAILY_SHAPE = np.array([
+    0.70, 0.65, 0.65, 0.65, 0.70, 0.90, 1.30, 1.40, 1.20, 1.00, 0.90, 0.85,
+    0.85, 0.85, 0.85, 0.90, 1.00, 1.20, 1.35, 1.40, 1.35, 1.20, 1.00, 0.80
+])
+# Water heaters are switched on during off-peak hours (heures creuses 22h-6h)
+WATER_HEATING_DAILY_SHAPE = np.where((HOUR_OF_DAY[:24] >= 22) | (HOUR_OF_DAY[:24] < 6), 1.0, 0.0)
+
+production_profile_cache: Dict[str, np.ndarray] = {}  # In-process cache of 1 kWp hourly profiles
+production_yield_cache: Dict[str, np.ndarray] = {}  # In-process cache of 1 kWp monthly yields (grid nodes)
+
+# Production lookups are snapped to a lat/lon grid so that neighbouring clients share cache entries
+PRODUCTION_GRID_CELL_DEGREES = float(os.environ.get('PRODUCTION_GRID_CELL_DEGREES', 0.05))  # ~5.5 x 3.8 km, 0 disables
+PRODUCTION_GRID_TOLERANCE_PERCENT = float(os.environ.get('PRODUCTION_GRID_TOLERANCE_PERCENT', 0.5))  # Accepted yield error
+KM_PER_DEGREE_LATITUDE = 111.2
+PRODUCTION_GRID_REPORT_MAX_SAMPLE = 50000  # Clients (and cached yields) read by one report
+
+def snap_to_production_cell(lat: float, lon: float, cell_degrees: Optional[float] = None) -> Tuple[float, float]:
     """
-    Get professional commission based on price level
+    Centre of the production grid cell containing a site
     """
-    if price_level == "remise_max":
-        return kit_info.get('commission_remise_max', kit_info.get('commission_normale', 0))
-    else:  # base or remise
-        return kit_info.get('commission_normale', 0)
+    cell = PRODUCTION_GRID_CELL_DEGREES if cell_degrees is None else cell_degrees
+    if cell <= 0:
+        return lat, lon
+    return round((np.floor(lat / cell) + 0.5) * cell, 4), round((np.floor(lon / cell) + 0.5) * cell, 4)
 
-def get_aids_by_mode(client_mode: str = "particuliers"):
+def production_profile_key(lat: float, lon: float, aspect: float, angle: float = PANEL_TILT) -> str:
     """
-    Get aids configuration based on client mode
+    Cache key for a 1 kWp hourly production profile
     """
-    if client_mode == "professionnels":
-        return {
-            "autoconsumption_aid_rate": AUTOCONSUMPTION_AID_PROFESSIONNELS,
-            "tva_rate": TVA_RATE_PROFESSIONNELS,
-            "amortissement_accelere": AMORTISSEMENT_ACCELERE,
-            "autoconsumption_rate": AUTOCONSUMPTION_RATE_PROFESSIONNELS,
-            "edf_rate": EDF_RATE_PER_KWH_PROFESSIONNELS,
-            "surplus_sale_rate": SURPLUS_SALE_RATE_PROFESSIONNELS
-        }
-    else:
-        return {
-            "autoconsumption_aid_rate": AUTOCONSUMPTION_AID_PARTICULIERS,
-            "tva_rate": TVA_RATE_PARTICULIERS,
-            "amortissement_accelere": 0,
-            "autoconsumption_rate": AUTOCONSUMPTION_RATE_PARTICULIERS,
-            "edf_rate": EDF_RATE_PER_KWH,
-            "surplus_sale_rate": SURPLUS_SALE_RATE
-        }
+    return f"{lat:.4f}:{lon:.4f}:{aspect:g}:{angle:g}"
 
-def calculate_optimal_kit_size(annual_consumption: float, roof_surface: float, client_mode: str = "particuliers") -> int:
+def synthetic_hourly_profile(lat: float, aspect: float, angle: float = PANEL_TILT, lon: Optional[float] = None) -> np.ndarray:
     """
-    Calculate optimal kit size based on consumption and roof space
+    Local stand-in for PVGIS: hourly production of 1 kWp (kWh) from solar geometry
+    Used when PVGIS is unreachable, scaled on typical French specific yields
+    Hours are local civil time when lon is given, solar time otherwise (enough for monthly or annual sums)
     """
-    # Each panel is 2.1 m² and 0.5 kW
-    max_panels_by_surface = int(roof_surface / 2.1)
-    max_power_by_surface = max_panels_by_surface * 0.5
+    day = DAY_OF_YEAR + 1
+    hour = HOUR_OF_DAY + 0.5  # Middle of the hour
+    if lon is not None:
+        # Civil -> solar time: UTC offset, longitude and equation of time (minutes)
+        b = 2 * np.pi * (day - 81) / 364
+        equation_of_time = 9.87 * np.sin(2 * b) - 7.53 * np.cos(b) - 1.5 * np.sin(b)
+        hour = hour - CIVIL_UTC_OFFSETS + lon / 15 + equation_of_time / 60
     
-    # Target 80-100% of annual consumption
-    target_power_by_consumption = annual_consumption / 1200  # Assuming ~1200 kWh/kW/year in France
+    declination = np.radians(23.45) * np.sin(2 * np.pi * (284 + day) / 365)
+    hour_angle = np.radians(15 * (hour - 12))
+    phi = np.radians(lat)
     
-    # Choose the limiting factor
-    target_power = min(max_power_by_surface, target_power_by_consumption * 1.1)  # 110% buffer
+    # Sun direction in (east, north, up) coordinates
+    sun_east = -np.cos(declination) * np.sin(hour_angle)
+    sun_north = np.cos(phi) * np.sin(declination) - np.sin(phi) * np.cos(declination) * np.cos(hour_angle)
+    sun_up = np.sin(phi) * np.sin(declination) + np.cos(phi) * np.cos(declination) * np.cos(hour_angle)
+    daylight = sun_up > 0.02
     
-    # Find the closest available kit based on client mode
-    available_kits = get_solar_kits_by_mode(client_mode)
-    available_powers = list(available_kits.keys())
-    best_power = min(available_powers, key=lambda x: abs(x - target_power))
+    # Clear sky beam irradiance with a simple air mass model (W/m²)
+    air_mass = 1 / np.where(daylight, sun_up, 1)
+    beam = np.where(daylight, 1000 * 0.7 ** (air_mass ** 0.678), 0)
     
-    return best_power
+    # Seasonal cloudiness, France gets far less sun in winter
+    clearness = 0.55 - 0.15 * np.cos(2 * np.pi * (day - 15) / 365)
+    
+    def plane_of_array(plane_aspect: float) -> np.ndarray:
+        tilt = np.radians(angle)
+        azimuth = np.radians(plane_aspect)  # PVGIS convention: 0 = south, -90 = east, 90 = west
+        normal_east = -np.sin(tilt) * np.sin(azimuth)
+        normal_north = -np.sin(tilt) * np.cos(azimuth)
+        normal_up = np.cos(tilt)
+        incidence = np.clip(sun_east * normal_east + sun_north * normal_north + sun_up * normal_up, 0, None)
+        diffuse = 0.12 * beam * sun_up * (1 + np.cos(tilt)) / 2
+        return clearness * (beam * incidence + diffuse)
+    
+    # Scale so that a south facing roof matches the typical yield at this latitude
+    south = plane_of_array(0)
+    specific_yield_south = 1050 + (50 - lat) * 57  # kWh/kWp/year, ~1050 in Lille, ~1450 in Marseille
+    return plane_of_array(aspect) * specific_yield_south / south.sum()
 
-def calculate_financing_options(kit_price: float, monthly_savings: float) -> List[Dict]:
+async def fetch_pvgis_hourly_profile(lat: float, lon: float, aspect: float, angle: float = PANEL_TILT) -> np.ndarray:
     """
-    Calculate financing options from 6 to 15 years
+    Get the hourly production of 1 kWp (kWh) from the PVGIS seriescalc API
+    PVGIS timestamps are UTC, the series is returned in local civil time like the load profiles
     """
-    taeg = 0.0496  # 4.96% TAEG
-    monthly_rate = taeg / 12
-    options = []
+    params = {
+        "lat": lat,
+        "lon": lon,
+        "peakpower": 1,  # kW, profiles are scaled by the kit power
+        "loss": SYSTEM_LOSS,
+        "angle": angle,
+        "aspect": aspect,
+        "pvcalculation": 1,
+        "pvtechchoice": "crystSi",
+        "mountingplace": "building",
+        "startyear": PVGIS_SERIES_YEAR,
+        "endyear": PVGIS_SERIES_YEAR,
+        "outputformat": "json",
+        "browser": 0
+    }
     
-    for years in range(6, 16):  # 6 to 15 years
-        months = years * 12
-        
-        if monthly_rate > 0:
-            # Standard loan calculation
-            monthly_payment = kit_price * (monthly_rate * (1 + monthly_rate)**months) / ((1 + monthly_rate)**months - 1)
-        else:
-            monthly_payment = kit_price / months
-        
-        # Calculate if it's close to the monthly savings
-        savings_ratio = monthly_payment / monthly_savings if monthly_savings > 0 else float('inf')
-        
-        options.append({
-            "duration_years": years,
-            "duration_months": months,
-            "monthly_payment": round(monthly_payment, 2),
-            "savings_ratio": round(savings_ratio, 2),
-            "difference_vs_savings": round(monthly_payment - monthly_savings, 2)
-        })
+    data = await pvgis_request("seriescalc", params)
     
-    return options
+    hourly = data.get("outputs", {}).get("hourly", [])
+    profile = np.array([hour.get("P", 0) for hour in hourly], dtype=np.float64) / 1000  # W -> kWh
+    if len(profile) != HOURS_PER_YEAR:
+        raise HTTPException(status_code=500, detail=f"Unexpected PVGIS series length: {len(profile)}")
+    
+    return utc_to_civil_profile(profile)
 
-def calculate_financing_with_aids(kit_price: float, total_aids: float, monthly_savings: float) -> Dict:
+# Collections backing the in-process production caches
+PRODUCTION_CACHE_COLLECTIONS = {"hourly": "production_profiles", "monthly": "production_yields"}
+
+production_refresh_tasks: Dict[str, asyncio.Task] = {}  # Background refreshes of stale entries, by key
+
+def get_production_memory_cache(kind: str) -> Dict[str, np.ndarray]:
+    """In-process cache of a production kind"""
+    return production_profile_cache if kind == "hourly" else production_yield_cache
+
+def decode_production(kind: str, cached: dict) -> np.ndarray:
+    """Production values of a cache document"""
+    if kind == "hourly":
+        profile = np.frombuffer(cached['profile'], dtype=np.float32).astype(np.float64)
+        # Profiles cached before the civil time conversion are still indexed by UTC hours
+        return profile if cached.get('timezone') == LOCAL_TIMEZONE else utc_to_civil_profile(profile)
+    return np.array(cached['monthly'], dtype=np.float64)
+
+async def store_production(kind: str, key: str, site: Dict[str, float], values: np.ndarray):
+    """Save fetched production values in the in-process cache and its collection"""
+    get_production_memory_cache(kind)[key] = values
+    encoded = {"profile": values.astype(np.float32).tobytes(), "timezone": LOCAL_TIMEZONE} if kind == "hourly" else {"monthly": values.tolist()}
+    await timed("mongo_write", db[PRODUCTION_CACHE_COLLECTIONS[kind]].update_one(
+        {"key": key},
+        {"$set": {"key": key, **site, **encoded, "fetched_at": datetime.utcnow()}},
+        upsert=True
+    ))
+
+async def refresh_production(kind: str, key: str, site: Dict[str, float], fetch):
+    """Fetch a stale cache entry again, keeping the stale one on failure"""
+    try:
+        await store_production(kind, key, site, await fetch())
+    except Exception as e:
+        logging.warning(f"Background refresh of {kind} production {key} failed: {e}")
+
+async def get_cached_production(kind: str, key: str, site: Dict[str, float], fetch, fallback) -> Tuple[np.ndarray, str]:
     """
-    Calculate financing options with aids deducted - WITH INTERESTS
+    Production values for a cache key: in-process cache, then collection, then PVGIS
+    Entries older than PRODUCTION_CACHE_TTL_DAYS are served as "stale" and refreshed in the background
+    fetch() calls PVGIS, fallback() is the local stand-in used when PVGIS is unreachable
+    Returns the values and their source: "cache", "stale", "pvgis" or "local"
     """
-    taeg = 0.0325  # 3.25% TAEG (taux réduit avec aides)
-    monthly_rate = taeg / 12
+    memory_cache = get_production_memory_cache(kind)
+    if key in memory_cache:
+        record_cache_lookup(f"production_{kind}", "memory")
+        return memory_cache[key], "cache"
     
-    # Amount to finance after aids
-    financed_amount = kit_price - total_aids
+    cached = await timed("mongo_read", db[PRODUCTION_CACHE_COLLECTIONS[kind]].find_one({"key": key}))
+    if cached:
+        values = decode_production(kind, cached)
+        if cached['fetched_at'] > datetime.utcnow() - timedelta(days=PRODUCTION_CACHE_TTL_DAYS):
+            record_cache_lookup(f"production_{kind}", "mongo")
+            memory_cache[key] = values
+            return values, "cache"
+        record_cache_lookup(f"production_{kind}", "stale")
+        # Stale entries stay out of the in-process cache until refreshed
+        if key not in production_refresh_tasks:
+            task = asyncio.create_task(refresh_production(kind, key, site, fetch))
+            production_refresh_tasks[key] = task
+            task.add_done_callback(lambda _: production_refresh_tasks.pop(key, None))
+        return values, "stale"
     
-    # Calculate for 15 years (180 months) as shown in the screenshot
-    years = 15
-    months = years * 12
+    record_cache_lookup(f"production_{kind}", "miss")
+    try:
+        values = await fetch()
+    except Exception as e:
+        # Stand-in values are not cached so that PVGIS is tried again next time
+        logging.warning(f"PVGIS {kind} production unavailable for {key}, using local model: {e}")
+        return fallback(), "local"
+    
+    await store_production(kind, key, site, values)
+    return values, "pvgis"
+
+async def get_section_production_profile(lat: float, lon: float, aspect: float, angle: float = PANEL_TILT) -> Tuple[np.ndarray, str]:
+    """
+    Get the hourly production of 1 kWp (kWh) for a roof plane
+    Returns the profile and its source, see get_cached_production
+    Sites are snapped to the centre of their production grid cell
+    """
+    lat, lon = snap_to_production_cell(lat, lon)
+    return await get_cached_production(
+        "hourly",
+        production_profile_key(lat, lon, aspect, angle),
+        {"latitude": lat, "longitude": lon, "aspect": aspect, "angle": angle},
+        lambda: fetch_pvgis_hourly_profile(lat, lon, aspect, angle),
+        lambda: synthetic_hourly_profile(lat, aspect, angle, lon)
+    )
+
+async def get_hourly_production_profile(lat: float, lon: float, orientation: str) -> Tuple[np.ndarray, str]:
+    """
+    Get the hourly production of 1 kWp (kWh) for a site with a single roof orientation
+    Calibrated on the PVcalc monthly yield, so that it adds up to the production of get_roof_pvgis_data
+    """
+    return await get_calibrated_hourly_profile(lat, lon, ORIENTATION_ASPECTS.get(orientation, 0), PANEL_TILT)
+
+def combine_production_sources(sources: List[str]) -> str:
+    """Overall source of a production built from several profiles, the least reliable wins"""
+    for source in ("local", "stale", "pvgis"):
+        if source in sources:
+            return source
+    return "cache"
+
+def yield_grid_nodes(aspect: float, tilt: float) -> List[Tuple[float, float, float]]:
+    """
+    Grid nodes surrounding an aspect / tilt with their bilinear weights
+    Aspects wrap around north, tilts are clipped to 0-90°, nodes with a zero weight are skipped
+    """
+    aspect = (aspect + 180) % 360 - 180
+    tilt = min(max(tilt, 0), 90)
+    
+    aspect_low = np.floor(aspect / YIELD_GRID_ASPECT_STEP) * YIELD_GRID_ASPECT_STEP
+    aspect_high = aspect_low + YIELD_GRID_ASPECT_STEP
+    aspect_fraction = (aspect - aspect_low) / YIELD_GRID_ASPECT_STEP
+    if aspect_high >= 180:
+        aspect_high -= 360
+    
+    tilt_low = min(np.floor(tilt / YIELD_GRID_TILT_STEP) * YIELD_GRID_TILT_STEP, 90 - YIELD_GRID_TILT_STEP)
+    tilt_fraction = (tilt - tilt_low) / YIELD_GRID_TILT_STEP
+    
+    nodes = []
+    for node_aspect, aspect_weight in ((aspect_low, 1 - aspect_fraction), (aspect_high, aspect_fraction)):
+        for node_tilt, tilt_weight in ((tilt_low, 1 - tilt_fraction), (tilt_low + YIELD_GRID_TILT_STEP, tilt_fraction)):
+            if aspect_weight * tilt_weight > 0:
+                nodes.append((float(node_aspect), float(node_tilt), float(aspect_weight * tilt_weight)))
+    return nodes
+
+async def interpolate_yield_grid(get_node, aspect: float, tilt: float) -> Tuple[np.ndarray, str]:
+    """
+    Bilinear interpolation of a production array between grid nodes
+    get_node(aspect, tilt) is an async getter returning the node's array and source
+    """
+    nodes = yield_grid_nodes(aspect, tilt)
+    results = await asyncio.gather(*[get_node(node_aspect, node_tilt) for node_aspect, node_tilt, _ in nodes])
+    value = sum(weight * array for (_, _, weight), (array, _) in zip(nodes, results))
+    return value, combine_production_sources([source for _, source in results])
+
+async def fetch_pvgis_monthly_yield(lat: float, lon: float, aspect: float, angle: float) -> np.ndarray:
+    """
+    Get the monthly production of 1 kWp (kWh) from the PVGIS PVcalc API
+    """
+    params = {
+        "lat": lat,
+        "lon": lon,
+        "peakpower": 1,  # kW, yields are scaled by the kit power
+        "loss": SYSTEM_LOSS,
+        "angle": angle,
+        "aspect": aspect,
+        "pvtech": "c-Si",
+        "mounting": "building",
+        "trackingtype": 0,
+        "outputformat": "json",
+        "browser": 0
+    }
+    
+    data = await pvgis_request("PVcalc", params)
+    
+    monthly = data.get("outputs", {}).get("monthly", {})
+    monthly = monthly.get("fixed", []) if isinstance(monthly, dict) else monthly
+    if len(monthly) != 12:
+        raise HTTPException(status_code=500, detail=f"Unexpected PVGIS monthly data length: {len(monthly)}")
+    return np.array([month.get("E_m", 0) for month in monthly], dtype=np.float64)
+
+async def get_monthly_yield_node(lat: float, lon: float, aspect: float, angle: float) -> Tuple[np.ndarray, str]:
+    """
+    Get the monthly production of 1 kWp (kWh) at a grid node
+    Returns the yields and their source, see get_cached_production
+    Sites are snapped to the centre of their production grid cell
+    """
+    lat, lon = snap_to_production_cell(lat, lon)
+    return await get_cached_production(
+        "monthly",
+        production_profile_key(lat, lon, aspect, angle),
+        {"latitude": lat, "longitude": lon, "aspect": aspect, "angle": angle},
+        lambda: fetch_pvgis_monthly_yield(lat, lon, aspect, angle),
+        lambda: np.add.reduceat(synthetic_hourly_profile(lat, aspect, angle), MONTH_START_HOURS)
+    )
+
+async def get_interpolated_pvgis_data(lat: float, lon: float, aspect: float, tilt: float, kit_power: int) -> Dict[str, Any]:
+    """
+    Same shape as get_pvgis_data for any aspect / tilt, interpolated over the cached yield grid
+    """
+    monthly, source = await interpolate_yield_grid(
+        lambda node_aspect, node_tilt: get_monthly_yield_node(lat, lon, node_aspect, node_tilt), aspect, tilt
+    )
+    production = monthly * kit_power
+    annual_production = float(production.sum())
+    return {
+        "annual_production": annual_production,
+        "monthly_data": [{"month": month + 1, "E_m": float(value)} for month, value in enumerate(production)],
+        "specific_production": annual_production / kit_power if kit_power > 0 else 0,
+        "production_source": source
+    }
+
+async def get_interpolated_hourly_profile(lat: float, lon: float, aspect: float, tilt: float) -> Tuple[np.ndarray, str]:
+    """
+    Hourly production of 1 kWp (kWh) for any aspect / tilt, interpolated over cached grid profiles
+    """
+    return await interpolate_yield_grid(
+        lambda node_aspect, node_tilt: get_section_production_profile(lat, lon, node_aspect, node_tilt), aspect, tilt
+    )
+
+def calibrate_hourly_profile(profile: np.ndarray, monthly: np.ndarray) -> np.ndarray:
+    """
+    Scale an hourly profile month by month so that its monthly totals match the given yields
+    seriescalc profiles cover a single year, only their shape is kept and PVcalc's multi-year averages set the level
+    Months without hourly production are left at zero
+    """
+    hourly_months = np.add.reduceat(profile, MONTH_START_HOURS)
+    factors = np.divide(monthly, hourly_months, out=np.zeros_like(hourly_months), where=hourly_months > 0)
+    return profile * np.repeat(factors, np.array(DAYS_PER_MONTH) * 24)
+
+async def get_calibrated_hourly_profile(lat: float, lon: float, aspect: float, tilt: float) -> Tuple[np.ndarray, str]:
+    """
+    Hourly production of 1 kWp (kWh) for any aspect / tilt, with the monthly totals of the PVcalc yield grid
+    """
+    (profile, profile_source), (monthly, monthly_source) = await asyncio.gather(
+        get_interpolated_hourly_profile(lat, lon, aspect, tilt),
+        interpolate_yield_grid(
+            lambda node_aspect, node_tilt: get_monthly_yield_node(lat, lon, node_aspect, node_tilt), aspect, tilt
+        )
+    )
+    return calibrate_hourly_profile(profile, monthly), combine_production_sources([profile_source, monthly_source])
+
+def get_roof_geometry(client: dict) -> Optional[Tuple[float, float]]:
+    """
+    Precise (aspect, tilt) of a single plane roof, None when only the named orientation is known
+    """
+    if client.get('roof_aspect') is None and client.get('roof_tilt') is None:
+        return None
+    aspect = client['roof_aspect'] if client.get('roof_aspect') is not None else ORIENTATION_ASPECTS.get(client['roof_orientation'], 0)
+    tilt = client['roof_tilt'] if client.get('roof_tilt') is not None else PANEL_TILT
+    return aspect, tilt
+
+def get_roof_sections(client: dict) -> List[Dict[str, Any]]:
+    """
+    Roof sections of a client, a single section built from roof_surface / roof_orientation by default
+    """
+    if client.get('roof_sections'):
+        return [dict(section) for section in client['roof_sections']]
+    aspect, tilt = get_roof_geometry(client) or (ORIENTATION_ASPECTS.get(client['roof_orientation'], 0), PANEL_TILT)
+    return [{
+        "name": client['roof_orientation'],
+        "surface": client['roof_surface'],
+        "tilt": tilt,
+        "aspect": aspect
+    }]
+
+async def get_roof_section_profiles(client: dict) -> Tuple[List[Dict[str, Any]], np.ndarray, List[str]]:
+    """
+    Hourly production of 1 kWp for every roof section of a client, fetched concurrently
+    Each section is calibrated on its PVcalc monthly yield, like single orientation roofs
+    Identical planes share the same cache entries across clients
+    Returns the sections, a (sections x 8760) array and the source of each profile
+    """
+    await ensure_client_location(client)
+    sections = get_roof_sections(client)
+    results = await asyncio.gather(*[
+        get_calibrated_hourly_profile(client['latitude'], client['longitude'], section['aspect'], section['tilt'])
+        for section in sections
+    ])
+    return sections, np.stack([profile for profile, _ in results]), [source for _, source in results]
+
+def allocate_roof_surface(needed_surface: np.ndarray, section_surfaces: np.ndarray, section_yields: np.ndarray) -> np.ndarray:
+    """
+    Split the panel surface of each kit across roof sections, best yielding sections first
+    needed_surface: (kits,), section_surfaces and section_yields: (sections,)
+    Returns the (kits x sections) surface placed on each section
+    """
+    order = np.argsort(-section_yields, kind="stable")
+    capacity = section_surfaces[order]
+    filled_before = np.cumsum(capacity) - capacity
+    placed = np.clip(np.asarray(needed_surface, dtype=np.float64)[:, None] - filled_before[None, :], 0, capacity[None, :])
+    allocation = np.empty_like(placed)
+    allocation[:, order] = placed
+    return allocation
+
+def roof_section_shares(allocation: np.ndarray) -> np.ndarray:
+    """
+    Share of each kit's power installed on each section
+    Kits larger than the roof keep their full power, spread like the surface that fits
+    """
+    placed = allocation.sum(axis=1, keepdims=True)
+    return np.divide(allocation, placed, out=np.zeros_like(allocation), where=placed > 0)
+
+def get_kit_surface(kit_power: int, client_mode: str = "particuliers") -> float:
+    """Panel surface of a catalog kit"""
+    kit_info = get_solar_kits_by_mode(client_mode).get(kit_power, {})
+    return kit_info.get('surface', kit_info.get('panels', kit_power * 2) * PANEL_SURFACE_M2)
+
+async def get_kit_production_profile(client: dict, kit_power: int, client_mode: str = "particuliers") -> Tuple[np.ndarray, str, Optional[List[Dict[str, Any]]]]:
+    """
+    Hourly production (kWh) of a kit on the client's roof
+    With several roof sections the panels are split across them and the profiles summed
+    Returns the profile, its source and the section split (None for single orientation roofs)
+    """
+    await ensure_client_location(client)
+    if not client.get('roof_sections') and not get_roof_geometry(client):
+        profile, source = await get_hourly_production_profile(client['latitude'], client['longitude'], client['roof_orientation'])
+        return profile * kit_power, source, None
+    
+    sections, profiles, sources = await get_roof_section_profiles(client)
+    section_yields = profiles.sum(axis=1)
+    allocation = allocate_roof_surface(
+        np.array([get_kit_surface(kit_power, client_mode)]),
+        np.array([section['surface'] for section in sections]),
+        section_yields
+    )
+    section_power = roof_section_shares(allocation)[0] * kit_power
+    production = section_power @ profiles
+    
+    split = [
+        {
+            **section,
+            "panel_surface": round(float(allocation[0, index]), 1),
+            "kit_power": round(float(section_power[index]), 2),
+            "specific_yield": round(float(section_yields[index]), 1),
+            "production": round(float(section_power[index] * section_yields[index]), 1),
+            "source": sources[index]
+        }
+        for index, section in enumerate(sections)
+    ]
+    return production, combine_production_sources(sources), split
+
+async def get_sections_pvgis_data(client: dict, kit_power: int, client_mode: str = "particuliers") -> Dict[str, Any]:
+    """
+    Same shape as get_pvgis_data for a multi-section roof, built from the summed hourly profiles
+    The profiles are calibrated on PVcalc, the totals match single orientation roofs of the same geometry
+    """
+    production, source, split = await get_kit_production_profile(client, kit_power, client_mode)
+    annual_production = float(production.sum())
+    return {
+        "annual_production": annual_production,
+        "monthly_data": [
+            {"month": month + 1, "E_m": float(value)}
+            for month, value in enumerate(np.add.reduceat(production, MONTH_START_HOURS))
+        ],
+        "specific_production": annual_production / kit_power if kit_power > 0 else 0,
+        "roof_sections": split,
+        "production_source": source
+    }
+
+@traced()
+async def get_roof_pvgis_data(client: dict, kit_power: int, client_mode: str = "particuliers") -> Dict[str, Any]:
+    """
+    Production data of a kit on the client's roof, served from the yield cache
+    Split roofs are summed section by section, precise geometries are interpolated over the yield grid
+    """
+    await ensure_client_location(client)
+    if client.get('roof_sections'):
+        return await get_sections_pvgis_data(client, kit_power, client_mode)
+    # Named orientations are grid nodes: a single cached PVcalc yield scaled by the kit power
+    aspect, tilt = get_roof_geometry(client) or (ORIENTATION_ASPECTS.get(client['roof_orientation'], 0), PANEL_TILT)
+    return await get_interpolated_pvgis_data(client['latitude'], client['longitude'], aspect, tilt, kit_power)
+
+def get_roof_surface(client: dict) -> float:
+    """Total roof surface, summed over the sections when there are several"""
+    if client.get('roof_sections'):
+        return sum(section['surface'] for section in client['roof_sections'])
+    return client['roof_surface']
+
+# Precomputed specific yield raster over metropolitan France, for instant estimates
+# Shape (latitudes, longitudes, aspects, tilts, 12): monthly kWh of 1 kWp from PVGIS PVcalc
+# Nodes PVGIS could not provide (sea, outages) are NaN and skipped by the lookup
+YIELD_RASTER_PATH = Path(os.environ.get('YIELD_RASTER_PATH', ROOT_DIR / 'data' / 'specific_yield_raster.npy'))
+YIELD_RASTER_STEP = 0.5  # Degrees of latitude / longitude
+YIELD_RASTER_LATITUDES = np.arange(41.0, 51.5 + YIELD_RASTER_STEP / 2, YIELD_RASTER_STEP)
+YIELD_RASTER_LONGITUDES = np.arange(-5.5, 10.0 + YIELD_RASTER_STEP / 2, YIELD_RASTER_STEP)
+YIELD_RASTER_ASPECTS = np.arange(-180, 180, 45)
+YIELD_RASTER_TILTS = np.array([0, 15, 25, PANEL_TILT, 45, 60, 90])
+YIELD_RASTER_SHAPE = (len(YIELD_RASTER_LATITUDES), len(YIELD_RASTER_LONGITUDES), len(YIELD_RASTER_ASPECTS), len(YIELD_RASTER_TILTS), 12)
+YIELD_RASTER_CHECKPOINT_NODES = 500  # The build saves its progress every N nodes
+
+yield_raster: Optional[np.ndarray] = None  # Memory-mapped on first use
+calculation_refine_tasks = set()  # Background PVGIS refinements of estimates
+
+def read_yield_raster(path: Path = YIELD_RASTER_PATH, mmap_mode: Optional[str] = 'r') -> Optional[np.ndarray]:
+    """
+    Stored specific yield raster, None when it has not been built or has another layout
+    """
+    try:
+        raster = np.load(path, mmap_mode=mmap_mode)
+    except FileNotFoundError:
+        logging.warning(f"Specific yield raster not found at {path}, run: python server.py build-yield-raster")
+        return None
+    if raster.shape != YIELD_RASTER_SHAPE:
+        logging.warning(f"Specific yield raster has shape {raster.shape}, expected {YIELD_RASTER_SHAPE}")
+        return None
+    return raster
+
+def load_yield_raster() -> Optional[np.ndarray]:
+    """
+    Memory-map the specific yield raster, None when it has not been built
+    """
+    global yield_raster
+    if yield_raster is None:
+        yield_raster = read_yield_raster(YIELD_RASTER_PATH)
+    return yield_raster
+
+def save_yield_raster(raster: np.ndarray, path: Path):
+    """Write next to the target then swap, so running processes never map a partial file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(path.name + '.tmp')
+    with open(temporary_path, 'wb') as raster_file:
+        np.save(raster_file, raster)
+    os.replace(temporary_path, path)
+
+def pvgis_pacer(min_interval: float):
+    """Async callable spacing successive PVGIS calls by at least min_interval seconds"""
+    pacing = {"lock": asyncio.Lock(), "next_call": 0.0}
+    
+    async def wait_for_upstream_slot():
+        loop = asyncio.get_running_loop()
+        async with pacing["lock"]:
+            delay = pacing["next_call"] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            pacing["next_call"] = loop.time() + min_interval
+    
+    return wait_for_upstream_slot
+
+async def build_yield_raster(path: Path = YIELD_RASTER_PATH) -> Dict[str, Any]:
+    """
+    Build the specific yield raster offline from PVGIS PVcalc, one call per node
+    Calls are paced like the cache warm-up, progress is saved every YIELD_RASTER_CHECKPOINT_NODES nodes
+    and a new run only fetches the nodes still missing (interrupted builds, sea, PVGIS errors)
+    """
+    global yield_raster
+    raster = read_yield_raster(path, mmap_mode=None)
+    raster = np.full(YIELD_RASTER_SHAPE, np.nan, dtype=np.float32) if raster is None else np.array(raster)
+    missing = [tuple(int(index) for index in node) for node in np.argwhere(np.isnan(raster[..., 0]))]
+    
+    semaphore = asyncio.Semaphore(CACHE_WARMUP_CONCURRENCY)
+    wait_for_upstream_slot = pvgis_pacer(CACHE_WARMUP_MIN_INTERVAL_SECONDS)
+    counts = {"nodes": int(np.prod(YIELD_RASTER_SHAPE[:4])), "fetched": 0, "failed": 0}
+    
+    async def fetch_node(lat_index: int, lon_index: int, aspect_index: int, tilt_index: int):
+        async with semaphore:
+            await wait_for_upstream_slot()
+            try:
+                raster[lat_index, lon_index, aspect_index, tilt_index] = await fetch_pvgis_monthly_yield(
+                    float(YIELD_RASTER_LATITUDES[lat_index]), float(YIELD_RASTER_LONGITUDES[lon_index]),
+                    float(YIELD_RASTER_ASPECTS[aspect_index]), float(YIELD_RASTER_TILTS[tilt_index])
+                )
+                counts["fetched"] += 1
+            except HTTPException as e:
+                # Sea nodes are refused by PVGIS, outages are retried by the next run
+                logging.debug(f"Yield raster node {lat_index, lon_index, aspect_index, tilt_index} unavailable: {e.detail}")
+                counts["failed"] += 1
+    
+    for batch_start in range(0, len(missing), YIELD_RASTER_CHECKPOINT_NODES):
+        await asyncio.gather(*[fetch_node(*node) for node in missing[batch_start:batch_start + YIELD_RASTER_CHECKPOINT_NODES]])
+        save_yield_raster(raster, path)
+        logging.info(f"Specific yield raster: {batch_start + YIELD_RASTER_CHECKPOINT_NODES}/{len(missing)} missing nodes processed")
+    if not missing:
+        save_yield_raster(raster, path)
+    yield_raster = None
+    
+    counts["missing"] = int(np.isnan(raster[..., 0]).sum())
+    logging.info(f"Specific yield raster written to {path}: {counts}")
+    return {"path": str(path), "shape": list(raster.shape), **counts}
+
+def lookup_yield_raster(raster: np.ndarray, lat: float, lon: float, aspect: float, tilt: float) -> Optional[np.ndarray]:
+    """
+    Monthly production of 1 kWp (kWh) at a site, linear over latitude, longitude, aspect and tilt
+    Sites outside the raster use the nearest edge, missing nodes are left out of the weights
+    None when none of the surrounding nodes is available
+    """
+    def axis_position(value: float, nodes: np.ndarray) -> Tuple[int, float]:
+        value = min(max(value, nodes[0]), nodes[-1])
+        low = min(int(np.searchsorted(nodes, value, side='right')) - 1, len(nodes) - 2)
+        return low, (value - nodes[low]) / (nodes[low + 1] - nodes[low])
+    
+    lat_low, lat_fraction = axis_position(lat, YIELD_RASTER_LATITUDES)
+    lon_low, lon_fraction = axis_position(lon, YIELD_RASTER_LONGITUDES)
+    tilt_low, tilt_fraction = axis_position(tilt, YIELD_RASTER_TILTS)
+    aspect_position = ((aspect + 180) % 360) / (YIELD_RASTER_ASPECTS[1] - YIELD_RASTER_ASPECTS[0])
+    aspect_low = int(aspect_position) % YIELD_RASTER_SHAPE[2]
+    aspect_high = (aspect_low + 1) % YIELD_RASTER_SHAPE[2]  # Aspects wrap around north
+    aspect_fraction = aspect_position - int(aspect_position)
+    
+    # (2, 2, 2, 2, 12) block of the surrounding nodes
+    block = raster[lat_low:lat_low + 2, lon_low:lon_low + 2][:, :, [aspect_low, aspect_high]][:, :, :, tilt_low:tilt_low + 2].astype(np.float64)
+    weights = (
+        np.array([1 - lat_fraction, lat_fraction])[:, None, None, None]
+        * np.array([1 - lon_fraction, lon_fraction])[None, :, None, None]
+        * np.array([1 - aspect_fraction, aspect_fraction])[None, None, :, None]
+        * np.array([1 - tilt_fraction, tilt_fraction])[None, None, None, :]
+    )
+    available = ~np.isnan(block[..., 0])
+    weights = weights * available
+    if weights.sum() <= 0:
+        return None
+    return np.tensordot(weights, np.where(available[..., None], block, 0), axes=4) / weights.sum()
+
+def estimate_pvgis_data(client: dict, kit_power: int, client_mode: str = "particuliers") -> Optional[Dict[str, Any]]:
+    """
+    Same shape as get_pvgis_data, looked up in the specific yield raster without any network call
+    None when the raster is not available or does not cover the site
+    """
+    raster = load_yield_raster()
+    if raster is None:
+        return None
+    
+    sections = get_roof_sections(client)
+    lookups = [
+        lookup_yield_raster(raster, client['latitude'], client['longitude'], section['aspect'], section['tilt'])
+        for section in sections
+    ]
+    if any(monthly is None for monthly in lookups):
+        logging.warning(f"Specific yield raster has no node around ({client['latitude']}, {client['longitude']})")
+        return None
+    monthly = np.stack(lookups)
+    allocation = allocate_roof_surface(
+        np.array([get_kit_surface(kit_power, client_mode)]),
+        np.array([section['surface'] for section in sections]),
+        monthly.sum(axis=1)
+    )
+    section_power = roof_section_shares(allocation)[0] * kit_power if len(sections) > 1 else np.array([float(kit_power)])
+    
+    production = section_power @ monthly
+    annual_production = float(production.sum())
+    return {
+        "annual_production": annual_production,
+        "monthly_data": [{"month": month + 1, "E_m": float(value)} for month, value in enumerate(production)],
+        "specific_production": annual_production / kit_power if kit_power > 0 else 0,
+        "roof_sections": [
+            {**section, "kit_power": round(float(section_power[index]), 2)} for index, section in enumerate(sections)
+        ],
+        "production_source": "estimate"
+    }
+
+def estimate_hourly_production(client: dict, estimate: Dict[str, Any]) -> np.ndarray:
+    """
+    Hourly production of an estimate without any network call
+    The local model gives the hourly shape of each section, the raster estimate the monthly totals
+    """
+    shape = sum(
+        section['kit_power'] * synthetic_hourly_profile(client['latitude'], section['aspect'], section['tilt'], client['longitude'])
+        for section in estimate['roof_sections']
+    )
+    return calibrate_hourly_profile(shape, np.array([month['E_m'] for month in estimate['monthly_data']]))
+
+# Cache warm-up: pre-fill the production caches for stored clients and hot cities
+# Off by default: every worker process would warm the same sites, run `python server.py warm-cache` once instead
+CACHE_WARMUP_ON_STARTUP = os.environ.get('CACHE_WARMUP_ON_STARTUP', '0') == '1'
+CACHE_WARMUP_CITIES = [city.strip().lower() for city in os.environ.get('CACHE_WARMUP_CITIES', ','.join(FALLBACK_CITY_COORDINATES)).split(',') if city.strip()]
+CACHE_WARMUP_CONCURRENCY = int(os.environ.get('CACHE_WARMUP_CONCURRENCY', 3))  # Parallel PVGIS calls
+CACHE_WARMUP_MIN_INTERVAL_SECONDS = float(os.environ.get('CACHE_WARMUP_MIN_INTERVAL_SECONDS', 0.5))  # Between PVGIS calls
+CACHE_WARMUP_HOURLY = os.environ.get('CACHE_WARMUP_HOURLY', '1') == '1'  # Also warm the hourly series
+
+cache_warmup_task: Optional[asyncio.Task] = None
+
+async def get_cache_warmup_sites() -> List[Tuple[float, float, float, float]]:
+    """
+    Distinct (latitude, longitude, aspect, tilt) yield grid nodes of the stored clients followed by the hot cities
+    Roof sections and precise aspects / tilts contribute the grid nodes they are interpolated from
+    Coordinates are production grid cell centres
+    """
+    sites = []
+    projection = {"_id": 0, "latitude": 1, "longitude": 1, "roof_surface": 1, "roof_orientation": 1,
+                  "roof_aspect": 1, "roof_tilt": 1, "roof_sections": 1}
+    async for client in db.clients.find({"latitude": {"$ne": None}, "longitude": {"$ne": None}}, projection):
+        lat, lon = snap_to_production_cell(client['latitude'], client['longitude'])
+        for section in get_roof_sections(client):
+            sites.extend((lat, lon, aspect, tilt) for aspect, tilt, _ in yield_grid_nodes(section['aspect'], section['tilt']))
+    
+    for city in CACHE_WARMUP_CITIES:
+        if city not in FALLBACK_CITY_COORDINATES:
+            logging.warning(f"Unknown cache warm-up city: {city}")
+            continue
+        lat, lon = snap_to_production_cell(*FALLBACK_CITY_COORDINATES[city])
+        sites.extend((lat, lon, aspect, PANEL_TILT) for aspect in ORIENTATION_ASPECTS.values())
+    
+    # Clients sharing a grid cell and a roof plane are a single site, keep the first occurrence, clients first
+    return list(dict.fromkeys(sites))
+
+async def is_production_cached(collection, key: str) -> bool:
+    """Whether a fresh production cache entry exists in a collection"""
+    cached = await collection.find_one(
+        {"key": key, "fetched_at": {"$gt": datetime.utcnow() - timedelta(days=PRODUCTION_CACHE_TTL_DAYS)}},
+        {"_id": 1}
+    )
+    return cached is not None
+
+async def warm_production_cache(hourly: bool = CACHE_WARMUP_HOURLY) -> Dict[str, Any]:
+    """
+    Fetch the missing monthly yields (and hourly series) of every warm-up site
+    PVGIS calls run with bounded concurrency and are spaced by CACHE_WARMUP_MIN_INTERVAL_SECONDS
+    """
+    started = datetime.utcnow()
+    sites = await get_cache_warmup_sites()
+    semaphore = asyncio.Semaphore(CACHE_WARMUP_CONCURRENCY)
+    wait_for_upstream_slot = pvgis_pacer(CACHE_WARMUP_MIN_INTERVAL_SECONDS)
+    counts = {"sites": len(sites), "cached": 0, "fetched": 0, "failed": 0}
+    
+    async def warm(collection, getter, lat: float, lon: float, aspect: float, tilt: float):
+        key = production_profile_key(lat, lon, aspect, tilt)
+        if await is_production_cached(collection, key):
+            counts["cached"] += 1
+            return
+        async with semaphore:
+            await wait_for_upstream_slot()
+            _, source = await getter(lat, lon, aspect, tilt)
+        counts[{"pvgis": "fetched", "cache": "cached"}.get(source, "failed")] += 1
+    
+    jobs = []
+    for lat, lon, aspect, tilt in sites:
+        jobs.append(warm(db.production_yields, get_monthly_yield_node, lat, lon, aspect, tilt))
+        if hourly:
+            jobs.append(warm(db.production_profiles, get_section_production_profile, lat, lon, aspect, tilt))
+    await asyncio.gather(*jobs)
+    
+    counts["duration_seconds"] = round((datetime.utcnow() - started).total_seconds(), 1)
+    logging.info(f"Production cache warm-up done: {counts}")
+    return counts
+
+def relative_error_stats(errors: np.ndarray) -> Dict[str, float]:
+    """Mean, 95th percentile and max of relative errors, in percent"""
+    if len(errors) == 0:
+        return {"mean": 0.0, "p95": 0.0, "max": 0.0}
+    errors = np.abs(errors) * 100
+    return {"mean": round(float(errors.mean()), 3), "p95": round(float(np.percentile(errors, 95)), 3), "max": round(float(errors.max()), 3)}
+
+async def production_grid_report(cell_degrees: Optional[float] = None,
+                                 tolerance_percent: float = PRODUCTION_GRID_TOLERANCE_PERCENT,
+                                 sample: int = 5000) -> Dict[str, Any]:
+    """
+    Yield error introduced by snapping the stored clients to the production grid
+    model_error: exact site against cell centre with the local stand-in (latitude effect only)
+    neighbour_error: half the yield difference between adjacent cells cached from PVGIS,
+    a bound of the error for a site at the edge of a cell
+    sample: clients drawn at random (and cached yields read) instead of scanning the collections
+    """
+    cell = PRODUCTION_GRID_CELL_DEGREES if cell_degrees is None else cell_degrees
+    clients = await db.clients.aggregate([
+        {"$match": {"latitude": {"$ne": None}, "longitude": {"$ne": None}}},
+        {"$sample": {"size": sample}},
+        {"$project": {"_id": 0, "latitude": 1, "longitude": 1}}
+    ]).to_list(None)
+    coordinates = np.array([[client['latitude'], client['longitude']] for client in clients], dtype=np.float64).reshape(-1, 2)
+    cells = np.array([snap_to_production_cell(lat, lon, cell) for lat, lon in coordinates]).reshape(-1, 2)
+    
+    # The stand-in yield only depends on latitude and is smooth: sample it every 0.05° and interpolate
+    lat_range = (coordinates[:, 0].min(), coordinates[:, 0].max()) if len(coordinates) else (46.5, 46.5)
+    sample_latitudes = np.arange(lat_range[0] - max(cell, 0.5) - 0.05, lat_range[1] + max(cell, 0.5) + 0.1, 0.05)
+    sample_yields = np.array([synthetic_hourly_profile(float(lat), 0).sum() for lat in sample_latitudes])
+    model_errors = np.interp(cells[:, 0], sample_latitudes, sample_yields) / np.interp(coordinates[:, 0], sample_latitudes, sample_yields) - 1
+    
+    # Largest relative model gradient (per degree) gives the cell size meeting the tolerance
+    gradients = np.abs(np.gradient(sample_yields, sample_latitudes)) / sample_yields
+    suggested_cell = 2 * tolerance_percent / 100 / max(float(gradients.max()), 1e-9)
+    
+    # Cached south facing PVGIS yields on cell centres, compared with their north and east neighbours
+    cached_yields = {}
+    async for cached in db.production_yields.find({"aspect": 0, "angle": PANEL_TILT}, {"_id": 0, "latitude": 1, "longitude": 1, "monthly": 1}).limit(sample):
+        cached_yields[snap_to_production_cell(cached['latitude'], cached['longitude'], cell)] = sum(cached['monthly'])
+    neighbour_errors = []
+    for (lat, lon), annual in cached_yields.items():
+        for neighbour in (snap_to_production_cell(lat + cell, lon, cell), snap_to_production_cell(lat, lon + cell, cell)):
+            if neighbour in cached_yields and annual > 0:
+                neighbour_errors.append((cached_yields[neighbour] / annual - 1) / 2)
+    
+    model_stats = relative_error_stats(model_errors)
+    neighbour_stats = relative_error_stats(np.array(neighbour_errors))
+    distinct_cells = len({tuple(row) for row in cells.tolist()})
+    return {
+        "cell_degrees": cell,
+        "cell_size_km": [round(cell * KM_PER_DEGREE_LATITUDE, 2),
+                         round(cell * KM_PER_DEGREE_LATITUDE * float(np.cos(np.radians(coordinates[:, 0].mean() if len(coordinates) else 46.5))), 2)],
+        "clients": len(coordinates),
+        "sample": sample,
+        "distinct_sites": len({tuple(row) for row in np.round(coordinates, 4).tolist()}),
+        "distinct_cells": distinct_cells,
+        "model_error_percent": model_stats,
+        "neighbour_error_percent": {**neighbour_stats, "pairs": len(neighbour_errors)},
+        "tolerance_percent": tolerance_percent,
+        "within_tolerance": max(model_stats["p95"], neighbour_stats["p95"]) <= tolerance_percent,
+        "suggested_cell_degrees": round(float(suggested_cell), 3)
+    }
+
+@lru_cache(maxsize=64)
+def _load_profile_shape(heating_system: str, water_heating_system: str) -> np.ndarray:
+    """
+    Hourly consumption shape normalised to 1 kWh per year (read-only, cached)
+    """
+    day = DAY_OF_YEAR + 1
+    heating_share = HEATING_LOAD_SHARES.get(heating_system, 0)
+    water_share = WATER_HEATING_LOAD_SHARES.get(water_heating_system, 0)
+    base_share = 1 - heating_share - water_share
+    
+    # Base load is a little higher in winter (lighting, cooking)
+    base = BASE_LOAD_DAILY_SHAPE[HOUR_OF_DAY] * (1 + 0.15 * np.cos(2 * np.pi * (day - 15) / 365))
+    shape = base_share * base / base.sum()
+    
+    if heating_share:
+        # Heating degree hours against a 16°C base with a sinusoidal outdoor temperature
+        outdoor_temperature = 11.5 - 7.5 * np.cos(2 * np.pi * (day - 20) / 365)
+        heating = np.clip(16 - outdoor_temperature, 0, None) * HEATING_DAILY_SHAPE[HOUR_OF_DAY]
+        shape = shape + heating_share * heating / heating.sum()
+    
+    if water_share:
+        # Hot water needs are slightly higher in winter (colder inlet water)
+        water = WATER_HEATING_DAILY_SHAPE[HOUR_OF_DAY] * (1 + 0.2 * np.cos(2 * np.pi * (day - 15) / 365))
+        shape = shape + water_share * water / water.sum()
+    
+    shape.setflags(write=False)
+    return shape
+
+def build_load_profile(annual_consumption: float, heating_system: str, water_heating_system: str) -> np.ndarray:
+    """
+    Synthetic hourly consumption (kWh) for a client from their annual consumption and equipment
+    """
+    return annual_consumption * _load_profile_shape(heating_system or "", water_heating_system or "")
+
+def simulate_self_consumption(production: np.ndarray, load: np.ndarray) -> Dict[str, Any]:
+    """
+    Hour by hour self-consumption of a production profile against a load profile (kWh arrays)
+    Both profiles must be indexed by local civil hours, see fetch_pvgis_hourly_profile
+    """
+    self_consumed = np.minimum(production, load)
+    surplus = production - self_consumed
+    grid_import = load - self_consumed
+    
+    annual_production = float(production.sum())
+    annual_load = float(load.sum())
+    self_consumption_kwh = float(self_consumed.sum())
+    
+    return {
+        "annual_production": annual_production,
+        "annual_consumption": annual_load,
+        "autoconsumption_kwh": self_consumption_kwh,
+        "surplus_kwh": float(surplus.sum()),
+        "grid_import_kwh": float(grid_import.sum()),
+        # Share of the production used on site
+        "autoconsumption_rate": self_consumption_kwh / annual_production if annual_production > 0 else 0,
+        # Share of the consumption covered by the production
+        "autonomy_rate": self_consumption_kwh / annual_load if annual_load > 0 else 0,
+        "monthly": [
+            {"month": month + 1, "production": float(p), "autoconsumption": float(a), "surplus": float(s), "consumption": float(c)}
+            for month, (p, a, s, c) in enumerate(zip(
+                np.add.reduceat(production, MONTH_START_HOURS),
+                np.add.reduceat(self_consumed, MONTH_START_HOURS),
+                np.add.reduceat(surplus, MONTH_START_HOURS),
+                np.add.reduceat(load, MONTH_START_HOURS)
+            ))
+        ]
+    }
+
+async def run_hourly_simulation(client: dict, kit_power: int, annual_production: Optional[float] = None,
+                                client_mode: str = "particuliers", estimate: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Simulate the self-consumption of a kit for a client over the 8760 hours of a year
+    When annual_production is given (PVcalc result) the hourly profile is rescaled to it
+    With an estimate (see estimate_pvgis_data) the profile is built locally, PVGIS is not called
+    """
+    if estimate:
+        production, source, split = estimate_hourly_production(client, estimate), "estimate", None
+    else:
+        production, source, split = await get_kit_production_profile(client, kit_power, client_mode)
+    if annual_production and production.sum() > 0:
+        production = production * (annual_production / production.sum())
+    
+    load = build_load_profile(client['annual_consumption_kwh'], client.get('heating_system'), client.get('water_heating_system'))
+    
+    simulation = simulate_self_consumption(production, load)
+    simulation["production_source"] = source
+    if split:
+        simulation["roof_sections"] = split
+    return simulation
+
+# Battery storage
+BATTERY_CAPACITIES_KWH = [0, 2.5, 5, 7.5, 10, 12.5, 15]  # Default sizing sweep
+BATTERY_MAX_CAPACITIES = 20  # Capacities accepted in one sweep, the hour loop cost grows with them
+BATTERY_CHARGE_EFFICIENCY = 0.95
+BATTERY_DISCHARGE_EFFICIENCY = 0.95  # ~90% round trip
+BATTERY_C_RATE = 0.5  # Max charge/discharge power as a share of the capacity per hour
+BATTERY_PRICE_PER_KWH = 750  # € TTC installed, for the payback estimate
+
+def validate_battery_capacities(capacities: List[float]) -> np.ndarray:
+    """
+    Battery capacities of a sweep as an array, rejected with a 400 when empty, too many or negative
+    """
+    capacities = np.asarray(capacities, dtype=np.float64)
+    if not 1 <= capacities.size <= BATTERY_MAX_CAPACITIES:
+        raise HTTPException(status_code=400, detail=f"Pass between 1 and {BATTERY_MAX_CAPACITIES} battery capacities")
+    if not np.all(np.isfinite(capacities) & (capacities >= 0)):
+        raise HTTPException(status_code=400, detail="Battery capacities must be positive kWh values")
+    return capacities
+
+def simulate_battery_sweep(production: np.ndarray, load: np.ndarray, capacities: List[float]) -> Dict[str, np.ndarray]:
+    """
+    Battery dispatch over the 8760 hours for several capacities at once
+    The battery charges from surplus and discharges to cover the load, the state of charge
+    of every capacity is advanced together so the hour loop runs only once
+    Returns annual kWh arrays indexed like capacities
+    """
+    capacities = validate_battery_capacities(capacities)
+    max_power = capacities * BATTERY_C_RATE
+    
+    net = production - load
+    surplus = np.clip(net, 0, None)
+    deficit = np.clip(-net, 0, None)
+    
+    state_of_charge = np.zeros_like(capacities)
+    charged = np.zeros_like(capacities)  # kWh taken from the PV surplus
+    discharged = np.zeros_like(capacities)  # kWh delivered to the load
+    
+    for hour_surplus, hour_deficit in zip(surplus.tolist(), deficit.tolist()):
+        if hour_surplus > 0:
+            taken = np.minimum(np.minimum(max_power, hour_surplus), (capacities - state_of_charge) / BATTERY_CHARGE_EFFICIENCY)
+            state_of_charge += taken * BATTERY_CHARGE_EFFICIENCY
+            charged += taken
+        elif hour_deficit > 0:
+            delivered = np.minimum(np.minimum(max_power, hour_deficit), state_of_charge * BATTERY_DISCHARGE_EFFICIENCY)
+            state_of_charge -= delivered / BATTERY_DISCHARGE_EFFICIENCY
+            discharged += delivered
+    
+    direct = float(np.minimum(production, load).sum())
+    return {
+        "capacities": capacities,
+        "charged_kwh": charged,
+        "discharged_kwh": discharged,
+        "autoconsumption_kwh": direct + discharged,
+        "surplus_kwh": float(surplus.sum()) - charged,
+        "grid_import_kwh": float(deficit.sum()) - discharged
+    }
+
+async def run_battery_sizing(client: dict, kit_power: int, capacities: List[float], client_mode: str = "particuliers") -> Dict[str, Any]:
+    """
+    Compare battery capacities for a client: self-consumption, autonomy and extra savings
+    """
+    aids_config = get_aids_by_mode(client_mode)
+    edf_rate = aids_config['edf_rate']
+    surplus_sale_rate = aids_config['surplus_sale_rate']
+    
+    production, source, _ = await get_kit_production_profile(client, kit_power, client_mode)
+    load = build_load_profile(client['annual_consumption_kwh'], client.get('heating_system'), client.get('water_heating_system'))
+    
+    sweep = simulate_battery_sweep(production, load, capacities)
+    annual_production = float(production.sum())
+    annual_load = float(load.sum())
+    
+    # Each kWh shifted by the battery is bought less from EDF but no longer sold as surplus
+    extra_savings = sweep['discharged_kwh'] * edf_rate - sweep['charged_kwh'] * surplus_sale_rate
+    battery_prices = sweep['capacities'] * BATTERY_PRICE_PER_KWH
+    
+    options = []
+    for index, capacity in enumerate(sweep['capacities'].tolist()):
+        autoconsumption_kwh = float(sweep['autoconsumption_kwh'][index])
+        options.append({
+            "battery_capacity_kwh": capacity,
+            "autoconsumption_kwh": round(autoconsumption_kwh, 1),
+            "surplus_kwh": round(float(sweep['surplus_kwh'][index]), 1),
+            "grid_import_kwh": round(float(sweep['grid_import_kwh'][index]), 1),
+            "autoconsumption_rate": round(autoconsumption_kwh / annual_production * 100, 1) if annual_production > 0 else 0,
+            "autonomy_percentage": round(autoconsumption_kwh / annual_load * 100, 1) if annual_load > 0 else 0,
+            "extra_annual_savings": round(float(extra_savings[index]), 2),
+            "battery_price": round(float(battery_prices[index]), 2),
+            "payback_years": round(float(battery_prices[index] / extra_savings[index]), 1) if capacity > 0 and extra_savings[index] > 0 else None
+        })
+    
+    return {
+        "kit_power": kit_power,
+        "annual_production": round(annual_production, 1),
+        "annual_consumption": round(annual_load, 1),
+        # Same formula as the calculation endpoints, for comparison
+        "autonomy_percentage": min(95, (annual_production / annual_load) * 100) if annual_load > 0 else 0,
+        "production_source": source,
+        "battery_options": options
+    }
+
+def get_solar_kits_by_mode(client_mode: str = "particuliers"):
+    """
+    Get solar kits based on client mode
+    """
+    if client_mode == "professionnels":
+        return SOLAR_KITS_PROFESSIONNELS
+    else:
+        return SOLAR_KITS_PARTICULIERS
+
+def get_professional_kit_price(kit_info: dict, price_level: str = "base") -> float:
+    """
+    Get professional kit price based on price level
+    price_level: "base", "remise", "remise_max"
+    """
+    if price_level == "remise":
+        return kit_info.get('tarif_remise_ht', kit_info.get('tarif_base_ht', 0))
+    elif price_level == "remise_max":
+        return kit_info.get('tarif_remise_max_ht', kit_info.get('tarif_base_ht', 0))
+    else:  # base
+        return kit_info.get('tarif_base_ht', 0)
+
+def get_professional_commission(kit_info: dict, price_level: str = "base") -> float:
+    """
+    Get professional commission based on price level
+    """
+    if price_level == "remise_max":
+        return kit_info.get('commission_remise_max', kit_info.get('commission_normale', 0))
+    else:  # base or remise
+        return kit_info.get('commission_normale', 0)
+
+def get_aids_by_mode(client_mode: str = "particuliers"):
+    """
+    Get aids configuration based on client mode
+    """
+    if client_mode == "professionnels":
+        return {
+            "autoconsumption_aid_rate": AUTOCONSUMPTION_AID_PROFESSIONNELS,
+            "tva_rate": TVA_RATE_PROFESSIONNELS,
+            "amortissement_accelere": AMORTISSEMENT_ACCELERE,
+            "autoconsumption_rate": AUTOCONSUMPTION_RATE_PROFESSIONNELS,
+            "edf_rate": EDF_RATE_PER_KWH_PROFESSIONNELS,
+            "surplus_sale_rate": SURPLUS_SALE_RATE_PROFESSIONNELS
+        }
+    else:
+        return {
+            "autoconsumption_aid_rate": AUTOCONSUMPTION_AID_PARTICULIERS,
+            "tva_rate": TVA_RATE_PARTICULIERS,
+            "amortissement_accelere": 0,
+            "autoconsumption_rate": AUTOCONSUMPTION_RATE_PARTICULIERS,
+            "edf_rate": EDF_RATE_PER_KWH,
+            "surplus_sale_rate": SURPLUS_SALE_RATE
+        }
+
+def calculate_optimal_kit_size(annual_consumption: float, roof_surface: float, client_mode: str = "particuliers") -> int:
+    """
+    Calculate optimal kit size based on consumption and roof space
+    """
+    # Each panel is 2.1 m² and 0.5 kW
+    max_panels_by_surface = int(roof_surface / 2.1)
+    max_power_by_surface = max_panels_by_surface * 0.5
+    
+    # Target 80-100% of annual consumption
+    target_power_by_consumption = annual_consumption / 1200  # Assuming ~1200 kWh/kW/year in France
+    
+    # Choose the limiting factor
+    target_power = min(max_power_by_surface, target_power_by_consumption * 1.1)  # 110% buffer
+    
+    # Find the closest available kit based on client mode
+    available_kits = get_solar_kits_by_mode(client_mode)
+    available_powers = list(available_kits.keys())
+    best_power = min(available_powers, key=lambda x: abs(x - target_power))
+    
+    return best_power
+
+def calculate_financing_options(kit_price: float, monthly_savings: float) -> List[Dict]:
+    """
+    Calculate financing options from 6 to 15 years
+    """
+    taeg = TAEG_CREDIT
+    monthly_rate = taeg / 12
+    options = []
+    
+    for years in range(6, 16):  # 6 to 15 years
+        months = years * 12
+        
+        if monthly_rate > 0:
+            # Standard loan calculation
+            monthly_payment = kit_price * (monthly_rate * (1 + monthly_rate)**months) / ((1 + monthly_rate)**months - 1)
+        else:
+            monthly_payment = kit_price / months
+        
+        # Calculate if it's close to the monthly savings
+        savings_ratio = monthly_payment / monthly_savings if monthly_savings > 0 else float('inf')
+        
+        options.append({
+            "duration_years": years,
+            "duration_months": months,
+            "monthly_payment": round(monthly_payment, 2),
+            "savings_ratio": round(savings_ratio, 2),
+            "difference_vs_savings": round(monthly_payment - monthly_savings, 2)
+        })
+    
+    return options
+
+def calculate_financing_with_aids(kit_price: float, total_aids: float, monthly_savings: float) -> Dict:
+    """
+    Calculate financing options with aids deducted - WITH INTERESTS
+    """
+    taeg = TAEG_CREDIT_WITH_AIDS
+    monthly_rate = taeg / 12
+    
+    # Amount to finance after aids
+    financed_amount = kit_price - total_aids
+    
+    # Calculate for 15 years (180 months) as shown in the screenshot
+    years = 15
+    months = years * 12
     
     if monthly_rate > 0:
         # Standard loan calculation WITH INTERESTS
@@ -725,7 +2592,7 @@ def calculate_all_financing_with_aids(kit_price: float, total_aids: float, month
     """
     Calculate financing options with aids deducted for all durations (6-15 years) - WITH INTERESTS
     """
-    taeg = 0.0325  # 3.25% TAEG (taux réduit avec aides)
+    taeg = TAEG_CREDIT_WITH_AIDS
     monthly_rate = taeg / 12
     
     # Amount to finance after aids
@@ -742,424 +2609,1871 @@ def calculate_all_financing_with_aids(kit_price: float, total_aids: float, month
         else:
             monthly_payment_with_interests = financed_amount / months
         
-        options.append({
-            "duration_years": years,
-            "duration_months": months,
-            "monthly_payment": round(monthly_payment_with_interests, 2),
-            "total_interests": round((monthly_payment_with_interests * months) - financed_amount, 2),
-            "difference_vs_savings": round(monthly_payment_with_interests - monthly_savings, 2)
-        })
+        options.append({
+            "duration_years": years,
+            "duration_months": months,
+            "monthly_payment": round(monthly_payment_with_interests, 2),
+            "total_interests": round((monthly_payment_with_interests * months) - financed_amount, 2),
+            "difference_vs_savings": round(monthly_payment_with_interests - monthly_savings, 2)
+        })
+    
+    return options
+
+# Cash-flow projection
+PROJECTION_YEARS = 25  # Panel production warranty
+MAX_PROJECTION_YEARS = 50  # Upper bound accepted by the endpoints
+PANEL_DEGRADATION_RATE = 0.005  # 0.5% production loss per year
+FINANCING_MODES = ["credit", "cash", "leasing"]
+
+def project_cash_flows(self_consumption_savings, surplus_revenue, upfront_cost, aids, monthly_payment, payment_months,
+                       years: int = PROJECTION_YEARS, rate_increase=ANNUAL_RATE_INCREASE,
+                       degradation: float = PANEL_DEGRADATION_RATE,
+                       production_factors: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Year by year cash flows of one or many installations
+    Inputs are scalars or arrays of shape (n_clients,), outputs are arrays of shape (n_clients, years)
+    - self_consumption_savings: first year value of the self-consumed kWh, escalates with the EDF rate
+    - surplus_revenue: first year surplus sales, the purchase tariff is fixed by contract
+    - upfront_cost / aids: paid / received during the first year
+    - monthly_payment / payment_months: loan or leasing outflows
+    - rate_increase: yearly EDF rate increase, scalar or per client
+    - production_factors: optional (n_clients, years) multipliers of the production (weather years)
+    """
+    self_consumption_savings, surplus_revenue, upfront_cost, aids, monthly_payment, payment_months, rate_increase = (
+        np.atleast_1d(np.asarray(value, dtype=np.float64))[:, None]
+        for value in (self_consumption_savings, surplus_revenue, upfront_cost, aids, monthly_payment, payment_months, rate_increase)
+    )
+    year = np.arange(years)[None, :]
+    
+    production_factor = (1 - degradation) ** year
+    if production_factors is not None:
+        production_factor = production_factor * production_factors
+    savings = (self_consumption_savings * (1 + rate_increase) ** year + surplus_revenue) * production_factor
+    
+    # Months of payments falling in each year
+    months_paid = np.clip(payment_months - 12 * year, 0, 12)
+    payments = monthly_payment * months_paid
+    shape = np.broadcast_shapes(savings.shape, payments.shape)
+    savings = np.broadcast_to(savings, shape)
+    payments = np.broadcast_to(payments, shape)
+    
+    net = savings - payments
+    net[:, 0] += (aids - upfront_cost)[:, 0]
+    cumulative = np.cumsum(net, axis=1)
+    
+    # Payback is when the balance turns positive for good, interpolated within the year
+    negative = cumulative < 0
+    ever_negative = negative.any(axis=1)
+    last_negative = years - 1 - np.argmax(negative[:, ::-1], axis=1)
+    next_year = np.minimum(last_negative + 1, years - 1)[:, None]
+    deficit = -np.take_along_axis(cumulative, last_negative[:, None], axis=1)[:, 0]
+    recovered = np.take_along_axis(net, next_year, axis=1)[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        payback_years = np.where(ever_negative, last_negative + 1 + deficit / recovered, 0.0)
+    payback_years[negative[:, -1]] = np.nan  # Never paid back within the projection
+    
+    total_savings = savings.sum(axis=1)
+    total_outflows = payments.sum(axis=1) + upfront_cost[:, 0]
+    net_gain = cumulative[:, -1]
+    total_outflows = np.broadcast_to(total_outflows, net_gain.shape)
+    roi = np.divide(net_gain, total_outflows, out=np.full_like(net_gain, np.nan), where=total_outflows > 0)
+    
+    return {
+        "savings": savings,
+        "payments": payments,
+        "net": net,
+        "cumulative": cumulative,
+        "payback_years": payback_years,
+        "total_savings": total_savings,
+        "total_outflows": total_outflows,
+        "net_gain": net_gain,
+        "roi": roi
+    }
+
+def get_cash_flow_inputs(calculation: dict, financing: str = "credit", duration_months: Optional[int] = None) -> Dict[str, float]:
+    """
+    Cash flow inputs of a calculation result (from /calculate or /calculate-professional)
+    financing: "credit" (loan with aids deducted), "cash" or "leasing" (professionals)
+    """
+    aids_config = calculation.get('aids_config') or get_aids_by_mode(calculation.get('client_mode', 'particuliers'))
+    inputs = {
+        "self_consumption_savings": calculation['autoconsumption_kwh'] * aids_config['edf_rate'],
+        "surplus_revenue": calculation['surplus_kwh'] * aids_config['surplus_sale_rate'],
+        "upfront_cost": 0.0,
+        "aids": 0.0,
+        "monthly_payment": 0.0,
+        "payment_months": 0
+    }
+    
+    if financing == "cash":
+        inputs["upfront_cost"] = calculation['kit_price']
+        inputs["aids"] = calculation.get('total_aids', 0)
+    elif financing == "leasing":
+        options = calculation.get('leasing_options') or calculate_leasing_options(calculation['kit_price'])
+        if duration_months:
+            options = [option for option in options if option['duration_months'] == duration_months]
+        if not options:
+            raise HTTPException(status_code=400, detail="No leasing option available for this kit and duration")
+        inputs["monthly_payment"] = options[0]['monthly_payment']
+        inputs["payment_months"] = options[0]['duration_months']
+        inputs["aids"] = calculation.get('total_aids', 0)
+    else:
+        # Aids are deducted from the financed amount (réinjection des aides)
+        if duration_months:
+            options = [option for option in calculate_all_financing_with_aids(calculation['kit_price'], calculation.get('total_aids', 0), calculation['monthly_savings'])
+                       if option['duration_months'] == duration_months]
+            if not options:
+                raise HTTPException(status_code=400, detail="Credit duration must be between 72 and 180 months in whole years")
+            loan = options[0]
+        else:
+            loan = calculation.get('financing_with_aids') or calculate_financing_with_aids(
+                calculation['kit_price'], calculation.get('total_aids', 0), calculation['monthly_savings']
+            )
+        inputs["monthly_payment"] = loan['monthly_payment']
+        inputs["payment_months"] = loan['duration_months']
+    
+    return inputs
+
+# Monte Carlo uncertainty
+MONTE_CARLO_DRAWS = 10000
+IRRADIANCE_VARIABILITY = 0.05  # Std dev of a year's production around the PVGIS average
+RATE_INCREASE_UNCERTAINTY = 0.02  # Std dev of the yearly EDF rate increase
+AUTOCONSUMPTION_RATE_UNCERTAINTY = 0.05  # Std dev of the autoconsumption rate
+UNCERTAINTY_PERCENTILES = [10, 50, 90]
+
+def finite_or_none(value: float, digits: int) -> Optional[float]:
+    """Rounded value, None for inf / nan which JSON cannot encode"""
+    return round(float(value), digits) if np.isfinite(value) else None
+
+def simulate_monte_carlo(calculation: dict, financing: str = "credit", draws: int = MONTE_CARLO_DRAWS,
+                         years: int = PROJECTION_YEARS, seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Percentile bands of production, savings and payback for a calculation result
+    Samples inter-annual irradiance, EDF rate escalation and the autoconsumption rate,
+    every draw is projected in the same broadcast call
+    P90 follows the solar convention: value exceeded in 90% of the draws (10th percentile)
+    """
+    rng = np.random.default_rng(seed)
+    inputs = get_cash_flow_inputs(calculation, financing)
+    aids_config = calculation.get('aids_config') or get_aids_by_mode(calculation.get('client_mode', 'particuliers'))
+    annual_production = calculation['estimated_production']
+    base_rate = calculation['autoconsumption_kwh'] / annual_production if annual_production > 0 else 0
+    
+    production_factors = np.clip(rng.normal(1, IRRADIANCE_VARIABILITY, (draws, years)), 0.7, 1.3)
+    rate_increase = rng.normal(ANNUAL_RATE_INCREASE, RATE_INCREASE_UNCERTAINTY, draws)
+    autoconsumption_rate = np.clip(rng.normal(base_rate, AUTOCONSUMPTION_RATE_UNCERTAINTY, draws), 0, 1)
+    
+    projection = project_cash_flows(
+        self_consumption_savings=annual_production * autoconsumption_rate * aids_config['edf_rate'],
+        surplus_revenue=annual_production * (1 - autoconsumption_rate) * aids_config['surplus_sale_rate'],
+        upfront_cost=inputs['upfront_cost'],
+        aids=inputs['aids'],
+        monthly_payment=inputs['monthly_payment'],
+        payment_months=inputs['payment_months'],
+        years=years,
+        rate_increase=rate_increase,
+        production_factors=production_factors
+    )
+    
+    # Never paid back within the projection counts as the longest payback
+    payback = np.where(np.isnan(projection['payback_years']), np.inf, projection['payback_years'])
+    
+    def bands(values: np.ndarray, digits: int = 2) -> Dict[str, Optional[float]]:
+        return {
+            f"p{100 - percentile}": finite_or_none(value, digits)
+            for percentile, value in zip(UNCERTAINTY_PERCENTILES, np.percentile(values, UNCERTAINTY_PERCENTILES, axis=0))
+        }
+    
+    # For payback lower is better, so P90 (90% chance of doing at least as well) is the 90th percentile
+    # "higher" picks an actual draw: interpolating next to never paid back draws (inf) would give nan,
+    # a band beyond the projection is reported as None
+    payback_bands = {
+        f"p{percentile}": finite_or_none(value, 1)
+        for percentile, value in zip(UNCERTAINTY_PERCENTILES, np.percentile(payback, UNCERTAINTY_PERCENTILES, method="higher"))
+    }
+    cumulative_bands = np.percentile(projection['cumulative'], UNCERTAINTY_PERCENTILES, axis=0)
+    
+    return {
+        "draws": draws,
+        "financing": financing,
+        "years": years,
+        "first_year_production": bands(annual_production * production_factors[:, 0], 0),
+        "first_year_savings": bands(projection['savings'][:, 0]),
+        "total_savings": bands(projection['total_savings']),
+        "net_gain": bands(projection['net_gain']),
+        "payback_years": payback_bands,
+        "probability_paid_back": round(float(np.isfinite(payback).mean()), 3),
+        "cumulative_balance": {
+            f"p{100 - percentile}": band.round(2).tolist()
+            for percentile, band in zip(UNCERTAINTY_PERCENTILES, cumulative_bands)
+        }
+    }
+
+# Sensitivity analysis
+SENSITIVITY_STEPS = [-0.2, -0.1, 0.1, 0.2]  # Relative changes applied to each input
+PRICE_LEVELS = ["base", "remise", "remise_max"]
+
+def loan_monthly_payments(principal, taeg, months) -> np.ndarray:
+    """
+    Vectorized version of the loan formula used by the financing functions
+    """
+    principal, taeg, months = np.broadcast_arrays(*(np.asarray(value, dtype=np.float64) for value in (principal, taeg, months)))
+    monthly_rate = taeg / 12
+    growth = (1 + monthly_rate) ** months
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(monthly_rate > 0, principal * monthly_rate * growth / (growth - 1), principal / months)
+
+def run_sensitivity_analysis(calculation: dict, financing: str = "credit", steps: List[float] = SENSITIVITY_STEPS,
+                             years: int = PROJECTION_YEARS) -> Dict[str, Any]:
+    """
+    Tornado chart data: impact of each input on monthly savings and payback, one input at a time
+    Every scenario reuses the calculation's production and is evaluated in one batch
+    """
+    aids_config = calculation.get('aids_config') or get_aids_by_mode(calculation.get('client_mode', 'particuliers'))
+    annual_production = calculation['estimated_production']
+    kit_price = calculation['kit_price']
+    total_aids = calculation.get('total_aids', 0)
+    # TVA refund follows the kit price, the autoconsumption aid does not
+    tva_ratio = calculation.get('tva_refund', 0) / kit_price if kit_price > 0 else 0
+    fixed_aids = total_aids - calculation.get('tva_refund', 0)
+    
+    if financing == "leasing":
+        options = calculation.get('leasing_options') or calculate_leasing_options(kit_price)
+        if not options:
+            raise HTTPException(status_code=400, detail="No leasing option available for this kit")
+        duration_months = options[0]['duration_months']
+        rate_parameter, base_rate = "leasing_rate", options[0]['rate']
+    else:
+        loan = calculation.get('financing_with_aids') or calculate_financing_with_aids(kit_price, total_aids, calculation['monthly_savings'])
+        duration_months = loan['duration_months']
+        rate_parameter, base_rate = "taeg", TAEG_CREDIT_WITH_AIDS
+    
+    base = {
+        "edf_rate": aids_config['edf_rate'],
+        "surplus_sale_rate": aids_config['surplus_sale_rate'],
+        "autoconsumption_rate": calculation['autoconsumption_kwh'] / annual_production if annual_production > 0 else 0,
+        "kit_price": kit_price
+    }
+    if financing != "cash":
+        base[rate_parameter] = base_rate
+    
+    # Scenario 0 is the base case, then each input is moved alone
+    scenarios = [("base", None, base)]
+    for parameter, base_value in base.items():
+        for step in steps:
+            values = dict(base)
+            values[parameter] = base_value * (1 + step)
+            if parameter == "autoconsumption_rate":
+                values[parameter] = min(values[parameter], 1)
+            scenarios.append((parameter, step, values))
+    
+    pricing_options = calculation.get('pricing_options')
+    if pricing_options:
+        for level in PRICE_LEVELS:
+            values = dict(base)
+            values["kit_price"] = get_professional_kit_price(pricing_options, level)
+            scenarios.append(("price_level", level, values))
+    
+    columns = {parameter: np.array([values[parameter] for _, _, values in scenarios]) for parameter in base}
+    prices = columns["kit_price"]
+    aids = fixed_aids + tva_ratio * prices
+    
+    self_consumption_savings = annual_production * columns["autoconsumption_rate"] * columns["edf_rate"]
+    surplus_revenue = annual_production * (1 - columns["autoconsumption_rate"]) * columns["surplus_sale_rate"]
+    monthly_savings = (self_consumption_savings + surplus_revenue) / 12
+    
+    upfront_cost = np.zeros_like(prices)
+    aids_received = np.zeros_like(prices)
+    payment_months = np.full_like(prices, duration_months if financing != "cash" else 0)
+    if financing == "cash":
+        monthly_payment = np.zeros_like(prices)
+        upfront_cost, aids_received = prices, aids
+    elif financing == "leasing":
+        # A new price can move the amount into another band of the leasing matrix
+        rates = np.array([
+            values["leasing_rate"] if parameter == "leasing_rate" else (get_leasing_rate(values["kit_price"], duration_months) or np.nan)
+            for parameter, _, values in scenarios
+        ])
+        monthly_payment = prices * rates / 100
+        aids_received = aids
+    else:
+        # Aids are deducted from the financed amount (réinjection des aides)
+        monthly_payment = loan_monthly_payments(prices - aids, columns["taeg"], duration_months)
+    
+    projection = project_cash_flows(
+        self_consumption_savings, surplus_revenue, upfront_cost, aids_received,
+        np.nan_to_num(monthly_payment), payment_months, years=years
+    )
+    payback = projection['payback_years']
+    
+    def scenario_result(index: int) -> Dict[str, Any]:
+        return {
+            "monthly_savings": round(float(monthly_savings[index]), 2),
+            "monthly_payment": optional_float(monthly_payment[index]),
+            "payback_years": optional_float(payback[index], 1),
+            "net_gain": round(float(projection['net_gain'][index]), 2)
+        }
+    
+    parameters = {}
+    for index, (parameter, change, values) in enumerate(scenarios[1:], start=1):
+        entry = parameters.setdefault(parameter, {
+            "parameter": parameter,
+            "base_value": base.get(parameter, calculation.get('price_level')),
+            "scenarios": []
+        })
+        result = scenario_result(index)
+        result.update({
+            "change": change,
+            "value": values["kit_price"] if parameter == "price_level" else values[parameter],
+            "monthly_savings_delta": round(float(monthly_savings[index] - monthly_savings[0]), 2),
+            "payback_delta": optional_float(payback[index] - payback[0], 1)
+        })
+        entry["scenarios"].append(result)
+    
+    # Tornado ordering: widest swing first
+    for entry in parameters.values():
+        savings_values = [scenario["monthly_savings"] for scenario in entry["scenarios"]]
+        paybacks = [scenario["payback_years"] for scenario in entry["scenarios"] if scenario["payback_years"] is not None]
+        entry["monthly_savings_swing"] = round(max(savings_values) - min(savings_values), 2)
+        entry["payback_swing"] = round(max(paybacks) - min(paybacks), 1) if paybacks else None
+    
+    return {
+        "financing": financing,
+        "steps": steps,
+        "base": scenario_result(0),
+        "parameters": sorted(
+            parameters.values(),
+            key=lambda entry: (entry["monthly_savings_swing"], entry["payback_swing"] or 0),
+            reverse=True
+        )
+    }
+
+# Kit comparison and optimisation
+PANEL_SURFACE_M2 = 2.1  # Surface of one 500W panel
+VELUX_SURFACE_M2 = 1.5  # Roof surface lost around each roof window
+OPTIMISATION_OBJECTIVES = ["net_savings", "payback", "leasing_benefit"]
+
+def get_kit_catalog_arrays(client_mode: str = "particuliers", price_level: str = "base") -> Dict[str, np.ndarray]:
+    """
+    Kit catalog of a mode as column arrays (one entry per kit, sorted by power)
+    """
+    solar_kits = get_solar_kits_by_mode(client_mode)
+    powers = sorted(solar_kits)
+    if client_mode == "professionnels":
+        prices = [get_professional_kit_price(solar_kits[power], price_level) for power in powers]
+        commissions = [get_professional_commission(solar_kits[power], price_level) for power in powers]
+        aids = [solar_kits[power].get('prime', 0) for power in powers]
+    else:
+        prices = [solar_kits[power]['price'] for power in powers]
+        commissions = [0] * len(powers)
+        aids_config = get_aids_by_mode(client_mode)
+        aids = [
+            power * aids_config['autoconsumption_aid_rate'] + (solar_kits[power]['price'] * aids_config['tva_rate'] if power > 3 else 0)
+            for power in powers
+        ]
+    panels = [solar_kits[power]['panels'] for power in powers]
+    return {
+        "power": np.array(powers, dtype=np.float64),
+        "panels": np.array(panels, dtype=np.float64),
+        "surface": np.array([solar_kits[power].get('surface', count * PANEL_SURFACE_M2) for power, count in zip(powers, panels)], dtype=np.float64),
+        "price": np.array(prices, dtype=np.float64),
+        "commission": np.array(commissions, dtype=np.float64),
+        "aids": np.array(aids, dtype=np.float64)
+    }
+
+async def get_site_specific_yield(client: dict) -> Tuple[float, str]:
+    """
+    Annual kWh per kWp of the client's roof, from the stored calculation or a single PVGIS call
+    The stored calculation is only reused when it was made for the current roof sections, aspect and tilt
+    """
+    calculation = client.get('last_calculation')
+    if calculation and calculation.get('kit_power') and calculation.get('roof_geometry') == get_roof_sections(client):
+        return calculation['estimated_production'] / calculation['kit_power'], "calculation"
+    pvgis_data = await get_roof_pvgis_data(client, 1)
+    return pvgis_data["specific_production"], "pvgis"
+
+def usable_roof_surface(client: dict) -> float:
+    """
+    Roof surface available for panels once the roof windows are kept clear
+    """
+    return max(0.0, get_roof_surface(client) - (client.get('velux_count') or 0) * VELUX_SURFACE_M2)
+
+async def evaluate_kit_catalog(client: dict, client_mode: str = "particuliers", price_level: str = "base",
+                               hourly_simulation: bool = False) -> Dict[str, Any]:
+    """
+    Economics of every kit of the catalog for a client as arrays (one entry per kit)
+    All kits share the site's specific yield and are evaluated together
+    On split roofs each kit fills the best yielding sections first
+    """
+    catalog = get_kit_catalog_arrays(client_mode, price_level)
+    aids_config = get_aids_by_mode(client_mode)
+    annual_consumption = client['annual_consumption_kwh']
+    power = catalog['power']
+    
+    if client.get('roof_sections'):
+        # (kits x sections) power split, then (kits x sections) @ (sections x 8760) when simulating hourly
+        sections, profiles, _ = await get_roof_section_profiles(client)
+        section_yields = profiles.sum(axis=1)
+        shares = roof_section_shares(allocate_roof_surface(
+            catalog['surface'], np.array([section['surface'] for section in sections]), section_yields
+        ))
+        production = power * (shares @ section_yields)
+        specific_yield = float(production.sum() / power.sum())
+        yield_source = "roof_sections"
+        kit_profiles = (shares * power[:, None]) @ profiles if hourly_simulation else None
+    else:
+        specific_yield, yield_source = await get_site_specific_yield(client)
+        production = specific_yield * power
+        kit_profiles = None
+        if hourly_simulation:
+            # (kits x 8760) production matrix against the same load
+            profile, _, _ = await get_kit_production_profile(client, 1, client_mode)
+            profile = profile * (specific_yield / profile.sum()) if profile.sum() > 0 else profile
+            kit_profiles = power[:, None] * profile[None, :]
+    
+    if hourly_simulation:
+        load = build_load_profile(annual_consumption, client.get('heating_system'), client.get('water_heating_system'))
+        autoconsumption_kwh = np.minimum(kit_profiles, load[None, :]).sum(axis=1)
+    else:
+        autoconsumption_kwh = production * aids_config['autoconsumption_rate']
+    surplus_kwh = production - autoconsumption_kwh
+    
+    self_consumption_savings = autoconsumption_kwh * aids_config['edf_rate']
+    surplus_revenue = surplus_kwh * aids_config['surplus_sale_rate']
+    annual_savings = self_consumption_savings + surplus_revenue
+    
+    # Credit over 15 years with aids deducted, as calculate_financing_with_aids
+    credit_months = np.full_like(power, 180)
+    credit_payment = loan_monthly_payments(catalog['price'] - catalog['aids'], TAEG_CREDIT_WITH_AIDS, credit_months)
+    
+    # Lowest available leasing rent of each kit (NaN when the amount is outside the matrix)
+    leasing_payment = np.full_like(power, np.nan)
+    leasing_months = np.zeros_like(power)
+    leasing_rate = np.full_like(power, np.nan)
+    if client_mode == "professionnels":
+        for index, price in enumerate(catalog['price'].tolist()):
+            options = calculate_leasing_options(price)
+            if options:
+                best = min(options, key=lambda option: option['monthly_payment'])
+                leasing_payment[index] = best['monthly_payment']
+                leasing_months[index] = best['duration_months']
+                leasing_rate[index] = best['rate']
+    
+    return {
+        **catalog,
+        "specific_yield": specific_yield,
+        "yield_source": yield_source,
+        "production": production,
+        "autoconsumption_kwh": autoconsumption_kwh,
+        "surplus_kwh": surplus_kwh,
+        "self_consumption_savings": self_consumption_savings,
+        "surplus_revenue": surplus_revenue,
+        "annual_savings": annual_savings,
+        "monthly_savings": annual_savings / 12,
+        "autonomy_percentage": np.minimum(95, production / annual_consumption * 100),
+        "fits_roof": catalog['surface'] <= usable_roof_surface(client),
+        "credit_payment": credit_payment,
+        "credit_months": credit_months,
+        "leasing_payment": leasing_payment,
+        "leasing_months": leasing_months,
+        "leasing_rate": leasing_rate
+    }
+
+async def compare_kits(client: dict, client_mode: str = "particuliers", price_level: str = "base",
+                       hourly_simulation: bool = False) -> Dict[str, Any]:
+    """
+    Economics of every kit of the catalog for a client
+    """
+    kits_data = await evaluate_kit_catalog(client, client_mode, price_level, hourly_simulation)
+    recommended = calculate_optimal_kit_size(client['annual_consumption_kwh'], get_roof_surface(client), client_mode)
+    
+    kits = []
+    for index, kit_power in enumerate(kits_data['power'].astype(int).tolist()):
+        monthly_savings = float(kits_data['monthly_savings'][index])
+        credit_payment = float(kits_data['credit_payment'][index])
+        kit = {
+            "kit_power": kit_power,
+            "panel_count": int(kits_data['panels'][index]),
+            "surface": float(kits_data['surface'][index]),
+            "fits_roof": bool(kits_data['fits_roof'][index]),
+            "recommended": kit_power == recommended,
+            "kit_price": float(kits_data['price'][index]),
+            "total_aids": round(float(kits_data['aids'][index]), 2),
+            "estimated_production": round(float(kits_data['production'][index]), 1),
+            "autoconsumption_kwh": round(float(kits_data['autoconsumption_kwh'][index]), 1),
+            "surplus_kwh": round(float(kits_data['surplus_kwh'][index]), 1),
+            "autonomy_percentage": round(float(kits_data['autonomy_percentage'][index]), 1),
+            "estimated_savings": round(float(kits_data['annual_savings'][index]), 2),
+            "monthly_savings": round(monthly_savings, 2),
+            "financing_with_aids": {
+                "duration_months": int(kits_data['credit_months'][index]),
+                "monthly_payment": round(credit_payment, 2),
+                "difference_vs_savings": round(credit_payment - monthly_savings, 2)
+            }
+        }
+        if client_mode == "professionnels":
+            # Leasing fit: lowest available rent against the savings
+            leasing_payment = float(kits_data['leasing_payment'][index])
+            kit.update({
+                "commission": float(kits_data['commission'][index]),
+                "leasing": {
+                    "duration_months": int(kits_data['leasing_months'][index]),
+                    "rate": float(kits_data['leasing_rate'][index]),
+                    "monthly_payment": leasing_payment,
+                    "monthly_benefit": round(monthly_savings - leasing_payment, 2),
+                    "fits_savings": leasing_payment <= monthly_savings
+                } if not np.isnan(leasing_payment) else None
+            })
+        kits.append(kit)
+    
+    return {
+        "client_mode": client_mode,
+        "price_level": price_level,
+        "specific_yield": round(kits_data['specific_yield'], 1),
+        "yield_source": kits_data['yield_source'],
+        "usable_roof_surface": usable_roof_surface(client),
+        "recommended_kit_power": recommended,
+        "kits": kits
+    }
+
+async def optimise_kit(client: dict, objective: str = "net_savings", client_mode: str = "particuliers",
+                       price_level: str = "base", financing: Optional[str] = None, hourly_simulation: bool = False,
+                       require_financing_fit: bool = False) -> Dict[str, Any]:
+    """
+    Rank the kits that fit the roof by an exact objective instead of the nearest power heuristic
+    objective: "net_savings" (25 years net gain), "payback" or "leasing_benefit" (professionals)
+    """
+    if objective == "leasing_benefit" and client_mode != "professionnels":
+        raise HTTPException(status_code=400, detail="leasing_benefit objective is only available for professionnels")
+    financing = financing or ("leasing" if client_mode == "professionnels" else "credit")
+    
+    kits_data = await evaluate_kit_catalog(client, client_mode, price_level, hourly_simulation)
+    power = kits_data['power']
+    zeros = np.zeros_like(power)
+    
+    if financing == "leasing":
+        monthly_payment = kits_data['leasing_payment']
+        cash_flow_inputs = (zeros, kits_data['aids'], np.nan_to_num(monthly_payment), kits_data['leasing_months'])
+    elif financing == "cash":
+        monthly_payment = zeros
+        cash_flow_inputs = (kits_data['price'], kits_data['aids'], zeros, zeros)
+    else:
+        monthly_payment = kits_data['credit_payment']
+        cash_flow_inputs = (zeros, zeros, monthly_payment, kits_data['credit_months'])
+    
+    projection = project_cash_flows(kits_data['self_consumption_savings'], kits_data['surplus_revenue'], *cash_flow_inputs)
+    net_gain = projection['net_gain']
+    payback = projection['payback_years']
+    leasing_benefit = kits_data['monthly_savings'] - kits_data['leasing_payment']
+    financing_fit = monthly_payment <= kits_data['monthly_savings']
+    
+    # Higher score is better, kits that cannot be financed or never pay back come last
+    if objective == "payback":
+        score = np.where(np.isnan(payback), -np.inf, -payback)
+    elif objective == "leasing_benefit":
+        score = np.where(np.isnan(leasing_benefit), -np.inf, leasing_benefit)
+    else:
+        score = net_gain
+    if financing == "leasing":
+        score = np.where(np.isnan(kits_data['leasing_payment']), -np.inf, score)
+    
+    eligible = kits_data['fits_roof'] & (financing_fit if require_financing_fit else True)
+    # Ties (e.g. kits paid back from the first year) are broken by the net gain
+    ranking = [index for index in np.lexsort((-net_gain, -score)).tolist() if eligible[index]]
+    
+    ranked_kits = [
+        {
+            "rank": rank + 1,
+            "kit_power": int(power[index]),
+            "panel_count": int(kits_data['panels'][index]),
+            "surface": float(kits_data['surface'][index]),
+            "kit_price": float(kits_data['price'][index]),
+            "estimated_production": round(float(kits_data['production'][index]), 1),
+            "monthly_savings": round(float(kits_data['monthly_savings'][index]), 2),
+            "monthly_payment": optional_float(monthly_payment[index]),
+            "financing_fit": bool(financing_fit[index]),
+            "net_gain": round(float(net_gain[index]), 2),
+            "payback_years": optional_float(payback[index], 1),
+            "leasing_benefit": optional_float(leasing_benefit[index]) if client_mode == "professionnels" else None
+        }
+        for rank, index in enumerate(ranking)
+    ]
+    
+    return {
+        "objective": objective,
+        "financing": financing,
+        "client_mode": client_mode,
+        "price_level": price_level,
+        "specific_yield": round(kits_data['specific_yield'], 1),
+        "yield_source": kits_data['yield_source'],
+        "usable_roof_surface": usable_roof_surface(client),
+        "best_kit": ranked_kits[0] if ranked_kits else None,
+        "excluded_kits": len(power) - len(ranked_kits),
+        "kits": ranked_kits
+    }
+
+# Routes
+@api_router.get("/")
+async def root():
+    return {"message": "Solar Calculator API with PVGIS Integration"}
+
+@api_router.get("/solar-kits")
+async def get_solar_kits():
+    """Get available solar kits with pricing (legacy endpoint for particuliers)"""
+    return SOLAR_KITS_PARTICULIERS
+
+@api_router.get("/solar-kits/{client_mode}")
+async def get_solar_kits_by_client_mode(client_mode: str):
+    """Get available solar kits with pricing based on client mode"""
+    if client_mode not in ["particuliers", "professionnels"]:
+        raise HTTPException(status_code=400, detail="Invalid client mode. Use 'particuliers' or 'professionnels'")
+    
+    return get_solar_kits_by_mode(client_mode)
+
+@api_router.post("/clients", response_model=ClientInfo)
+async def create_client(client_data: ClientInfoCreate, deferred_geocoding: Optional[bool] = None):
+    """
+    Create a client
+    deferred_geocoding: insert right away and geocode in the background (defaults to DEFERRED_GEOCODING)
+    """
+    try:
+        client_dict = client_data.dict()
+        deferred = DEFERRED_GEOCODING if deferred_geocoding is None else deferred_geocoding
+        
+        if deferred:
+            client_dict['geocode_status'] = GEOCODE_PENDING
+        else:
+            # Geocode the address, repeated addresses are served by the geocode cache
+            location = await resolve_address(client_data.address)
+            client_dict.update(client_location_fields(location))
+        
+        client_obj = ClientInfo(**client_dict)
+        await timed("mongo_write", db.clients.insert_one(client_obj.dict()))
+        if deferred:
+            schedule_client_geocoding(client_obj.id, client_obj.address)
+        return client_obj
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Bulk lead import
+IMPORT_CHUNK_SIZE = 500  # Rows validated, geocoded and inserted together
+IMPORT_GEOCODE_CONCURRENCY = int(os.environ.get('IMPORT_GEOCODE_CONCURRENCY', 8))
+IMPORT_MAX_REPORTED_ERRORS = 1000
+IMPORT_FORMATS = ["csv", "ndjson"]
+
+async def iter_body_lines(request: Request):
+    """Lines of a request body, decoded as the chunks arrive"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')  # Characters may span chunks
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield pending.rstrip("\r")
+
+class CsvLineFeed:
+    """Lines handed to a csv.reader, refilled as the body arrives"""
+    
+    def __init__(self):
+        self.lines = deque()
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if not self.lines:
+            raise StopIteration  # The reader resumes on its next call once lines are added
+        return self.lines.popleft()
+
+async def iter_csv_records(request: Request):
+    """
+    Records of a CSV body parsed by a single csv.reader, quoted fields may span lines
+    Lines are handed over once their quotes are balanced, so that the reader never stops inside a record
+    Yields the list of values, or a parse error message
+    """
+    feed = CsvLineFeed()
+    reader = None
+    record = []  # Lines of the record being received
+    quotes = 0
+    
+    def parse():
+        try:
+            yield from reader
+        except csv.Error as e:
+            yield f"Invalid CSV: {e}"
+    
+    async for line in iter_body_lines(request):
+        if reader is None:
+            if not line.strip():
+                continue
+            # The delimiter is guessed from the header line
+            reader = csv.reader(feed, delimiter=";" if line.count(";") > line.count(",") else ",", strict=True)
+        record.append(line + "\n")
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        feed.lines.extend(record)
+        record, quotes = [], 0
+        for values in parse():
+            yield values
+    if record:
+        # Unterminated quoted field at the end of the body
+        feed.lines.extend(record)
+        for values in parse():
+            yield values
+
+async def iter_import_rows(request: Request, import_format: str):
+    """
+    Rows of a CSV (header line, comma or semicolon separated) or NDJSON (one object per line) body
+    Yields (row number, dict or parse error message)
+    """
+    row_number = 0
+    if import_format == "ndjson":
+        async for line in iter_body_lines(request):
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+                yield row_number, row if isinstance(row, dict) else "Row is not a JSON object"
+            except json.JSONDecodeError as e:
+                yield row_number, f"Invalid JSON: {e}"
+        return
+    
+    header = None
+    async for values in iter_csv_records(request):
+        if isinstance(values, list) and not any(value.strip() for value in values):
+            continue
+        if header is None and isinstance(values, list):
+            header = [name.strip() for name in values]
+            continue
+        row_number += 1
+        if isinstance(values, str):
+            yield row_number, values
+            continue
+        if len(values) != len(header):
+            yield row_number, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        row = {name: (value.strip() or None) for name, value in zip(header, values)}
+        if row.get('roof_sections'):
+            try:
+                row['roof_sections'] = json.loads(row['roof_sections'])
+            except json.JSONDecodeError as e:
+                yield row_number, f"Invalid roof_sections: {e}"
+                continue
+        yield row_number, row
+
+async def import_client_chunk(rows: List[Tuple[int, ClientInfoCreate]], semaphore: asyncio.Semaphore,
+                              report: Dict[str, Any]):
+    """
+    Geocode a chunk of validated rows (one call per distinct normalized address) and insert it
+    """
+    locations: Dict[str, asyncio.Task] = {}
+    
+    async def locate(address: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await resolve_address(address)
+    
+    for _, client_data in rows:
+        key, _ = normalize_address(client_data.address)
+        if key not in locations:
+            locations[key] = asyncio.ensure_future(locate(client_data.address))
+    await asyncio.gather(*locations.values(), return_exceptions=True)
+    
+    documents = []
+    document_rows = []  # Row number of each document
+    for row_number, client_data in rows:
+        task = locations[normalize_address(client_data.address)[0]]
+        if task.exception():
+            add_import_error(report, row_number, [{"field": "address", "message": f"Geocoding failed: {task.exception()}"}])
+            continue
+        location = task.result()
+        report["geocode_cache_hits"] += location['cached']
+        documents.append(ClientInfo(**client_data.dict(), **client_location_fields(location)).dict())
+        document_rows.append(row_number)
+    report["distinct_addresses"] += len(locations)
+    
+    if documents:
+        try:
+            await db.clients.insert_many(documents, ordered=False)
+            report["imported"] += len(documents)
+        except BulkWriteError as e:
+            # Unordered inserts go on after a failed document, only the failed ones are reported
+            report["imported"] += e.details.get("nInserted", 0)
+            for error in e.details.get("writeErrors", []):
+                add_import_error(report, document_rows[error['index']], [{"field": None, "message": error.get('errmsg', "Insert failed")}])
+
+def add_import_error(report: Dict[str, Any], row_number: int, errors: List[Dict[str, str]]):
+    """Record a rejected row, the detailed list is capped"""
+    report["failed"] += 1
+    if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+        report["errors"].append({"row": row_number, "errors": errors})
+
+@api_router.post("/clients/import")
+async def import_clients(request: Request, import_format: Optional[str] = Query(None, alias="format")):
+    """
+    Bulk import of ClientInfoCreate rows from a CSV or NDJSON body
+    format: "csv" or "ndjson", guessed from the Content-Type by default
+    Rows are parsed while the body is received and processed by chunks of IMPORT_CHUNK_SIZE;
+    invalid rows are reported without stopping the import
+    """
+    import_format = import_format or ("ndjson" if "json" in request.headers.get("content-type", "") else "csv")
+    if import_format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of {IMPORT_FORMATS}")
+    
+    try:
+        report = {"rows": 0, "imported": 0, "failed": 0, "distinct_addresses": 0, "geocode_cache_hits": 0, "errors": []}
+        semaphore = asyncio.Semaphore(IMPORT_GEOCODE_CONCURRENCY)
+        chunk: List[Tuple[int, ClientInfoCreate]] = []
+        
+        async for row_number, row in iter_import_rows(request, import_format):
+            report["rows"] += 1
+            if isinstance(row, str):
+                add_import_error(report, row_number, [{"field": None, "message": row}])
+                continue
+            try:
+                chunk.append((row_number, ClientInfoCreate(**row)))
+            except ValidationError as e:
+                add_import_error(report, row_number, [
+                    {"field": ".".join(str(part) for part in error['loc']), "message": error['msg']} for error in e.errors()
+                ])
+                continue
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                await import_client_chunk(chunk, semaphore, report)
+                chunk = []
+        if chunk:
+            await import_client_chunk(chunk, semaphore, report)
+        
+        return report
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Client import error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/clients", response_model=List[ClientInfo])
+async def get_clients():
+    try:
+        clients = await db.clients.find().to_list(1000)
+        return [ClientInfo(**client) for client in clients]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/clients/{client_id}", response_model=ClientInfo)
+async def get_client(client_id: str):
+    try:
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
+        return ClientInfo(**client)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/gazetteer/search")
+async def search_gazetteer(q: str, limit: int = 10):
+    """Commune autocomplete from the offline gazetteer: postcode, name prefix, then fuzzy matches"""
+    if not load_gazetteer():
+        raise HTTPException(status_code=503, detail="Gazetteer not available")
+    query = q.strip()
+    if query.isdigit():
+        communes = gazetteer_lookup_postcode(query) if len(query) == 5 else []
+    else:
+        communes = gazetteer_prefix(query, limit) or [index for index, score in gazetteer_fuzzy(query, limit=limit)
+                                                        if score >= GAZETTEER_MIN_SCORE]
+    return {"query": q, "communes": [gazetteer_commune(index) for index in communes[:limit]]}
+
+@api_router.post("/geocode-cache/re-resolve")
+async def reresolve_geocode_cache(limit: int = Query(100, ge=1, le=GEOCODE_RERESOLVE_MAX_LIMIT),
+                                  x_admin_token: Optional[str] = Header(default=None)):
+    """Retry the geocoding provider for cached fallback results and fix the affected clients (admin only)"""
+    require_admin(x_admin_token)
+    try:
+        return await reresolve_geocode_fallbacks(limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Geocode re-resolution error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@traced()
+async def compute_professional_solution(client: dict, price_level: str = "base", client_mode: Optional[str] = None,
+                                        hourly_simulation: bool = False) -> Dict[str, Any]:
+    """
+    Run the professional calculation for a client document without touching the database
+    price_level: "base", "remise", "remise_max"
+    hourly_simulation: use the 8760 hours simulation instead of the fixed autoconsumption rate
+    """
+    client_id = client['id']
+    await ensure_client_location(client)
+    
+    # Extract client data
+    annual_consumption = client['annual_consumption_kwh']
+    roof_surface = get_roof_surface(client)
+    orientation = client['roof_orientation']
+    lat = client['latitude']
+    lon = client['longitude']
+    client_mode = client_mode or client.get('client_mode', 'professionnels')
+    
+    # Get appropriate kits and aids configuration
+    solar_kits = get_solar_kits_by_mode(client_mode)
+    aids_config = get_aids_by_mode(client_mode)
+    
+    # Calculate optimal kit size
+    best_kit = calculate_optimal_kit_size(annual_consumption, roof_surface, client_mode)
+    kit_info = solar_kits[best_kit]
+    
+    # Get price based on level for professionals
+    if client_mode == "professionnels":
+        kit_price = get_professional_kit_price(kit_info, price_level)
+        commission = get_professional_commission(kit_info, price_level)
+    else:
+        kit_price = kit_info.get('price', 0)
+        commission = 0
+    
+    # Get PVGIS data
+    pvgis_data = await get_roof_pvgis_data(client, best_kit, client_mode)
+    engine_started = time.perf_counter()  # Everything below is the calculation engine
+    annual_production = pvgis_data["annual_production"]
+    pvgis_monthly_data = pvgis_data["monthly_data"].get("fixed", []) if isinstance(pvgis_data["monthly_data"], dict) else pvgis_data["monthly_data"]
+    
+    # Calculate autonomy percentage
+    autonomy_percentage = min(95, (annual_production / annual_consumption) * 100)
+    
+    # Calculate autoconsumption with correct rates by mode
+    autoconsumption_rate = aids_config['autoconsumption_rate']
+    edf_rate = aids_config['edf_rate']
+    surplus_sale_rate = aids_config['surplus_sale_rate']
+    
+    # Replace the fixed rate with the hour by hour simulation when requested
+    hourly = None
+    if hourly_simulation:
+        hourly = await run_hourly_simulation(client, best_kit, annual_production, client_mode)
+        autoconsumption_rate = hourly['autoconsumption_rate']
+    
+    autoconsumption_kwh = annual_production * autoconsumption_rate
+    surplus_kwh = annual_production * (1 - autoconsumption_rate)
+    
+    # Calculate savings with correct rates
+    annual_savings = (autoconsumption_kwh * edf_rate) + (surplus_kwh * surplus_sale_rate)
+    monthly_savings = annual_savings / 12
+    
+    # Calculate aids based on client mode
+    if client_mode == "professionnels":
+        # Pour les professionnels, utiliser la prime déjà calculée dans les kits
+        autoconsumption_aid_total = kit_info.get('prime', 0)
+        tva_refund = 0  # Pas de TVA pour les professionnels (récupérée par l'entreprise)
+    else:
+        # Pour les particuliers, calculer avec le taux habituel
+        autoconsumption_aid_total = best_kit * aids_config['autoconsumption_aid_rate']
+        tva_refund = kit_price * aids_config['tva_rate'] if best_kit > 3 else 0
+    
+    total_aids = autoconsumption_aid_total + tva_refund
+    
+    # Calculate financing options based on client mode
+    if client_mode == "professionnels":
+        # Pour les professionnels : utiliser le leasing
+        leasing_options = calculate_leasing_options(kit_price)
+        
+        # Trouver le MEILLEUR KITS OPTIMISE
+        optimal_kit = find_optimal_leasing_kit(solar_kits, monthly_savings, client_mode)
+        
+        result = {
+            "calculation_id": str(uuid.uuid4()),
+            "client_id": client_id,
+            "client_mode": client_mode,
+            "price_level": price_level,
+            "kit_power": best_kit,
+            "panel_count": kit_info['panels'],
+            "surface": kit_info.get('surface', 0),
+            "estimated_production": annual_production,
+            "estimated_savings": annual_savings,
+            "autonomy_percentage": autonomy_percentage,
+            "monthly_savings": monthly_savings,
+            "kit_price": kit_price,
+            "commission": commission,
+            "autoconsumption_kwh": autoconsumption_kwh,
+            "surplus_kwh": surplus_kwh,
+            "autoconsumption_aid": autoconsumption_aid_total,
+            "tva_refund": tva_refund,
+            "total_aids": total_aids,
+            "leasing_options": leasing_options,
+            "optimal_kit": optimal_kit,
+            "pvgis_monthly_data": pvgis_monthly_data,
+            "pvgis_source": "Données source PVGIS Commission Européenne",
+            "production_source": pvgis_data.get("production_source", "pvgis"),
+            "orientation": orientation,
+            "roof_geometry": get_roof_sections(client),
+            "coordinates": {"lat": lat, "lon": lon},
+            "aids_config": aids_config,
+            "pricing_options": {
+                "tarif_base_ht": kit_info.get('tarif_base_ht', 0),
+                "tarif_remise_ht": kit_info.get('tarif_remise_ht', 0),
+                "tarif_remise_max_ht": kit_info.get('tarif_remise_max_ht', 0),
+                "commission_normale": kit_info.get('commission_normale', 0),
+                "commission_remise_max": kit_info.get('commission_remise_max', 0)
+            }
+        }
+    else:
+        # Pour les particuliers : utiliser le crédit classique
+        financing_with_aids = calculate_financing_with_aids(kit_price, total_aids, monthly_savings)
+        all_financing_with_aids = calculate_all_financing_with_aids(kit_price, total_aids, monthly_savings)
+        
+        result = {
+            "calculation_id": str(uuid.uuid4()),
+            "client_id": client_id,
+            "client_mode": client_mode,
+            "price_level": price_level,
+            "kit_power": best_kit,
+            "panel_count": kit_info['panels'],
+            "surface": kit_info.get('surface', 0),
+            "estimated_production": annual_production,
+            "estimated_savings": annual_savings,
+            "autonomy_percentage": autonomy_percentage,
+            "monthly_savings": monthly_savings,
+            "kit_price": kit_price,
+            "commission": commission,
+            "autoconsumption_kwh": autoconsumption_kwh,
+            "surplus_kwh": surplus_kwh,
+            "autoconsumption_aid": autoconsumption_aid_total,
+            "tva_refund": tva_refund,
+            "total_aids": total_aids,
+            "financing_with_aids": financing_with_aids,
+            "all_financing_with_aids": all_financing_with_aids,
+            "pvgis_monthly_data": pvgis_monthly_data,
+            "pvgis_source": "Données source PVGIS Commission Européenne",
+            "production_source": pvgis_data.get("production_source", "pvgis"),
+            "orientation": orientation,
+            "roof_geometry": get_roof_sections(client),
+            "coordinates": {"lat": lat, "lon": lon},
+            "aids_config": aids_config
+        }
     
-    return options
-
-# Routes
-@api_router.get("/")
-async def root():
-    return {"message": "Solar Calculator API with PVGIS Integration"}
-
-@api_router.get("/solar-kits")
-async def get_solar_kits():
-    """Get available solar kits with pricing (legacy endpoint for particuliers)"""
-    return SOLAR_KITS_PARTICULIERS
-
-@api_router.get("/solar-kits/{client_mode}")
-async def get_solar_kits_by_client_mode(client_mode: str):
-    """Get available solar kits with pricing based on client mode"""
-    if client_mode not in ["particuliers", "professionnels"]:
-        raise HTTPException(status_code=400, detail="Invalid client mode. Use 'particuliers' or 'professionnels'")
+    if result["production_source"] == "local":
+        # PVGIS was unreachable and nothing was cached: stand-in figures, never stored nor sent in a report
+        result["degraded"] = True
+    if hourly:
+        result["hourly_simulation"] = hourly
     
-    return get_solar_kits_by_mode(client_mode)
+    observe_histogram(stage_latency, "engine", time.perf_counter() - engine_started)
+    return result
 
-@api_router.post("/clients", response_model=ClientInfo)
-async def create_client(client_data: ClientInfoCreate):
+@api_router.post("/calculate-professional/{client_id}")
+async def calculate_professional_solution(client_id: str, price_level: str = "base", hourly_simulation: bool = False,
+                                          monte_carlo: bool = False):
+    """
+    Calculate solar solution for professional clients with pricing level
+    price_level: "base", "remise", "remise_max"
+    hourly_simulation: compute autoconsumption hour by hour instead of the fixed rate
+    monte_carlo: add P10/P50/P90 bands for production, savings and payback
+    """
     try:
-        # Geocode the address
-        lat, lon = await geocode_address(client_data.address)
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
         
-        client_dict = client_data.dict()
-        client_dict['latitude'] = lat
-        client_dict['longitude'] = lon
+        result = await compute_professional_solution(client, price_level, hourly_simulation=hourly_simulation)
+        if monte_carlo:
+            result["uncertainty"] = simulate_monte_carlo(result, default_financing(result))
         
-        client_obj = ClientInfo(**client_dict)
-        await db.clients.insert_one(client_obj.dict())
-        return client_obj
+        # Keep the result so that reports can reuse it by calculation_id
+        if not result.get("degraded"):
+            await timed("mongo_write", db.clients.update_one(
+                {"id": client_id},
+                {"$set": {"last_calculation": result}}
+            ))
+        
+        return result
+        
+    except HTTPException:
+        raise
     except Exception as e:
+        logging.error(f"Professional calculation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/clients", response_model=List[ClientInfo])
-async def get_clients():
-    try:
-        clients = await db.clients.find().to_list(1000)
-        return [ClientInfo(**client) for client in clients]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@traced()
+async def compute_solar_solution(client: dict, hourly_simulation: bool = False, estimate: bool = False,
+                                 client_mode: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Run the solar calculation for a client document without touching the database
+    hourly_simulation: use the 8760 hours simulation instead of the fixed autoconsumption rate
+    estimate: use the precomputed yield raster instead of PVGIS (falls back to PVGIS without raster)
+    client_mode: overrides the client's own mode
+    Returns the calculation result and the raw PVGIS data
+    """
+    client_id = client['id']
+    await ensure_client_location(client)
+    
+    # Extract client data
+    annual_consumption = client['annual_consumption_kwh']
+    roof_surface = get_roof_surface(client)
+    orientation = client['roof_orientation']
+    lat = client['latitude']
+    lon = client['longitude']
+    client_mode = client_mode or client.get('client_mode', 'particuliers')  # Default to particuliers if not specified
+    
+    # Get appropriate kits and aids configuration
+    solar_kits = get_solar_kits_by_mode(client_mode)
+    aids_config = get_aids_by_mode(client_mode)
+    
+    # Calculate optimal kit size
+    best_kit = calculate_optimal_kit_size(annual_consumption, roof_surface, client_mode)
+    kit_info = solar_kits[best_kit]
+    
+    # Get PVGIS data
+    pvgis_data = estimate_pvgis_data(client, best_kit, client_mode) if estimate else None
+    estimated = pvgis_data is not None
+    if not estimated:
+        pvgis_data = await get_roof_pvgis_data(client, best_kit, client_mode)
+    engine_started = time.perf_counter()  # Everything below is the calculation engine
+    annual_production = pvgis_data["annual_production"]
+    
+    # Calculate autonomy percentage
+    autonomy_percentage = min(95, (annual_production / annual_consumption) * 100)
+    
+    # Calculate autoconsumption with correct rates by mode
+    aids_config = get_aids_by_mode(client_mode)
+    autoconsumption_rate = aids_config['autoconsumption_rate']
+    edf_rate = aids_config['edf_rate']
+    surplus_sale_rate = aids_config['surplus_sale_rate']
+    
+    # Replace the fixed rate with the hour by hour simulation when requested
+    hourly = None
+    if hourly_simulation:
+        hourly = await run_hourly_simulation(client, best_kit, annual_production, client_mode, pvgis_data if estimated else None)
+        autoconsumption_rate = hourly['autoconsumption_rate']
+    
+    autoconsumption_kwh = annual_production * autoconsumption_rate
+    surplus_kwh = annual_production * (1 - autoconsumption_rate)
+    
+    # Calculate savings with correct rates
+    annual_savings = (autoconsumption_kwh * edf_rate) + (surplus_kwh * surplus_sale_rate)
+    monthly_savings = annual_savings / 12
+    
+    # Calculate financing options
+    if client_mode == "professionnels":
+        # Pour les professionnels, utiliser le prix de base par défaut
+        kit_price = get_professional_kit_price(kit_info, "base")
+    else:
+        # Pour les particuliers, utiliser le prix TTC
+        kit_price = kit_info.get('price', 0)
+    
+    financing_options = calculate_financing_options(kit_price, monthly_savings)
+    
+    # Calculate aids based on client mode
+    aids_config = get_aids_by_mode(client_mode)
+    
+    if client_mode == "professionnels":
+        # Pour les professionnels, utiliser la prime déjà calculée dans les kits
+        autoconsumption_aid_total = kit_info.get('prime', 0)
+        tva_refund = 0  # Pas de TVA pour les professionnels (récupérée par l'entreprise)
+    else:
+        # Pour les particuliers, calculer avec le taux habituel
+        autoconsumption_aid_total = best_kit * aids_config['autoconsumption_aid_rate']
+        tva_refund = kit_info['price'] * aids_config['tva_rate'] if best_kit > 3 else 0
+    
+    total_aids = autoconsumption_aid_total + tva_refund
+    
+    # Calculate financing options with aids deducted
+    financing_with_aids = calculate_financing_with_aids(kit_price, total_aids, monthly_savings)
+    
+    # Calculate all financing options with aids deducted for all durations
+    all_financing_with_aids = calculate_all_financing_with_aids(kit_price, total_aids, monthly_savings)
+    
+    calculation = SolarCalculation(
+        client_id=client_id,
+        kit_power=best_kit,
+        panel_count=kit_info['panels'],
+        estimated_production=annual_production,
+        estimated_savings=annual_savings,
+        autonomy_percentage=autonomy_percentage,
+        monthly_savings=monthly_savings,
+        financing_options=financing_options,
+        pvgis_annual_production=annual_production,
+        pvgis_monthly_data=pvgis_data["monthly_data"].get("fixed", []) if isinstance(pvgis_data["monthly_data"], dict) else pvgis_data["monthly_data"]
+    )
+    
+    # Add additional info for frontend
+    result = calculation.dict()
+    result.update({
+        "client_mode": client_mode,
+        "kit_price": kit_price,
+        "autoconsumption_kwh": autoconsumption_kwh,
+        "surplus_kwh": surplus_kwh,
+        "autoconsumption_aid": autoconsumption_aid_total,
+        "tva_refund": tva_refund,
+        "total_aids": total_aids,
+        "financing_with_aids": financing_with_aids,
+        "all_financing_with_aids": all_financing_with_aids,
+        "pvgis_source": "Données source PVGIS Commission Européenne",
+        "production_source": pvgis_data.get("production_source", "pvgis"),
+        "orientation": orientation,
+        "roof_geometry": get_roof_sections(client),
+        "coordinates": {"lat": lat, "lon": lon},
+        "aids_config": aids_config  # Include aids configuration for frontend
+    })
+    if estimated:
+        result["estimate"] = True
+    elif estimate:
+        # The raster is missing or does not cover the site, the figures come from PVGIS
+        result["estimate_unavailable"] = True
+    if result["production_source"] == "local":
+        # PVGIS was unreachable and nothing was cached: stand-in figures, never stored nor sent in a report
+        result["degraded"] = True
+    if hourly:
+        result["hourly_simulation"] = hourly
+    
+    observe_histogram(stage_latency, "engine", time.perf_counter() - engine_started)
+    return result, pvgis_data
 
-@api_router.get("/clients/{client_id}", response_model=ClientInfo)
-async def get_client(client_id: str):
+async def refine_estimated_calculation(client_id: str, calculation_id: str, hourly_simulation: bool = False):
+    """
+    Replace an estimated calculation with the PVGIS one, keeping its calculation_id
+    Skipped when a newer calculation has been stored in the meantime
+    """
     try:
-        client = await db.clients.find_one({"id": client_id})
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
         if not client:
-            raise HTTPException(status_code=404, detail="Client not found")
-        return ClientInfo(**client)
+            return
+        result, pvgis_data = await compute_solar_solution(client, hourly_simulation)
+        if result.get("degraded"):
+            logging.warning(f"Refinement of estimated calculation {calculation_id} skipped: PVGIS unavailable")
+            return
+        result["calculation_id"] = calculation_id
+        await db.clients.update_one(
+            {"id": client_id, "last_calculation.calculation_id": calculation_id},
+            {"$set": {
+                "recommended_kit_power": result['kit_power'],
+                "estimated_production": result['estimated_production'],
+                "estimated_savings": result['estimated_savings'],
+                "pvgis_data": pvgis_data,
+                "last_calculation": result
+            }}
+        )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logging.warning(f"Refinement of estimated calculation {calculation_id} failed: {e}")
 
-@api_router.post("/calculate-professional/{client_id}")
-async def calculate_professional_solution(client_id: str, price_level: str = "base"):
+@api_router.post("/calculate/{client_id}")
+async def calculate_solar_solution(client_id: str, hourly_simulation: bool = False, monte_carlo: bool = False,
+                                   estimate: bool = False, refine: bool = False):
     """
-    Calculate solar solution for professional clients with pricing level
-    price_level: "base", "remise", "remise_max"
+    Calculate solar solution for a client
+    hourly_simulation: compute autoconsumption hour by hour instead of the fixed rate
+    monte_carlo: add P10/P50/P90 bands for production, savings and payback
+    estimate: instant estimate from the precomputed yield raster instead of PVGIS,
+              flagged estimate_unavailable when PVGIS had to be used (raster not built or site not covered)
+    refine: with estimate, replace the stored calculation with the PVGIS one in the background
     """
     try:
-        client = await db.clients.find_one({"id": client_id})
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
         if not client:
             raise HTTPException(status_code=404, detail="Client not found")
         
-        # Extract client data
-        annual_consumption = client['annual_consumption_kwh']
-        roof_surface = client['roof_surface']
-        orientation = client['roof_orientation']
-        lat = client['latitude']
-        lon = client['longitude']
-        client_mode = client.get('client_mode', 'professionnels')
-        
-        # Get appropriate kits and aids configuration
-        solar_kits = get_solar_kits_by_mode(client_mode)
-        aids_config = get_aids_by_mode(client_mode)
-        
-        # Calculate optimal kit size
-        best_kit = calculate_optimal_kit_size(annual_consumption, roof_surface, client_mode)
-        kit_info = solar_kits[best_kit]
+        result, pvgis_data = await compute_solar_solution(client, hourly_simulation, estimate)
+        if monte_carlo:
+            result["uncertainty"] = simulate_monte_carlo(result, default_financing(result))
         
-        # Get price based on level for professionals
-        if client_mode == "professionnels":
-            kit_price = get_professional_kit_price(kit_info, price_level)
-            commission = get_professional_commission(kit_info, price_level)
-        else:
-            kit_price = kit_info.get('price', 0)
-            commission = 0
+        # Update client with calculation results
+        # The last calculation is kept so that reports can reuse it by calculation_id
+        if not result.get("degraded"):
+            await timed("mongo_write", db.clients.update_one(
+                {"id": client_id},
+                {"$set": {
+                    "recommended_kit_power": result['kit_power'],
+                    "estimated_production": result['estimated_production'],
+                    "estimated_savings": result['estimated_savings'],
+                    "pvgis_data": pvgis_data,
+                    "last_calculation": result
+                }}
+            ))
         
-        # Get PVGIS data
-        pvgis_data = await get_pvgis_data(lat, lon, orientation, best_kit)
-        annual_production = pvgis_data["annual_production"]
+        if refine and result.get("estimate"):
+            task = asyncio.create_task(refine_estimated_calculation(client_id, result['calculation_id'], hourly_simulation))
+            calculation_refine_tasks.add(task)
+            task.add_done_callback(calculation_refine_tasks.discard)
+            result["refinement"] = "pending"
         
-        # Calculate autonomy percentage
-        autonomy_percentage = min(95, (annual_production / annual_consumption) * 100)
+        return result
         
-        # Calculate autoconsumption with correct rates by mode
-        autoconsumption_rate = aids_config['autoconsumption_rate']
-        edf_rate = aids_config['edf_rate']
-        surplus_sale_rate = aids_config['surplus_sale_rate']
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Calculation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/hourly-simulation/{client_id}")
+async def get_hourly_simulation(client_id: str, kit_power: Optional[int] = None, client_mode: Optional[str] = None):
+    """
+    Hour by hour self-consumption simulation for a client
+    kit_power defaults to the recommended kit
+    """
+    try:
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
         
-        autoconsumption_kwh = annual_production * autoconsumption_rate
-        surplus_kwh = annual_production * (1 - autoconsumption_rate)
+        client_mode = client_mode or client.get('client_mode', 'particuliers')
+        if kit_power is None:
+            kit_power = client.get('recommended_kit_power') or calculate_optimal_kit_size(
+                client['annual_consumption_kwh'], get_roof_surface(client), client_mode
+            )
         
-        # Calculate savings with correct rates
-        annual_savings = (autoconsumption_kwh * edf_rate) + (surplus_kwh * surplus_sale_rate)
-        monthly_savings = annual_savings / 12
+        simulation = await run_hourly_simulation(client, kit_power, client_mode=client_mode)
+        simulation.update({"client_id": client_id, "kit_power": kit_power})
+        return simulation
         
-        # Calculate aids based on client mode
-        if client_mode == "professionnels":
-            # Pour les professionnels, utiliser la prime déjà calculée dans les kits
-            autoconsumption_aid_total = kit_info.get('prime', 0)
-            tva_refund = 0  # Pas de TVA pour les professionnels (récupérée par l'entreprise)
-        else:
-            # Pour les particuliers, calculer avec le taux habituel
-            autoconsumption_aid_total = best_kit * aids_config['autoconsumption_aid_rate']
-            tva_refund = kit_price * aids_config['tva_rate'] if best_kit > 3 else 0
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Hourly simulation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/battery-sizing/{client_id}")
+async def get_battery_sizing(client_id: str, kit_power: Optional[int] = None, client_mode: Optional[str] = None,
+                             capacities: Optional[List[float]] = Query(None)):
+    """
+    Battery sizing sweep for a client on top of the hourly simulation
+    capacities: battery capacities in kWh (repeat the parameter), defaults to BATTERY_CAPACITIES_KWH
+    """
+    try:
+        capacities = validate_battery_capacities(capacities or BATTERY_CAPACITIES_KWH).tolist()
         
-        total_aids = autoconsumption_aid_total + tva_refund
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
         
-        # Calculate financing options based on client mode
-        if client_mode == "professionnels":
-            # Pour les professionnels : utiliser le leasing
-            leasing_options = calculate_leasing_options(kit_price)
-            
-            # Trouver le MEILLEUR KITS OPTIMISE
-            optimal_kit = find_optimal_leasing_kit(solar_kits, monthly_savings, client_mode)
-            
-            result = {
-                "client_id": client_id,
-                "client_mode": client_mode,
-                "price_level": price_level,
-                "kit_power": best_kit,
-                "panel_count": kit_info['panels'],
-                "surface": kit_info.get('surface', 0),
-                "estimated_production": annual_production,
-                "estimated_savings": annual_savings,
-                "autonomy_percentage": autonomy_percentage,
-                "monthly_savings": monthly_savings,
-                "kit_price": kit_price,
-                "commission": commission,
-                "autoconsumption_kwh": autoconsumption_kwh,
-                "surplus_kwh": surplus_kwh,
-                "autoconsumption_aid": autoconsumption_aid_total,
-                "tva_refund": tva_refund,
-                "total_aids": total_aids,
-                "leasing_options": leasing_options,
-                "optimal_kit": optimal_kit,
-                "pvgis_source": "Données source PVGIS Commission Européenne",
-                "orientation": orientation,
-                "coordinates": {"lat": lat, "lon": lon},
-                "aids_config": aids_config,
-                "pricing_options": {
-                    "tarif_base_ht": kit_info.get('tarif_base_ht', 0),
-                    "tarif_remise_ht": kit_info.get('tarif_remise_ht', 0),
-                    "tarif_remise_max_ht": kit_info.get('tarif_remise_max_ht', 0),
-                    "commission_normale": kit_info.get('commission_normale', 0),
-                    "commission_remise_max": kit_info.get('commission_remise_max', 0)
-                }
-            }
-        else:
-            # Pour les particuliers : utiliser le crédit classique
-            financing_with_aids = calculate_financing_with_aids(kit_price, total_aids, monthly_savings)
-            all_financing_with_aids = calculate_all_financing_with_aids(kit_price, total_aids, monthly_savings)
-            
-            result = {
-                "client_id": client_id,
-                "client_mode": client_mode,
-                "price_level": price_level,
-                "kit_power": best_kit,
-                "panel_count": kit_info['panels'],
-                "surface": kit_info.get('surface', 0),
-                "estimated_production": annual_production,
-                "estimated_savings": annual_savings,
-                "autonomy_percentage": autonomy_percentage,
-                "monthly_savings": monthly_savings,
-                "kit_price": kit_price,
-                "commission": commission,
-                "autoconsumption_kwh": autoconsumption_kwh,
-                "surplus_kwh": surplus_kwh,
-                "autoconsumption_aid": autoconsumption_aid_total,
-                "tva_refund": tva_refund,
-                "total_aids": total_aids,
-                "financing_with_aids": financing_with_aids,
-                "all_financing_with_aids": all_financing_with_aids,
-                "pvgis_source": "Données source PVGIS Commission Européenne",
-                "orientation": orientation,
-                "coordinates": {"lat": lat, "lon": lon},
-                "aids_config": aids_config
-            }
+        client_mode = client_mode or client.get('client_mode', 'particuliers')
+        if kit_power is None:
+            kit_power = client.get('recommended_kit_power') or calculate_optimal_kit_size(
+                client['annual_consumption_kwh'], get_roof_surface(client), client_mode
+            )
         
+        result = await run_battery_sizing(client, kit_power, capacities, client_mode)
+        result["client_id"] = client_id
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Professional calculation error: {e}")
+        logging.error(f"Battery sizing error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/calculate/{client_id}")
-async def calculate_solar_solution(client_id: str):
+async def get_client_calculation(client: dict, client_mode: Optional[str] = None, price_level: str = "base") -> Dict[str, Any]:
+    """
+    Latest calculation of a client, computed (without saving) when none is stored for this mode and price level
+    """
+    client_mode = client_mode or client.get('client_mode', 'particuliers')
+    calculation = client.get('last_calculation')
+    if (calculation and calculation.get('client_mode', 'particuliers') == client_mode
+            and calculation.get('price_level', "base") == price_level):
+        return calculation
+    if client_mode == "professionnels":
+        return await compute_professional_solution(client, price_level, "professionnels")
+    calculation, _ = await compute_solar_solution(client, client_mode=client_mode)
+    return calculation
+
+def default_financing(calculation: dict) -> str:
+    """Financing offered by default: leasing for the professional engine, credit otherwise"""
+    return "leasing" if calculation.get('leasing_options') else "credit"
+
+def optional_float(value: float, digits: int = 2) -> Optional[float]:
+    """Round a NumPy scalar for JSON output, NaN becomes None"""
+    return None if np.isnan(value) else round(float(value), digits)
+
+@api_router.get("/kit-comparison/{client_id}")
+async def get_kit_comparison(client_id: str, client_mode: Optional[str] = None, price_level: str = "base",
+                             hourly_simulation: bool = False):
+    """
+    Production, savings, aids, credit and leasing fit of every kit of the catalog for a client
+    """
     try:
-        client = await db.clients.find_one({"id": client_id})
+        if client_mode is not None and client_mode not in ["particuliers", "professionnels"]:
+            raise HTTPException(status_code=400, detail="Invalid client mode. Use 'particuliers' or 'professionnels'")
+        
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
         if not client:
             raise HTTPException(status_code=404, detail="Client not found")
         
-        # Extract client data
-        annual_consumption = client['annual_consumption_kwh']
-        roof_surface = client['roof_surface']
-        orientation = client['roof_orientation']
-        lat = client['latitude']
-        lon = client['longitude']
-        client_mode = client.get('client_mode', 'particuliers')  # Default to particuliers if not specified
-        
-        # Get appropriate kits and aids configuration
-        solar_kits = get_solar_kits_by_mode(client_mode)
-        aids_config = get_aids_by_mode(client_mode)
+        result = await compare_kits(client, client_mode or client.get('client_mode', 'particuliers'), price_level, hourly_simulation)
+        result["client_id"] = client_id
+        return result
         
-        # Calculate optimal kit size
-        best_kit = calculate_optimal_kit_size(annual_consumption, roof_surface, client_mode)
-        kit_info = solar_kits[best_kit]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Kit comparison error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/optimise-kit/{client_id}")
+async def get_optimised_kit(client_id: str, objective: str = "net_savings", client_mode: Optional[str] = None,
+                            price_level: str = "base", financing: Optional[str] = None,
+                            hourly_simulation: bool = False, require_financing_fit: bool = False):
+    """
+    Kits that fit the roof (surface minus roof windows) ranked by an objective
+    objective: "net_savings", "payback" or "leasing_benefit" (professionnels)
+    financing: "credit", "cash" or "leasing", defaults to leasing for professionnels and credit otherwise
+    """
+    try:
+        if objective not in OPTIMISATION_OBJECTIVES:
+            raise HTTPException(status_code=400, detail=f"Invalid objective. Use one of {OPTIMISATION_OBJECTIVES}")
+        if financing is not None and financing not in FINANCING_MODES:
+            raise HTTPException(status_code=400, detail=f"Invalid financing. Use one of {FINANCING_MODES}")
         
-        # Get PVGIS data
-        pvgis_data = await get_pvgis_data(lat, lon, orientation, best_kit)
-        annual_production = pvgis_data["annual_production"]
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
         
-        # Calculate autonomy percentage
-        autonomy_percentage = min(95, (annual_production / annual_consumption) * 100)
+        result = await optimise_kit(
+            client, objective, client_mode or client.get('client_mode', 'particuliers'), price_level,
+            financing, hourly_simulation, require_financing_fit
+        )
+        result["client_id"] = client_id
+        return result
         
-        # Calculate autoconsumption with correct rates by mode
-        aids_config = get_aids_by_mode(client_mode)
-        autoconsumption_rate = aids_config['autoconsumption_rate']
-        edf_rate = aids_config['edf_rate']
-        surplus_sale_rate = aids_config['surplus_sale_rate']
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Kit optimisation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/sensitivity/{client_id}")
+async def get_sensitivity(client_id: str, financing: Optional[str] = None, steps: Optional[List[float]] = Query(None),
+                          client_mode: Optional[str] = None, price_level: str = "base"):
+    """
+    Sensitivity of monthly savings and payback to EDF rate, surplus rate, autoconsumption rate,
+    TAEG (or leasing rate) and kit price / price level
+    steps: relative changes (repeat the parameter), defaults to -20%, -10%, +10%, +20%
+    """
+    try:
+        if financing is not None and financing not in FINANCING_MODES:
+            raise HTTPException(status_code=400, detail=f"Invalid financing. Use one of {FINANCING_MODES}")
         
-        autoconsumption_kwh = annual_production * autoconsumption_rate
-        surplus_kwh = annual_production * (1 - autoconsumption_rate)
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
         
-        # Calculate savings with correct rates
-        annual_savings = (autoconsumption_kwh * edf_rate) + (surplus_kwh * surplus_sale_rate)
-        monthly_savings = annual_savings / 12
+        calculation = await get_client_calculation(client, client_mode, price_level)
+        result = run_sensitivity_analysis(calculation, financing or default_financing(calculation), steps or SENSITIVITY_STEPS)
+        result.update({
+            "client_id": client_id,
+            "calculation_id": calculation.get('calculation_id'),
+            "kit_power": calculation['kit_power']
+        })
+        return result
         
-        # Calculate financing options
-        if client_mode == "professionnels":
-            # Pour les professionnels, utiliser le prix de base par défaut
-            kit_price = get_professional_kit_price(kit_info, "base")
-        else:
-            # Pour les particuliers, utiliser le prix TTC
-            kit_price = kit_info.get('price', 0)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Sensitivity analysis error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/monte-carlo/{client_id}")
+async def get_monte_carlo(client_id: str, financing: Optional[str] = None, draws: int = MONTE_CARLO_DRAWS,
+                          seed: Optional[int] = None, client_mode: Optional[str] = None, price_level: str = "base"):
+    """
+    Uncertainty bands (P10/P50/P90) of production, savings and payback for a client
+    Uses the stored calculation when there is one, so no PVGIS call is needed
+    """
+    try:
+        if financing is not None and financing not in FINANCING_MODES:
+            raise HTTPException(status_code=400, detail=f"Invalid financing. Use one of {FINANCING_MODES}")
+        if not 1 <= draws <= 100000:
+            raise HTTPException(status_code=400, detail="draws must be between 1 and 100000")
         
-        financing_options = calculate_financing_options(kit_price, monthly_savings)
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
         
-        # Calculate aids based on client mode
-        aids_config = get_aids_by_mode(client_mode)
+        calculation = await get_client_calculation(client, client_mode, price_level)
+        result = simulate_monte_carlo(calculation, financing or default_financing(calculation), draws, seed=seed)
+        result.update({
+            "client_id": client_id,
+            "calculation_id": calculation.get('calculation_id'),
+            "kit_power": calculation['kit_power']
+        })
+        return result
         
-        if client_mode == "professionnels":
-            # Pour les professionnels, utiliser la prime déjà calculée dans les kits
-            autoconsumption_aid_total = kit_info.get('prime', 0)
-            tva_refund = 0  # Pas de TVA pour les professionnels (récupérée par l'entreprise)
-        else:
-            # Pour les particuliers, calculer avec le taux habituel
-            autoconsumption_aid_total = best_kit * aids_config['autoconsumption_aid_rate']
-            tva_refund = kit_info['price'] * aids_config['tva_rate'] if best_kit > 3 else 0
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Monte Carlo error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/cash-flow/portfolio")
+async def get_portfolio_cash_flow(financing: str = "credit", years: int = Query(PROJECTION_YEARS, ge=1, le=MAX_PROJECTION_YEARS)):
+    """
+    Cash flow projection of every client with a stored calculation, in one batch
+    """
+    try:
+        if financing not in FINANCING_MODES:
+            raise HTTPException(status_code=400, detail=f"Invalid financing. Use one of {FINANCING_MODES}")
         
-        total_aids = autoconsumption_aid_total + tva_refund
+        clients = await db.clients.find(
+            {"last_calculation": {"$exists": True}},
+            {"_id": 0, "id": 1, "last_calculation": 1}
+        ).to_list(None)
         
-        # Calculate financing options with aids deducted
-        financing_with_aids = calculate_financing_with_aids(kit_price, total_aids, monthly_savings)
+        client_ids = []
+        rows = []
+        for client in clients:
+            try:
+                rows.append(get_cash_flow_inputs(client['last_calculation'], financing))
+                client_ids.append(client['id'])
+            except Exception as e:
+                logging.warning(f"Skipping client {client['id']} in portfolio projection: {e}")
         
-        # Calculate all financing options with aids deducted for all durations
-        all_financing_with_aids = calculate_all_financing_with_aids(kit_price, total_aids, monthly_savings)
+        if not rows:
+            return {"financing": financing, "years": years, "client_count": 0, "clients": []}
         
-        calculation = SolarCalculation(
-            client_id=client_id,
-            kit_power=best_kit,
-            panel_count=kit_info['panels'],
-            estimated_production=annual_production,
-            estimated_savings=annual_savings,
-            autonomy_percentage=autonomy_percentage,
-            monthly_savings=monthly_savings,
-            financing_options=financing_options,
-            pvgis_annual_production=annual_production,
-            pvgis_monthly_data=pvgis_data["monthly_data"].get("fixed", []) if isinstance(pvgis_data["monthly_data"], dict) else pvgis_data["monthly_data"]
+        projection = project_cash_flows(
+            **{key: [row[key] for row in rows] for key in rows[0]},
+            years=years
         )
+        payback = projection['payback_years']
         
-        # Update client with calculation results
-        await db.clients.update_one(
-            {"id": client_id},
-            {"$set": {
-                "recommended_kit_power": best_kit,
-                "estimated_production": annual_production,
-                "estimated_savings": annual_savings,
-                "pvgis_data": pvgis_data
-            }}
-        )
+        return {
+            "financing": financing,
+            "years": years,
+            "client_count": len(client_ids),
+            "total_savings": round(float(projection['total_savings'].sum()), 2),
+            "total_outflows": round(float(projection['total_outflows'].sum()), 2),
+            "total_net_gain": round(float(projection['net_gain'].sum()), 2),
+            "mean_roi": optional_float(np.nanmean(projection['roi'])) if not np.isnan(projection['roi']).all() else None,
+            "median_payback_years": optional_float(np.nanmedian(payback), 1) if not np.isnan(payback).all() else None,
+            "not_paid_back_count": int(np.isnan(payback).sum()),
+            "cumulative_balance": projection['cumulative'].sum(axis=0).round(2).tolist(),
+            "clients": [
+                {
+                    "client_id": client_id,
+                    "payback_years": optional_float(payback[index], 1),
+                    "net_gain": round(float(projection['net_gain'][index]), 2),
+                    "roi": optional_float(projection['roi'][index], 3)
+                }
+                for index, client_id in enumerate(client_ids)
+            ]
+        }
         
-        # Add additional info for frontend
-        result = calculation.dict()
-        result.update({
-            "client_mode": client_mode,
-            "kit_price": kit_price,
-            "autoconsumption_kwh": autoconsumption_kwh,
-            "surplus_kwh": surplus_kwh,
-            "autoconsumption_aid": autoconsumption_aid_total,
-            "tva_refund": tva_refund,
-            "total_aids": total_aids,
-            "financing_with_aids": financing_with_aids,
-            "all_financing_with_aids": all_financing_with_aids,
-            "pvgis_source": "Données source PVGIS Commission Européenne",
-            "orientation": orientation,
-            "coordinates": {"lat": lat, "lon": lon},
-            "aids_config": aids_config  # Include aids configuration for frontend
-        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Portfolio cash flow error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/cash-flow/{client_id}")
+async def get_cash_flow(client_id: str, financing: str = "credit",
+                        duration_months: Optional[int] = Query(None, ge=60, le=180),  # Leasing 60-96, credit 72-180
+                        client_mode: Optional[str] = None, price_level: str = "base",
+                        years: int = Query(PROJECTION_YEARS, ge=1, le=MAX_PROJECTION_YEARS)):
+    """
+    Year by year cash flow projection for a client
+    financing: "credit" (aids deducted), "cash" or "leasing" (professionals)
+    Uses the stored calculation when there is one, so no PVGIS call is needed
+    """
+    try:
+        if financing not in FINANCING_MODES:
+            raise HTTPException(status_code=400, detail=f"Invalid financing. Use one of {FINANCING_MODES}")
         
-        return result
+        client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
+        
+        calculation = await get_client_calculation(client, client_mode, price_level)
+        inputs = get_cash_flow_inputs(calculation, financing, duration_months)
+        projection = project_cash_flows(**inputs, years=years)
+        
+        return {
+            "client_id": client_id,
+            "calculation_id": calculation.get('calculation_id'),
+            "financing": financing,
+            "kit_power": calculation['kit_power'],
+            "kit_price": calculation['kit_price'],
+            "inputs": inputs,
+            "payback_years": optional_float(projection['payback_years'][0], 1),
+            "total_savings": round(float(projection['total_savings'][0]), 2),
+            "total_outflows": round(float(projection['total_outflows'][0]), 2),
+            "net_gain": round(float(projection['net_gain'][0]), 2),
+            "roi": optional_float(projection['roi'][0], 3),
+            "yearly": [
+                {
+                    "year": year + 1,
+                    "savings": round(float(projection['savings'][0, year]), 2),
+                    "payments": round(float(projection['payments'][0, year]), 2),
+                    "net": round(float(projection['net'][0, year]), 2),
+                    "cumulative": round(float(projection['cumulative'][0, year]), 2)
+                }
+                for year in range(years)
+            ]
+        }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Calculation error: {e}")
+        logging.error(f"Cash flow error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-def generate_monthly_chart(monthly_data: List[dict]) -> str:
-    """Generate monthly production chart and return as base64"""
+@contextmanager
+def chart_figure(figsize: Tuple[float, float]):
+    """
+    Standalone figure, not registered in pyplot: reports render in worker threads and pyplot's
+    global state is not thread safe, nor does it free figures left open by a failed chart
+    """
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
     try:
-        # Create figure
-        fig, ax = plt.subplots(figsize=(12, 6))
-        
-        # Extract data
-        months = ['Jan', 'Fév', 'Mar', 'Avr', 'Mai', 'Jun', 'Jul', 'Aoû', 'Sep', 'Oct', 'Nov', 'Déc']
-        production = [month.get('E_m', 0) for month in monthly_data]
-        
-        # Create bars with gradient colors
-        bars = ax.bar(months, production, 
-                     color=['#ff6b35' if i < 6 else '#4caf50' for i in range(len(months))],
-                     alpha=0.8, edgecolor='white', linewidth=1)
-        
-        # Styling
-        ax.set_title('Production Mensuelle Estimée (kWh)', fontsize=16, fontweight='bold', pad=20)
-        ax.set_ylabel('Production (kWh)', fontsize=12, fontweight='bold')
-        ax.set_xlabel('Mois', fontsize=12, fontweight='bold')
-        ax.grid(True, alpha=0.3, axis='y')
-        ax.set_facecolor('#f8f9fa')
-        
-        # Add value labels on bars
-        for bar, value in zip(bars, production):
-            height = bar.get_height()
-            ax.text(bar.get_x() + bar.get_width()/2., height + 10,
-                   f'{int(value)}', ha='center', va='bottom', fontweight='bold')
-        
-        plt.tight_layout()
-        
-        # Save to base64
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight', 
-                   facecolor='white', edgecolor='none')
-        buffer.seek(0)
-        
-        chart_base64 = base64.b64encode(buffer.getvalue()).decode()
-        plt.close()
+        yield fig, ax
+    finally:
+        fig.clear()
+
+def figure_png(fig) -> io.BytesIO:
+    """Render a figure as PNG in a rewound buffer, ready for reportlab's Image"""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight',
+                facecolor='white', edgecolor='none')
+    buffer.seek(0)
+    return buffer
+
+@traced()
+@render_memory("monthly_chart")
+def render_monthly_chart(monthly_data: List[dict]) -> Optional[io.BytesIO]:
+    """Render the monthly production chart as PNG, None when it fails"""
+    try:
+        with chart_figure((12, 6)) as (fig, ax):
+            # Extract data
+            months = ['Jan', 'Fév', 'Mar', 'Avr', 'Mai', 'Jun', 'Jul', 'Aoû', 'Sep', 'Oct', 'Nov', 'Déc']
+            production = [month.get('E_m', 0) for month in monthly_data]
+            
+            # Create bars with gradient colors
+            bars = ax.bar(months, production, 
+                         color=['#ff6b35' if i < 6 else '#4caf50' for i in range(len(months))],
+                         alpha=0.8, edgecolor='white', linewidth=1)
+            
+            # Styling
+            ax.set_title('Production Mensuelle Estimée (kWh)', fontsize=16, fontweight='bold', pad=20)
+            ax.set_ylabel('Production (kWh)', fontsize=12, fontweight='bold')
+            ax.set_xlabel('Mois', fontsize=12, fontweight='bold')
+            ax.grid(True, alpha=0.3, axis='y')
+            ax.set_facecolor('#f8f9fa')
+            
+            # Add value labels on bars
+            for bar, value in zip(bars, production):
+                height = bar.get_height()
+                ax.text(bar.get_x() + bar.get_width()/2., height + 10,
+                       f'{int(value)}', ha='center', va='bottom', fontweight='bold')
+            
+            fig.tight_layout()
+            return figure_png(fig)
         
-        return chart_base64
+    except Exception as e:
+        logging.error(f"Error generating monthly chart: {e}")
+        return None
+
+def generate_monthly_chart(monthly_data: List[dict]) -> str:
+    """Generate monthly production chart and return as base64"""
+    buffer = render_monthly_chart(monthly_data)
+    return base64.b64encode(buffer.getvalue()).decode() if buffer else ""
+
+@render_memory("autonomy_chart")
+def render_autonomy_pie_chart(autonomy_percentage: float) -> Optional[io.BytesIO]:
+    """Render the autonomy pie chart as PNG, None when it fails"""
+    try:
+        with chart_figure((8, 8)) as (fig, ax):
+            # Data for pie chart
+            autonomous = autonomy_percentage
+            grid = 100 - autonomy_percentage
+            
+            sizes = [autonomous, grid]
+            labels = [f'Autoconsommation\n{autonomous:.1f}%', f'Réseau EDF\n{grid:.1f}%']
+            colors = ['#4caf50', '#ff6b35']
+            explode = (0.05, 0)  # Explode autonomous part
+            
+            # Create pie chart
+            wedges, texts, autotexts = ax.pie(sizes, explode=explode, labels=labels, colors=colors,
+                                             autopct='%1.1f%%', shadow=True, startangle=90,
+                                             textprops={'fontsize': 12, 'fontweight': 'bold'})
+            
+            ax.set_title('Répartition de votre Consommation Électrique', 
+                        fontsize=16, fontweight='bold', pad=20)
+            
+            fig.tight_layout()
+            return figure_png(fig)
         
     except Exception as e:
-        logging.error(f"Error generating monthly chart: {e}")
-        return ""
+        logging.error(f"Error generating autonomy chart: {e}")
+        return None
 
 def generate_autonomy_pie_chart(autonomy_percentage: float) -> str:
     """Generate autonomy pie chart and return as base64"""
-    try:
-        fig, ax = plt.subplots(figsize=(8, 8))
-        
-        # Data for pie chart
-        autonomous = autonomy_percentage
-        grid = 100 - autonomy_percentage
-        
-        sizes = [autonomous, grid]
-        labels = [f'Autoconsommation\n{autonomous:.1f}%', f'Réseau EDF\n{grid:.1f}%']
-        colors = ['#4caf50', '#ff6b35']
-        explode = (0.05, 0)  # Explode autonomous part
-        
-        # Create pie chart
-        wedges, texts, autotexts = ax.pie(sizes, explode=explode, labels=labels, colors=colors,
-                                         autopct='%1.1f%%', shadow=True, startangle=90,
-                                         textprops={'fontsize': 12, 'fontweight': 'bold'})
-        
-        ax.set_title('Répartition de votre Consommation Électrique', 
-                    fontsize=16, fontweight='bold', pad=20)
-        
-        plt.tight_layout()
-        
-        # Save to base64
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight',
-                   facecolor='white', edgecolor='none')
-        buffer.seek(0)
-        
-        chart_base64 = base64.b64encode(buffer.getvalue()).decode()
-        plt.close()
-        
-        return chart_base64
+    buffer = render_autonomy_pie_chart(autonomy_percentage)
+    return base64.b64encode(buffer.getvalue()).decode() if buffer else ""
+
+def get_report_styles() -> Tuple[Any, ParagraphStyle, ParagraphStyle]:
+    """Get the stylesheet, title style and heading style shared by all reports"""
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        textColor=colors.HexColor('#2c5530'),
+        alignment=1  # Center
+    )
+    
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=16,
+        spaceBefore=20,
+        spaceAfter=12,
+        textColor=colors.HexColor('#ff6b35'),
+        leftIndent=0
+    )
+    
+    return styles, title_style, heading_style
+
+def build_client_info_section(client: dict, heading_style: ParagraphStyle) -> List:
+    """Build the client information block of a report"""
+    story = []
+    
+    # Client information
+    story.append(Paragraph("INFORMATIONS CLIENT", heading_style))
+    client_info = [
+        ['Nom complet:', f"{client['first_name']} {client['last_name']}"],
+        ['Adresse:', client['address']],
+        ['Surface toiture:', f"{get_roof_surface(client)} m²"],
+        ['Orientation:', ", ".join(
+            f"{section.get('name') or section['aspect']} ({section['surface']} m²)" for section in client['roof_sections']
+        ) if client.get('roof_sections') else client['roof_orientation']],
+        ['Système chauffage:', client['heating_system']],
+        ['Consommation annuelle:', f"{client['annual_consumption_kwh']} kWh"],
+        ['Facture EDF actuelle:', f"{client['monthly_edf_payment']} € / mois"],
+        ['Date de l\'étude:', datetime.now().strftime('%d/%m/%Y')]
+    ]
+    
+    client_table = Table(client_info, colWidths=[4*cm, 10*cm])
+    client_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f8f9fa')),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 8),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+        ('TOPPADDING', (0, 0), (-1, -1), 6),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    
+    story.append(client_table)
+    story.append(Spacer(1, 20))
+    
+    return story
+
+def build_charts_section(calculation_data: dict, heading_style: ParagraphStyle) -> List:
+    """Build the monthly production and autonomy charts block of a report"""
+    story = []
+    
+    # Monthly production if available
+    if calculation_data.get('pvgis_monthly_data'):
+        story.append(Paragraph("PRODUCTION MENSUELLE DÉTAILLÉE", heading_style))
         
-    except Exception as e:
-        logging.error(f"Error generating autonomy chart: {e}")
-        return ""
+        with stage_timer("chart"):
+            chart_buffer = render_monthly_chart(calculation_data['pvgis_monthly_data'])
+        if chart_buffer:
+            chart_image = Image(chart_buffer, width=12*cm, height=6*cm)
+            story.append(chart_image)
+            story.append(Spacer(1, 20))
+    
+    # Autonomy chart
+    with stage_timer("chart"):
+        autonomy_buffer = render_autonomy_pie_chart(calculation_data['autonomy_percentage'])
+    if autonomy_buffer:
+        story.append(Paragraph("RÉPARTITION DE VOTRE CONSOMMATION", heading_style))
+        autonomy_image = Image(autonomy_buffer, width=8*cm, height=6*cm)
+        story.append(autonomy_image)
+        story.append(Spacer(1, 20))
+    
+    return story
+
+def build_tech_specs_section(calculation_data: dict, heading_style: ParagraphStyle) -> List:
+    """Build the technical specifications block of a report"""
+    story = []
+    
+    # Technical specifications
+    story.append(Paragraph("SPÉCIFICATIONS TECHNIQUES", heading_style))
+    tech_specs = [
+        ['Panneaux photovoltaïques:', f'{calculation_data["panel_count"]} × 500W monocristallin'],
+        ['Puissance totale:', f'{calculation_data["kit_power"]} kWc'],
+        ['Surface nécessaire:', f'{calculation_data["panel_count"] * 2.1:.1f} m²'],
+        ['Onduleur:', 'Hoymiles haute performance (99,8% efficacité)'],
+        ['Garantie panneaux:', '25 ans sur la production'],
+        ['Garantie installation:', '10 ans décennale'],
+        ['Système de montage:', 'Intégration toiture avec étanchéité'],
+        ['Suivi production:', 'Application mobile temps réel']
+    ]
+    
+    tech_table = Table(tech_specs, colWidths=[6*cm, 8*cm])
+    tech_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f8ff')),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#2196f3')),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 8),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+        ('TOPPADDING', (0, 0), (-1, -1), 6),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    
+    story.append(tech_table)
+    story.append(Spacer(1, 30))
+    
+    return story
+
+def build_contact_section(styles: Any, heading_style: ParagraphStyle) -> List:
+    """Build the contact and certifications footer of a report"""
+    story = []
+    
+    # Footer with contact info
+    story.append(Paragraph("COORDONNÉES ET CONTACT", heading_style))
+    footer_text = """
+    <b>FRH ENVIRONNEMENT</b><br/>
+    196 Avenue Jean Lolive, 93500 Pantin<br/>
+    Téléphone: 09 85 60 50 51<br/>
+    Email: contact@francerenovhabitat.com<br/><br/>
+    
+    <b>Certifications:</b><br/>
+    • RGE QualiPV 2025 (Photovoltaïque)<br/>
+    • RGE QualiPac 2025 (Pompes à chaleur)<br/>
+    • Membre FFB (Fédération Française du Bâtiment)<br/>
+    • Partenaire Agir Plus EDF<br/>
+    • Garantie décennale MMA<br/><br/>
+    
+    <i>Ce devis est valable 30 jours. Les données de production sont basées sur les statistiques officielles PVGIS de la Commission Européenne.</i>
+    """
+    
+    story.append(Paragraph(footer_text, styles['Normal']))
+    
+    return story
 
-async def generate_solar_report_pdf(client_id: str, calculation_data: dict) -> bytes:
+@traced()
+def generate_solar_report_pdf(client: dict, calculation_data: dict) -> bytes:
     """Generate comprehensive solar installation PDF report"""
     try:
-        # Get client data
-        client = await db.clients.find_one({"id": client_id})
-        if not client:
-            raise HTTPException(status_code=404, detail="Client not found")
-        
         # Create PDF buffer
         buffer = io.BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=A4, 
@@ -1167,25 +4481,7 @@ async def generate_solar_report_pdf(client_id: str, calculation_data: dict) -> b
                               topMargin=50, bottomMargin=50)
         
         # Get styles
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            textColor=colors.HexColor('#2c5530'),
-            alignment=1  # Center
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=16,
-            spaceBefore=20,
-            spaceAfter=12,
-            textColor=colors.HexColor('#ff6b35'),
-            leftIndent=0
-        )
+        styles, title_style, heading_style = get_report_styles()
         
         # Story (content) list
         story = []
@@ -1196,36 +4492,7 @@ async def generate_solar_report_pdf(client_id: str, calculation_data: dict) -> b
         story.append(Spacer(1, 20))
         
         # Client information
-        story.append(Paragraph("INFORMATIONS CLIENT", heading_style))
-        client_info = [
-            ['Nom complet:', f"{client['first_name']} {client['last_name']}"],
-            ['Adresse:', client['address']],
-            ['Surface toiture:', f"{client['roof_surface']} m²"],
-            ['Orientation:', client['roof_orientation']],
-            ['Système chauffage:', client['heating_system']],
-            ['Consommation annuelle:', f"{client['annual_consumption_kwh']} kWh"],
-            ['Facture EDF actuelle:', f"{client['monthly_edf_payment']} € / mois"],
-            ['Date de l\'étude:', datetime.now().strftime('%d/%m/%Y')]
-        ]
-        
-        client_table = Table(client_info, colWidths=[4*cm, 10*cm])
-        client_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f8f9fa')),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 8),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 0), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ]))
-        
-        story.append(client_table)
-        story.append(Spacer(1, 20))
+        story.extend(build_client_info_section(client, heading_style))
         
         # Solution recommendations
         story.append(Paragraph("SOLUTION RECOMMANDÉE", heading_style))
@@ -1366,49 +4633,75 @@ async def generate_solar_report_pdf(client_id: str, calculation_data: dict) -> b
         # Add page break
         story.append(Spacer(1, 50))
         
-        # Monthly production if available
-        if calculation_data.get('pvgis_monthly_data'):
-            story.append(Paragraph("PRODUCTION MENSUELLE DÉTAILLÉE", heading_style))
-            
-            monthly_chart_b64 = generate_monthly_chart(calculation_data['pvgis_monthly_data'])
-            if monthly_chart_b64:
-                # Create image from base64
-                chart_buffer = io.BytesIO(base64.b64decode(monthly_chart_b64))
-                chart_image = Image(chart_buffer, width=12*cm, height=6*cm)
-                story.append(chart_image)
-                story.append(Spacer(1, 20))
-        
-        # Autonomy chart
-        autonomy_chart_b64 = generate_autonomy_pie_chart(calculation_data['autonomy_percentage'])
-        if autonomy_chart_b64:
-            story.append(Paragraph("RÉPARTITION DE VOTRE CONSOMMATION", heading_style))
-            autonomy_buffer = io.BytesIO(base64.b64decode(autonomy_chart_b64))
-            autonomy_image = Image(autonomy_buffer, width=8*cm, height=6*cm)
-            story.append(autonomy_image)
-            story.append(Spacer(1, 20))
+        # Monthly production and autonomy charts
+        story.extend(build_charts_section(calculation_data, heading_style))
         
         # Technical specifications
-        story.append(Paragraph("SPÉCIFICATIONS TECHNIQUES", heading_style))
-        tech_specs = [
-            ['Panneaux photovoltaïques:', f'{calculation_data["panel_count"]} × 500W monocristallin'],
-            ['Puissance totale:', f'{calculation_data["kit_power"]} kWc'],
-            ['Surface nécessaire:', f'{calculation_data["panel_count"] * 2.1:.1f} m²'],
-            ['Onduleur:', 'Hoymiles haute performance (99,8% efficacité)'],
-            ['Garantie panneaux:', '25 ans sur la production'],
-            ['Garantie installation:', '10 ans décennale'],
-            ['Système de montage:', 'Intégration toiture avec étanchéité'],
-            ['Suivi production:', 'Application mobile temps réel']
+        story.extend(build_tech_specs_section(calculation_data, heading_style))
+        
+        # Footer with contact info
+        story.extend(build_contact_section(styles, heading_style))
+        
+        # Build PDF
+        with stage_timer("pdf_build"):
+            doc.build(story)
+        buffer.seek(0)
+        
+        return buffer.getvalue()
+        
+    except Exception as e:
+        logging.error(f"Error generating PDF: {e}")
+        raise HTTPException(status_code=500, detail=f"Error generating PDF: {str(e)}")
+
+@traced()
+def generate_professional_report_pdf(client: dict, calculation_data: dict) -> bytes:
+    """Generate professional solar installation PDF report (leasing, optimal kit, price levels)"""
+    try:
+        # Create PDF buffer
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4, 
+                              rightMargin=50, leftMargin=50, 
+                              topMargin=50, bottomMargin=50)
+        
+        # Get styles
+        styles, title_style, heading_style = get_report_styles()
+        
+        # Story (content) list
+        story = []
+        
+        # Title and header
+        story.append(Paragraph("ÉTUDE SOLAIRE PROFESSIONNELLE", title_style))
+        story.append(Paragraph(f"<b>FRH ENVIRONNEMENT</b> - Énergie Solaire Professionnel", styles['Normal']))
+        story.append(Spacer(1, 20))
+        
+        # Client information
+        story.extend(build_client_info_section(client, heading_style))
+        
+        # Solution recommendations
+        story.append(Paragraph("SOLUTION RECOMMANDÉE", heading_style))
+        solution_info = [
+            ['Kit solaire optimal:', f"{calculation_data['kit_power']} kW ({calculation_data['panel_count']} panneaux)"],
+            ['Surface des panneaux:', f"{calculation_data.get('surface', 0)} m²"],
+            ['Investissement:', f"{calculation_data.get('kit_price', 0):,.0f} € HT"],
+            ['Production annuelle estimée:', f"{calculation_data['estimated_production']:.0f} kWh"],
+            ['Autoconsommation / Revente:', f"{calculation_data.get('autoconsumption_kwh', 0):.0f} kWh / {calculation_data.get('surplus_kwh', 0):.0f} kWh"],
+            ['Autonomie énergétique:', f"{calculation_data['autonomy_percentage']:.1f} %"],
+            ['Économies annuelles:', f"{calculation_data['estimated_savings']:.0f} €"],
+            ['Économies mensuelles:', f"{calculation_data['monthly_savings']:.0f} €"],
+            ['Prime autoconsommation:', f"{calculation_data.get('autoconsumption_aid', 0):.0f} €"],
+            ['Source données:', calculation_data.get('pvgis_source', 'PVGIS Commission Européenne')]
         ]
         
-        tech_table = Table(tech_specs, colWidths=[6*cm, 8*cm])
-        tech_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f8ff')),
+        solution_table = Table(solution_info, colWidths=[6*cm, 8*cm])
+        solution_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#e8f5e8')),
+            ('BACKGROUND', (1, 6), (1, 7), colors.HexColor('#d4edda')),  # Highlight savings
             ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
             ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
             ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
             ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#2196f3')),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#4caf50')),
             ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
             ('LEFTPADDING', (0, 0), (-1, -1), 8),
             ('RIGHTPADDING', (0, 0), (-1, -1), 8),
@@ -1416,67 +4709,599 @@ async def generate_solar_report_pdf(client_id: str, calculation_data: dict) -> b
             ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
         ]))
         
-        story.append(tech_table)
+        story.append(solution_table)
         story.append(Spacer(1, 30))
         
-        # Footer with contact info
-        story.append(Paragraph("COORDONNÉES ET CONTACT", heading_style))
-        footer_text = """
-        <b>FRH ENVIRONNEMENT</b><br/>
-        196 Avenue Jean Lolive, 93500 Pantin<br/>
-        Téléphone: 09 85 60 50 51<br/>
-        Email: contact@francerenovhabitat.com<br/><br/>
+        # Price level comparison
+        pricing_options = calculation_data.get('pricing_options')
+        if pricing_options:
+            story.append(Paragraph("COMPARATIF DES NIVEAUX DE PRIX", heading_style))
+            pricing_data = [['Niveau', 'Prix HT', 'Commission']]
+            price_levels = [
+                ("base", "Tarif de base", pricing_options['tarif_base_ht'], pricing_options['commission_normale']),
+                ("remise", "Tarif remisé", pricing_options['tarif_remise_ht'], pricing_options['commission_normale']),
+                ("remise_max", "Remise maximale", pricing_options['tarif_remise_max_ht'], pricing_options['commission_remise_max'])
+            ]
+            selected_row = 1
+            for index, (level, label, price, commission) in enumerate(price_levels):
+                if level == calculation_data.get('price_level'):
+                    selected_row = index + 1
+                pricing_data.append([label, f"{price:,.0f} €", f"{commission:,.0f} €"])
+            
+            pricing_table = Table(pricing_data, colWidths=[5*cm, 4.5*cm, 4.5*cm])
+            pricing_table.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#ff9800')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('BACKGROUND', (0, selected_row), (-1, selected_row), colors.HexColor('#fff3e0')),  # Highlight selected level
+                ('FONTNAME', (0, selected_row), (-1, selected_row), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, 0), (-1, -1), 9),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
+                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                ('TOPPADDING', (0, 0), (-1, -1), 4),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+            ]))
+            
+            story.append(pricing_table)
+            story.append(Spacer(1, 20))
         
-        <b>Certifications:</b><br/>
-        • RGE QualiPV 2025 (Photovoltaïque)<br/>
-        • RGE QualiPac 2025 (Pompes à chaleur)<br/>
-        • Membre FFB (Fédération Française du Bâtiment)<br/>
-        • Partenaire Agir Plus EDF<br/>
-        • Garantie décennale MMA<br/><br/>
+        # Leasing options
+        if calculation_data.get('leasing_options'):
+            story.append(Paragraph("OPTIONS DE LEASING", heading_style))
+            leasing_data = [['Durée', 'Taux', 'Loyer mensuel', 'Économie mensuelle', 'Différence']]
+            
+            for option in calculation_data['leasing_options']:
+                difference = option['monthly_payment'] - calculation_data['monthly_savings']
+                diff_text = f"+{difference:.0f} €" if difference > 0 else f"{difference:.0f} €"
+                leasing_data.append([
+                    f"{option['duration_months']} mois",
+                    f"{option['rate']:.2f} %",
+                    f"{option['monthly_payment']:.0f} €",
+                    f"{calculation_data['monthly_savings']:.0f} €",
+                    diff_text
+                ])
+            
+            leasing_table = Table(leasing_data, colWidths=[2.5*cm, 2.5*cm, 3*cm, 3.5*cm, 2.5*cm])
+            leasing_table.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2196f3')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, 0), (-1, 0), 9),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+                ('FONTSIZE', (0, 1), (-1, -1), 8),
+                ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e0e0e0')),
+                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                ('LEFTPADDING', (0, 0), (-1, -1), 4),
+                ('RIGHTPADDING', (0, 0), (-1, -1), 4),
+                ('TOPPADDING', (0, 0), (-1, -1), 4),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+            ]))
+            
+            story.append(leasing_table)
+            story.append(Spacer(1, 20))
+        
+        # MEILLEUR KITS OPTIMISE
+        optimal_kit = calculation_data.get('optimal_kit')
+        if optimal_kit:
+            story.append(Paragraph("MEILLEUR KIT OPTIMISÉ EN LEASING", heading_style))
+            optimal_info = [
+                ['Kit:', f"{optimal_kit['kit_power']} kW ({optimal_kit['kit_info'].get('panels', 0)} panneaux)"],
+                ['Niveau de prix:', optimal_kit['price_level']],
+                ['Prix HT:', f"{optimal_kit['kit_price']:,.0f} €"],
+                ['Durée:', f"{optimal_kit['duration_months']} mois à {optimal_kit['leasing_rate']:.2f} %"],
+                ['Loyer mensuel:', f"{optimal_kit['monthly_payment']:.0f} €"],
+                ['Bénéfice mensuel:', f"{optimal_kit['monthly_benefit']:.0f} €"]
+            ]
+            
+            optimal_table = Table(optimal_info, colWidths=[6*cm, 8*cm])
+            optimal_table.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#fff3e0')),
+                ('BACKGROUND', (1, 5), (1, 5), colors.HexColor('#4caf50')),  # Highlight benefit
+                ('TEXTCOLOR', (1, 5), (1, 5), colors.white),
+                ('FONTNAME', (1, 5), (1, 5), 'Helvetica-Bold'),
+                ('TEXTCOLOR', (0, 0), (-1, -2), colors.black),
+                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+                ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+                ('FONTNAME', (1, 0), (1, -2), 'Helvetica'),
+                ('FONTSIZE', (0, 0), (-1, -1), 10),
+                ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#ff9800')),
+                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                ('LEFTPADDING', (0, 0), (-1, -1), 8),
+                ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+                ('TOPPADDING', (0, 0), (-1, -1), 6),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+            ]))
+            
+            story.append(optimal_table)
+            story.append(Spacer(1, 20))
+        
+        # Add page break
+        story.append(Spacer(1, 50))
         
-        <i>Ce devis est valable 30 jours. Les données de production sont basées sur les statistiques officielles PVGIS de la Commission Européenne.</i>
-        """
+        # Monthly production and autonomy charts
+        story.extend(build_charts_section(calculation_data, heading_style))
         
-        story.append(Paragraph(footer_text, styles['Normal']))
+        # Technical specifications
+        story.extend(build_tech_specs_section(calculation_data, heading_style))
+        
+        # Footer with contact info
+        story.extend(build_contact_section(styles, heading_style))
         
         # Build PDF
-        doc.build(story)
+        with stage_timer("pdf_build"):
+            doc.build(story)
         buffer.seek(0)
         
         return buffer.getvalue()
         
     except Exception as e:
-        logging.error(f"Error generating PDF: {e}")
+        logging.error(f"Error generating professional PDF: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating PDF: {str(e)}")
 
+def render_report_pdf(render: str, generate_report, client: dict, calculation_data: dict) -> bytes:
+    """Render a report with its memory accounting, runs in a worker thread"""
+    with render_memory(render):
+        return generate_report(client, calculation_data)
+
+@traced()
+async def build_client_report(client_id: str, calculation_id: Optional[str] = None,
+                              client_mode: Optional[str] = None, price_level: str = "base") -> Tuple[bytes, str]:
+    """
+    Render the PDF report for a client from a single client read
+    Reuses the stored calculation when calculation_id is given, otherwise computes it
+    Professional clients get the professional engine result and report template
+    Returns the PDF bytes and the download filename
+    """
+    # Get client
+    client = await timed("mongo_read", db.clients.find_one({"id": client_id}))
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found")
+    
+    # Get calculation data - recalculate if needed
+    if calculation_id:
+        calculation_response = client.get('last_calculation')
+        if not calculation_response or calculation_response.get('calculation_id') != calculation_id:
+            raise HTTPException(status_code=404, detail="Calculation not found")
+    elif (client_mode or client.get('client_mode', 'particuliers')) == "professionnels":
+        calculation_response = await compute_professional_solution(client, price_level, "professionnels")
+    else:
+        calculation_response, _ = await compute_solar_solution(client, client_mode=client_mode)
+    if calculation_response.get("degraded"):
+        raise HTTPException(status_code=503, detail="PVGIS unavailable, the report cannot be built from the local production model")
+    
+    # Generate PDF - only the professional engine returns leasing options
+    # Rendering is CPU bound, it runs in a worker thread to keep the event loop serving requests
+    if 'leasing_options' in calculation_response:
+        pdf_bytes = await asyncio.to_thread(render_report_pdf, "professional_pdf", generate_professional_report_pdf, client, calculation_response)
+    else:
+        pdf_bytes = await asyncio.to_thread(render_report_pdf, "solar_pdf", generate_solar_report_pdf, client, calculation_response)
+    
+    filename = f"etude_solaire_{client['first_name']}_{client['last_name']}_{datetime.now().strftime('%Y%m%d')}.pdf"
+    
+    return pdf_bytes, filename
+
 @api_router.get("/generate-pdf/{client_id}")
-async def generate_pdf_report(client_id: str):
-    """Generate and download PDF report for client"""
+async def generate_pdf_report(client_id: str, calculation_id: Optional[str] = None,
+                              client_mode: Optional[str] = None, price_level: str = "base"):
+    """
+    Generate and download PDF report for client
+    Pass the calculation_id returned by /calculate or /calculate-professional to skip the recalculation
+    client_mode: "particuliers" or "professionnels" (defaults to the client's mode)
+    price_level: "base", "remise", "remise_max" (professional reports only)
+    """
     try:
-        # Get client
-        client = await db.clients.find_one({"id": client_id})
-        if not client:
-            raise HTTPException(status_code=404, detail="Client not found")
-        
-        # Get calculation data - recalculate if needed
-        calculation_response = await calculate_solar_solution(client_id)
-        
-        # Generate PDF
-        pdf_bytes = await generate_solar_report_pdf(client_id, calculation_response)
+        pdf_bytes, filename = await build_client_report(client_id, calculation_id, client_mode, price_level)
         
         # Return PDF as response
-        filename = f"etude_solaire_{client['first_name']}_{client['last_name']}_{datetime.now().strftime('%Y%m%d')}.pdf"
-        
         return Response(
             content=pdf_bytes,
             media_type="application/pdf",
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"PDF generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# PDF job queue configuration
+PDF_JOB_WORKERS = int(os.environ.get('PDF_JOB_WORKERS', 2))  # Concurrent renders per process
+PDF_JOB_MAX_ATTEMPTS = int(os.environ.get('PDF_JOB_MAX_ATTEMPTS', 3))
+PDF_JOB_RETRY_DELAY_SECONDS = 5  # Doubled after each failed attempt
+PDF_JOB_RESULT_TTL_HOURS = int(os.environ.get('PDF_JOB_RESULT_TTL_HOURS', 24))
+PDF_JOB_POLL_INTERVAL_SECONDS = 2
+PDF_JOB_LEASE_SECONDS = int(os.environ.get('PDF_JOB_LEASE_SECONDS', 60))  # Renewed while rendering, expired leases are taken over
+
+# Job states
+PDF_JOB_PENDING = "pending"
+PDF_JOB_RUNNING = "running"
+PDF_JOB_DONE = "done"
+PDF_JOB_FAILED = "failed"
+
+pdf_job_event = asyncio.Event()  # Set when a job is enqueued to wake up idle workers
+pdf_job_tasks: List[asyncio.Task] = []
+
+class PDFJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    client_id: str
+    calculation_id: Optional[str] = None
+    client_mode: Optional[str] = None
+    price_level: str = "base"
+    status: str = PDF_JOB_PENDING
+    attempts: int = 0
+    error: Optional[str] = None
+    filename: Optional[str] = None
+    claimed_by: Optional[str] = None  # Token of the current attempt, only its owner may update the job
+    lease_expires_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: Optional[datetime] = None
+
+async def claim_pdf_job() -> Optional[dict]:
+    """
+    Atomically take the oldest runnable job from the queue
+    Running jobs whose lease expired belong to a process that died, they are taken over
+    """
+    now = datetime.utcnow()
+    return await db.pdf_jobs.find_one_and_update(
+        {"$or": [
+            {"status": PDF_JOB_PENDING, "next_attempt_at": {"$lte": now}},
+            {"status": PDF_JOB_RUNNING, "lease_expires_at": {"$lte": now}},
+            # Claimed before leases existed
+            {"status": PDF_JOB_RUNNING, "lease_expires_at": None, "updated_at": {"$lte": now - timedelta(seconds=PDF_JOB_LEASE_SECONDS)}}
+        ]},
+        {
+            "$set": {
+                "status": PDF_JOB_RUNNING,
+                "claimed_by": uuid.uuid4().hex,
+                "lease_expires_at": now + timedelta(seconds=PDF_JOB_LEASE_SECONDS),
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def renew_pdf_job_lease(job: dict):
+    """
+    Heartbeat: extend the lease while the job renders
+    """
+    while True:
+        await asyncio.sleep(PDF_JOB_LEASE_SECONDS / 3)
+        result = await db.pdf_jobs.update_one(
+            {"id": job['id'], "claimed_by": job['claimed_by']},
+            {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=PDF_JOB_LEASE_SECONDS)}}
+        )
+        if not result.matched_count:
+            logging.warning(f"PDF job {job['id']} lease lost, another worker took it over")
+            return
+
+async def run_pdf_job(job: dict):
+    """
+    Render one job and store the result, or schedule a retry on failure
+    Results are only written while the job is still claimed by this attempt
+    """
+    owned = {"id": job['id'], "claimed_by": job['claimed_by']}
+    if job['attempts'] > PDF_JOB_MAX_ATTEMPTS:
+        # Taken over after its workers died each time, e.g. killed while rendering it
+        now = datetime.utcnow()
+        await db.pdf_jobs.update_one(owned, {"$set": {
+            "status": PDF_JOB_FAILED,
+            "error": job.get('error') or "Worker lost while rendering",
+            "lease_expires_at": None,
+            "updated_at": now,
+            "expires_at": now + timedelta(hours=PDF_JOB_RESULT_TTL_HOURS)
+        }})
+        logging.error(f"PDF job {job['id']} abandoned after {job['attempts'] - 1} attempts")
+        return
+    
+    heartbeat = asyncio.create_task(renew_pdf_job_lease(job))
+    try:
+        pdf_bytes, filename = await build_client_report(
+            job['client_id'], job.get('calculation_id'), job.get('client_mode'), job.get('price_level', "base")
+        )
+        now = datetime.utcnow()
+        result = await db.pdf_jobs.update_one(
+            owned,
+            {"$set": {
+                "status": PDF_JOB_DONE,
+                "pdf": pdf_bytes,
+                "filename": filename,
+                "error": None,
+                "lease_expires_at": None,
+                "updated_at": now,
+                "expires_at": now + timedelta(hours=PDF_JOB_RESULT_TTL_HOURS)
+            }}
+        )
+        if result.matched_count:
+            logging.info(f"PDF job {job['id']} done for client {job['client_id']}")
+        else:
+            logging.warning(f"PDF job {job['id']} rendered after its lease was taken over, result dropped")
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        now = datetime.utcnow()
+        # A missing client will never succeed, don't retry it
+        retryable = not (isinstance(e, HTTPException) and e.status_code == 404)
+        if retryable and job['attempts'] < PDF_JOB_MAX_ATTEMPTS:
+            delay = PDF_JOB_RETRY_DELAY_SECONDS * 2 ** (job['attempts'] - 1)
+            update = {
+                "status": PDF_JOB_PENDING,
+                "error": error,
+                "lease_expires_at": None,
+                "updated_at": now,
+                "next_attempt_at": now + timedelta(seconds=delay)
+            }
+            logging.warning(f"PDF job {job['id']} attempt {job['attempts']} failed, retrying in {delay}s: {error}")
+        else:
+            update = {
+                "status": PDF_JOB_FAILED,
+                "error": error,
+                "lease_expires_at": None,
+                "updated_at": now,
+                "expires_at": now + timedelta(hours=PDF_JOB_RESULT_TTL_HOURS)
+            }
+            logging.error(f"PDF job {job['id']} failed after {job['attempts']} attempts: {error}")
+        await db.pdf_jobs.update_one(owned, {"$set": update})
+    finally:
+        heartbeat.cancel()
+
+async def pdf_job_worker(worker_id: int):
+    """
+    Worker loop: claim jobs until the queue is empty, then wait for a new one
+    """
+    while True:
+        try:
+            job = await claim_pdf_job()
+            if job:
+                await run_pdf_job(job)
+                continue
+            pdf_job_event.clear()
+            try:
+                # Also wake up periodically to pick up delayed retries
+                await asyncio.wait_for(pdf_job_event.wait(), timeout=PDF_JOB_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"PDF worker {worker_id} error: {e}")
+            await asyncio.sleep(PDF_JOB_POLL_INTERVAL_SECONDS)
+
+async def start_pdf_job_workers():
+    """
+    Prepare the job collection and start the worker pool
+    """
+    # Finished jobs and their PDFs are purged by Mongo once expired
+    await db.pdf_jobs.create_index("expires_at", expireAfterSeconds=0)
+    await db.pdf_jobs.create_index("id", unique=True)
+    await db.pdf_jobs.create_index([("status", 1), ("next_attempt_at", 1), ("created_at", 1)])
+    await db.pdf_jobs.create_index([("status", 1), ("lease_expires_at", 1)])
+    
+    # Jobs left running by a dead process are taken over by claim_pdf_job once their lease expires,
+    # jobs of the other live processes (several uvicorn workers, rolling deploys) are left alone
+    
+    for worker_id in range(PDF_JOB_WORKERS):
+        pdf_job_tasks.append(asyncio.create_task(pdf_job_worker(worker_id)))
+    logging.info(f"Started {PDF_JOB_WORKERS} PDF job workers")
+
+async def stop_pdf_job_workers():
+    for task in pdf_job_tasks:
+        task.cancel()
+    await asyncio.gather(*pdf_job_tasks, return_exceptions=True)
+    pdf_job_tasks.clear()
+
+@api_router.post("/pdf-jobs/{client_id}", status_code=202)
+async def create_pdf_job(client_id: str, calculation_id: Optional[str] = None,
+                         client_mode: Optional[str] = None, price_level: str = "base"):
+    """Queue a PDF report for a client, poll /pdf-jobs/{job_id} for its status"""
+    client = await db.clients.find_one({"id": client_id}, {"_id": 1})
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found")
+    
+    job = PDFJob(client_id=client_id, calculation_id=calculation_id, client_mode=client_mode, price_level=price_level)
+    await db.pdf_jobs.insert_one(job.dict())
+    pdf_job_event.set()
+    
+    return {"job_id": job.id, "status": job.status}
+
+@api_router.get("/pdf-jobs/{job_id}")
+async def get_pdf_job(job_id: str):
+    """Get the status of a PDF job"""
+    job = await db.pdf_jobs.find_one({"id": job_id}, {"_id": 0, "pdf": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return PDFJob(**job)
+
+@api_router.get("/pdf-jobs/{job_id}/download")
+async def download_pdf_job(job_id: str):
+    """Download the PDF produced by a finished job"""
+    job = await db.pdf_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.get('expires_at') and job['expires_at'] <= datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Job result expired")
+    if job['status'] == PDF_JOB_FAILED:
+        raise HTTPException(status_code=500, detail=job.get('error') or "PDF generation failed")
+    if job['status'] != PDF_JOB_DONE:
+        raise HTTPException(status_code=409, detail=f"Job not finished (status: {job['status']})")
+    
+    return Response(
+        content=bytes(job['pdf']),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"attachment; filename={job['filename']}"}
+    )
+
+# On-demand profiler: samples the worker's thread stacks for a bounded time, admin only
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')  # Empty disables the admin endpoints
+PROFILER_MAX_SECONDS = float(os.environ.get('PROFILER_MAX_SECONDS', 60))
+PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', 5))
+PROFILE_FORMATS = ["collapsed", "pstats"]
+
+profiler_lock = asyncio.Lock()  # One profile at a time per worker
+
+def require_admin(token: Optional[str]):
+    """Reject the call unless the X-Admin-Token header matches ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+def frame_key(frame) -> Tuple[str, int, str]:
+    """Function identity as used by pstats: (file, first line, name)"""
+    code = frame.f_code
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+def sample_stacks(stop: threading.Event, interval: float, endpoints: Dict[Any, str], routes: List[str], samples: Dict[Tuple, int]):
+    """
+    Sampler thread: count the stack of every other thread, root first, prefixed by the route
+    A stack belongs to a route when one of its frames is the route's endpoint (coroutine frames
+    of a running task are chained, so the endpoint is on the stack while its code runs), the
+    frames above the endpoint (event loop, middlewares) are dropped
+    With no route selected every stack is kept, under "-" when it is not serving a route
+    """
+    own_thread = threading.get_ident()
+    while not stop.wait(interval):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            route = None
+            while frame is not None and route is None:
+                stack.append(frame_key(frame))
+                route = endpoints.get(frame.f_code)
+                frame = frame.f_back
+            if route is None:
+                route = "-"
+            if routes and route not in routes:
+                continue
+            key = (route, tuple(reversed(stack)))
+            samples[key] = samples.get(key, 0) + 1
+
+def collapsed_stacks(samples: Dict[Tuple, int]) -> str:
+    """Brendan Gregg's collapsed format, input of flamegraph.pl and speedscope"""
+    lines = []
+    for (route, stack), count in sorted(samples.items(), key=lambda item: -item[1]):
+        frames = [f"{Path(filename).name}:{name}:{line}" for filename, line, name in stack]
+        lines.append(f"{';'.join([route] + frames)} {count}")
+    return "\n".join(lines) + "\n"
+
+class SampledStats:
+    """Samples shaped like a cProfile run so that pstats can sort and print them"""
+    def __init__(self, samples: Dict[Tuple, int], interval: float):
+        self.stats = {}
+        for (_, stack), count in samples.items():
+            seconds = count * interval
+            seen = set()
+            for depth, function in enumerate(stack):
+                primitive_calls, calls, own, cumulative, callers = self.stats.get(function, (0, 0, 0.0, 0.0, {}))
+                own += seconds if depth == len(stack) - 1 else 0
+                calls += count
+                if function not in seen:  # Recursion: count the cumulative time once per sample
+                    primitive_calls += count
+                    cumulative += seconds
+                    seen.add(function)
+                if depth > 0:
+                    caller = callers.get(stack[depth - 1], (0, 0, 0.0, 0.0))
+                    callers[stack[depth - 1]] = (caller[0] + count, caller[1] + count, caller[2], caller[3] + seconds)
+                self.stats[function] = (primitive_calls, calls, own, cumulative, callers)
+
+    def create_stats(self):
+        pass
+
+def pstats_report(samples: Dict[Tuple, int], interval: float, sort: str, limit: int) -> str:
+    """pstats listing of the samples, call counts are sample counts"""
+    output = io.StringIO()
+    stats = pstats.Stats(SampledStats(samples, interval), stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+async def profile_worker(seconds: float, interval: float, routes: List[str]) -> Tuple[Dict[Tuple, int], int]:
+    """Sample this worker for the given time, returns the samples and the number of ticks"""
+    endpoints = {route.endpoint.__code__: route.path for route in app.routes if getattr(route, "endpoint", None)}
+    samples: Dict[Tuple, int] = {}
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_stacks, args=(stop, interval, endpoints, routes, samples), name="profiler", daemon=True)
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+        await asyncio.to_thread(sampler.join)
+    return samples, int((time.perf_counter() - started) / interval)
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Prometheus text format scrape endpoint"""
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@api_router.get("/admin/profile")
+async def get_profile(
+    seconds: float = 10,
+    route: List[str] = Query(default=[]),
+    format: str = "collapsed",
+    interval_ms: float = PROFILER_INTERVAL_MS,
+    sort: str = "cumulative",
+    limit: int = 50,
+    x_admin_token: Optional[str] = Header(default=None)
+):
+    """
+    Time-boxed sampling profile of this worker, e.g. ?seconds=30&route=/api/calculate/{client_id}
+    Routes are given as templates; collapsed stacks feed flame graphs, pstats lists the hot functions
+    """
+    require_admin(x_admin_token)
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of {PROFILE_FORMATS}")
+    if not 0 < seconds <= PROFILER_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {PROFILER_MAX_SECONDS:g}")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    known_routes = {getattr(api_route, "path", None) for api_route in app.routes}
+    unknown = [path for path in route if path not in known_routes]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown routes: {unknown}")
+    if profiler_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    
+    try:
+        async with profiler_lock:
+            interval = interval_ms / 1000
+            samples, ticks = await profile_worker(seconds, interval, route)
+            if format == "collapsed":
+                content = collapsed_stacks(samples)
+            else:
+                content = pstats_report(samples, interval, sort, limit)
+        return Response(
+            content=content,
+            media_type="text/plain; charset=utf-8",
+            headers={"X-Profile-Samples": str(sum(samples.values())), "X-Profile-Ticks": str(ticks)}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Profiler error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/production-grid/report")
+async def get_production_grid_report(cell_degrees: Optional[float] = None, tolerance_percent: float = PRODUCTION_GRID_TOLERANCE_PERCENT,
+                                     sample: int = Query(5000, ge=1, le=PRODUCTION_GRID_REPORT_MAX_SAMPLE),
+                                     x_admin_token: Optional[str] = Header(default=None)):
+    """Yield error and cache sharing of the production grid for a sample of the stored clients (admin only)"""
+    require_admin(x_admin_token)
+    try:
+        return await production_grid_report(cell_degrees, tolerance_percent, sample)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Production grid report error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.get("/test-pvgis/{lat}/{lon}")
 async def test_pvgis(lat: float, lon: float, orientation: str = "Sud", power: int = 6):
     """Test endpoint for PVGIS API"""
@@ -1488,6 +5313,8 @@ async def test_pvgis(lat: float, lon: float, orientation: str = "Sud", power: in
             "power_kw": power,
             "pvgis_data": data
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1509,6 +5336,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_pdf_jobs():
+    await start_pdf_job_workers()
+
+@app.on_event("startup")
+async def startup_geocode_cache():
+    global geocode_resume_task
+    await db.geocode_cache.create_index("key", unique=True)
+    await db.geocode_cache.create_index("provider")
+    geocode_resume_task = asyncio.create_task(resume_pending_geocodings())
+
+@app.on_event("startup")
+async def startup_cache_warmup():
+    # Runs in the background so that the API is available right away
+    global cache_warmup_task
+    if CACHE_WARMUP_ON_STARTUP:
+        cache_warmup_task = asyncio.create_task(warm_production_cache())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await stop_pdf_job_workers()
+    for task in [cache_warmup_task, geocode_resume_task]:
+        if task and not task.done():
+            task.cancel()
+    client.close()
+
+if __name__ == "__main__":
+    # Offline tasks: python server.py build-yield-raster | warm-cache | build-gazetteer <csv>
+    if sys.argv[1:2] == ["build-yield-raster"]:
+        print(json.dumps(asyncio.run(build_yield_raster())))
+    elif sys.argv[1:2] == ["warm-cache"]:
+        print(json.dumps(asyncio.run(warm_production_cache())))
+    elif sys.argv[1:2] == ["build-gazetteer"] and len(sys.argv) == 3:
+        print(json.dumps(build_gazetteer(Path(sys.argv[2]))))
@@ -0,0 +1,115 @@
+"""
+Shared setup of the in-process tests: server.py is imported directly from backend/
+server.py reads MONGO_URL and DB_NAME at import, Motor only connects on the first query
+so placeholders are enough for code that does not touch the database
+"""
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "solar_calculator_tests")
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import server  # noqa: E402  (needs the environment above)
+
+# Benchmark baseline: fastest round in seconds per benchmark, committed with the tests
+# Timings depend on the machine, the comparison is opt-in (--benchmark-compare-baseline) and meant for the reference
+# runner, record a local baseline with --benchmark-update-baseline and BENCHMARK_BASELINE_PATH
+BENCHMARK_BASELINE_PATH = Path(os.environ.get("BENCHMARK_BASELINE_PATH", Path(__file__).parent / "benchmark_baseline.json"))
+BENCHMARK_MAX_REGRESSION = float(os.environ.get("BENCHMARK_MAX_REGRESSION", 0.25))  # Accepted slowdown vs the baseline
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark-compare-baseline",
+        action="store_true",
+        default=False,
+        help="Fail the benchmarks more than BENCHMARK_MAX_REGRESSION slower than the baseline",
+    )
+    parser.addoption(
+        "--benchmark-update-baseline",
+        action="store_true",
+        default=False,
+        help="Record the measured timings as the new benchmark baseline",
+    )
+
+
+@pytest.fixture(scope="session")
+def benchmark_baseline(request):
+    """Stored baseline, written back at the end of the session with --benchmark-update-baseline"""
+    baseline = json.loads(BENCHMARK_BASELINE_PATH.read_text()) if BENCHMARK_BASELINE_PATH.exists() else {}
+    updated = dict(baseline)
+    yield baseline, updated
+    if request.config.getoption("--benchmark-update-baseline") and updated != baseline:
+        BENCHMARK_BASELINE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        BENCHMARK_BASELINE_PATH.write_text(json.dumps(updated, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture
+def regression(benchmark_baseline, request):
+    """
+    Compare a finished benchmark with the baseline: assert regression(benchmark) is None
+    The fastest round is compared, it is the least sensitive to noise from the rest of the machine
+    Only with --benchmark-compare-baseline, benchmarks missing from the baseline are skipped
+    Returns the regression message, None within BENCHMARK_MAX_REGRESSION
+    """
+    def check(benchmark):
+        if benchmark.stats is None:  # --benchmark-disable
+            return None
+        fastest = benchmark.stats.stats.min
+        baseline, updated = benchmark_baseline
+        name = request.node.name
+        if request.config.getoption("--benchmark-update-baseline"):
+            updated[name] = fastest
+            return None
+        if not request.config.getoption("--benchmark-compare-baseline"):
+            return None
+        if name not in baseline:
+            pytest.skip(f"{name} has no baseline, record it with --benchmark-update-baseline")
+        limit = baseline[name] * (1 + BENCHMARK_MAX_REGRESSION)
+        if fastest <= limit:
+            return None
+        return (
+            f"{name} regressed: {fastest * 1000:.3f} ms vs baseline {baseline[name] * 1000:.3f} ms "
+            f"(limit +{BENCHMARK_MAX_REGRESSION:.0%})"
+        )
+
+    return check
+
+
+@pytest.fixture
+def specific_yield():
+    """Site yield (kWh/kWp/year) of the stored_client calculation"""
+    return 1200
+
+
+@pytest.fixture
+def roof_surface():
+    """Default roof surface of stored_client, override the fixture in a module to change it"""
+    return 40
+
+
+@pytest.fixture
+def stored_client(specific_yield, roof_surface):
+    """
+    Factory of clients whose stored calculation gives the site yield, so that no PVGIS call is made
+    Keyword arguments override the client fields
+    """
+    def make(**overrides):
+        client = {
+            "roof_orientation": "Sud", "roof_surface": roof_surface, "velux_count": 0, "latitude": 48.85,
+            "longitude": 2.35, "annual_consumption_kwh": 6500,
+        }
+        client.update(overrides)
+        client["last_calculation"] = {
+            "kit_power": 6, "estimated_production": 6 * specific_yield, "roof_geometry": server.get_roof_sections(client),
+        }
+        return client
+
+    return make
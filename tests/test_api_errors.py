@@ -0,0 +1,70 @@
+"""Client errors raised inside the endpoints' try blocks must not be turned into 500s"""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(server.app)  # Not entered: startup hooks (Mongo, workers) are not run
+
+
+@pytest.mark.parametrize("url", [
+    "/api/optimise-kit/any?objective=unknown",
+    "/api/optimise-kit/any?financing=unknown",
+    "/api/sensitivity/any?financing=unknown",
+    "/api/monte-carlo/any?financing=unknown",
+    "/api/monte-carlo/any?draws=0",
+    "/api/cash-flow/any?financing=unknown",
+    "/api/battery-sizing/any?capacities=-5",
+])
+def test_validation_errors_are_400(client, url):
+    response = client.get(url)
+    assert response.status_code == 400
+    assert not response.json()["detail"].startswith("400")
+
+
+@pytest.mark.parametrize("url", [
+    "/api/cash-flow/any?years=0",
+    "/api/cash-flow/any?years=-3",
+    "/api/cash-flow/any?years=100000",
+    "/api/cash-flow/any?duration_months=0",
+    "/api/cash-flow/any?duration_months=100000",
+    "/api/cash-flow/portfolio?years=0",
+    "/api/cash-flow/portfolio?years=100000",
+])
+def test_projection_bounds_are_validated(client, url):
+    assert client.get(url).status_code == 422
+
+
+def test_pvgis_outage_stays_503(monkeypatch):
+    async def pvgis_request(endpoint, params):
+        raise server.HTTPException(status_code=503, detail="PVGIS unavailable (circuit open)")
+    monkeypatch.setattr(server, "pvgis_request", pvgis_request)
+    with pytest.raises(server.HTTPException) as error:
+        asyncio.run(server.get_pvgis_data(48.85, 2.35, "Sud", 6))
+    assert error.value.status_code == 503
+
+
+def test_geocode_reresolution_is_admin_only(client, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    assert client.post("/api/geocode-cache/re-resolve").status_code == 401
+    assert client.post("/api/geocode-cache/re-resolve", headers={"X-Admin-Token": "wrong"}).status_code == 401
+    response = client.post("/api/geocode-cache/re-resolve?limit=100000", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 422
+
+
+def test_production_grid_report_is_admin_only(client, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    assert client.get("/api/production-grid/report").status_code == 401
+    response = client.get("/api/production-grid/report?sample=1000000", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 422
+
+
+def test_import_format_query_parameter(client):
+    response = client.post("/api/clients/import?format=xml", content=b"")
+    assert response.status_code == 400
+    assert "Invalid format" in response.json()["detail"]
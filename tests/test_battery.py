@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import server
+
+
+def day_profiles(days: int = 365):
+    """1 kWh of surplus at noon and 1 kWh of deficit in the evening, every day"""
+    production = np.zeros(days * 24)
+    load = np.zeros(days * 24)
+    production[12::24] = 1.0
+    load[20::24] = 1.0
+    return production, load
+
+
+def test_battery_shifts_the_daily_surplus():
+    production, load = day_profiles()
+    sweep = server.simulate_battery_sweep(production, load, [0, 10])
+    efficiency = server.BATTERY_CHARGE_EFFICIENCY * server.BATTERY_DISCHARGE_EFFICIENCY
+    np.testing.assert_allclose(sweep["charged_kwh"], [0, 365])
+    np.testing.assert_allclose(sweep["discharged_kwh"], [0, 365 * efficiency])
+    np.testing.assert_allclose(sweep["autoconsumption_kwh"], sweep["discharged_kwh"])
+
+
+def test_power_limit_caps_charge_and_discharge():
+    production, load = day_profiles()
+    capacity = 1.0  # Max power of C_RATE kW
+    sweep = server.simulate_battery_sweep(production, load, [capacity])
+    assert sweep["charged_kwh"][0] == pytest.approx(365 * capacity * server.BATTERY_C_RATE)
+
+
+def test_energy_balances():
+    production = server.synthetic_hourly_profile(48.85, 0, server.PANEL_TILT, lon=2.35) * 6
+    load = server.build_load_profile(6500, "Radiateurs électriques", "Ballon électrique standard")
+    sweep = server.simulate_battery_sweep(production, load, server.BATTERY_CAPACITIES_KWH)
+    np.testing.assert_allclose(sweep["surplus_kwh"] + sweep["charged_kwh"], np.clip(production - load, 0, None).sum())
+    np.testing.assert_allclose(sweep["grid_import_kwh"] + sweep["autoconsumption_kwh"], load.sum())
+    # Larger batteries never do worse, and never deliver more than they stored
+    assert np.all(np.diff(sweep["autoconsumption_kwh"]) >= -1e-9)
+    assert np.all(sweep["discharged_kwh"] <= sweep["charged_kwh"])
+
+
+def test_capacities_are_independent():
+    production, load = day_profiles(30)
+    together = server.simulate_battery_sweep(production, load, [0.5, 2, 5])
+    for index, capacity in enumerate([0.5, 2, 5]):
+        alone = server.simulate_battery_sweep(production, load, [capacity])
+        assert together["discharged_kwh"][index] == pytest.approx(alone["discharged_kwh"][0])
+
+
+@pytest.mark.parametrize("capacities", [[-5], [5, float("nan")], [], [5] * (server.BATTERY_MAX_CAPACITIES + 1)])
+def test_invalid_capacities_are_rejected(capacities):
+    production, load = day_profiles()
+    with pytest.raises(server.HTTPException) as error:
+        server.simulate_battery_sweep(production, load, capacities)
+    assert error.value.status_code == 400
@@ -0,0 +1,120 @@
+"""
+Micro-benchmarks of the engine hot paths, run in-process with fixed inputs (no PVGIS, no Mongo)
+
+    pytest tests/test_benchmarks.py                                # measure only
+    pytest tests/test_benchmarks.py --benchmark-compare-baseline   # compare with the baseline
+    pytest tests/test_benchmarks.py --benchmark-update-baseline    # accept the current timings
+
+The baseline is committed in tests/benchmark_baseline.json and holds the timings of the reference runner,
+with --benchmark-compare-baseline a test fails when its fastest round is more than
+BENCHMARK_MAX_REGRESSION (25% by default) above it
+"""
+import pytest
+
+import server
+
+# Rounds of at least 0.2 ms: the financing functions take microseconds, single calls are mostly timer noise
+pytestmark = pytest.mark.benchmark(min_time=0.0002)
+
+# Typical particulier: 6 kWc kit, Paris-like monthly production
+MONTHLY_PRODUCTION = [
+    {"month": month, "E_m": production}
+    for month, production in enumerate([250, 320, 480, 560, 620, 650, 680, 630, 520, 400, 270, 230], start=1)
+]
+KIT_PRICE = 14900
+TOTAL_AIDS = 1680
+MONTHLY_SAVINGS = 96.5
+
+CLIENT = {
+    "id": "benchmark-client",
+    "first_name": "Jean",
+    "last_name": "Dupont",
+    "address": "1 rue de Rivoli 75001 Paris",
+    "roof_surface": 40,
+    "roof_orientation": "Sud",
+    "velux_count": 0,
+    "heating_system": "Radiateurs électriques",
+    "water_heating_system": "Ballon électrique standard",
+    "annual_consumption_kwh": 6500,
+    "monthly_edf_payment": 150,
+    "annual_edf_payment": 1800,
+    "client_mode": "particuliers",
+}
+
+
+@pytest.fixture(scope="module")
+def calculation():
+    """Calculation result as stored for a particulier, built from the engine functions"""
+    return {
+        "kit_power": 6,
+        "panel_count": 12,
+        "surface": 25.2,
+        "kit_price": KIT_PRICE,
+        "estimated_production": sum(month["E_m"] for month in MONTHLY_PRODUCTION),
+        "estimated_savings": 1158,
+        "monthly_savings": MONTHLY_SAVINGS,
+        "autonomy_percentage": 72.5,
+        "autoconsumption_kwh": 4620,
+        "surplus_kwh": 1990,
+        "autoconsumption_aid": 1680,
+        "total_aids": TOTAL_AIDS,
+        "pvgis_monthly_data": MONTHLY_PRODUCTION,
+        "financing_options": server.calculate_financing_options(KIT_PRICE, MONTHLY_SAVINGS),
+        "financing_with_aids": server.calculate_financing_with_aids(KIT_PRICE, TOTAL_AIDS, MONTHLY_SAVINGS),
+        "all_financing_with_aids": server.calculate_all_financing_with_aids(KIT_PRICE, TOTAL_AIDS, MONTHLY_SAVINGS),
+    }
+
+
+@pytest.mark.parametrize("client_mode", ["particuliers", "professionnels"])
+def test_calculate_optimal_kit_size(benchmark, regression, client_mode):
+    power = benchmark(server.calculate_optimal_kit_size, 6500, 40, client_mode)
+    assert power in server.get_solar_kits_by_mode(client_mode)
+    assert regression(benchmark) is None
+
+
+def test_calculate_leasing_options(benchmark, regression):
+    options = benchmark(server.calculate_leasing_options, 25000)
+    assert options
+    assert regression(benchmark) is None
+
+
+def test_find_optimal_leasing_kit(benchmark, regression):
+    result = benchmark(server.find_optimal_leasing_kit, server.SOLAR_KITS_PROFESSIONNELS, 450)
+    assert result
+    assert regression(benchmark) is None
+
+
+def test_calculate_financing_options(benchmark, regression):
+    options = benchmark(server.calculate_financing_options, KIT_PRICE, MONTHLY_SAVINGS)
+    assert len(options) == 10
+    assert regression(benchmark) is None
+
+
+def test_calculate_financing_with_aids(benchmark, regression):
+    result = benchmark(server.calculate_financing_with_aids, KIT_PRICE, TOTAL_AIDS, MONTHLY_SAVINGS)
+    assert result["financed_amount"] == KIT_PRICE - TOTAL_AIDS
+    assert regression(benchmark) is None
+
+
+def test_calculate_all_financing_with_aids(benchmark, regression):
+    options = benchmark(server.calculate_all_financing_with_aids, KIT_PRICE, TOTAL_AIDS, MONTHLY_SAVINGS)
+    assert len(options) == 10
+    assert regression(benchmark) is None
+
+
+def test_generate_monthly_chart(benchmark, regression):
+    chart = benchmark.pedantic(server.generate_monthly_chart, args=(MONTHLY_PRODUCTION,), rounds=10, warmup_rounds=2)
+    assert chart
+    assert regression(benchmark) is None
+
+
+def test_generate_autonomy_pie_chart(benchmark, regression):
+    chart = benchmark.pedantic(server.generate_autonomy_pie_chart, args=(72.5,), rounds=10, warmup_rounds=2)
+    assert chart
+    assert regression(benchmark) is None
+
+
+def test_generate_solar_report_pdf(benchmark, regression, calculation):
+    pdf = benchmark.pedantic(server.generate_solar_report_pdf, args=(CLIENT, calculation), rounds=5, warmup_rounds=1)
+    assert pdf.startswith(b"%PDF")
+    assert regression(benchmark) is None
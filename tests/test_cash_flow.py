@@ -0,0 +1,82 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import server
+
+
+def project(**overrides):
+    inputs = dict(
+        self_consumption_savings=1000, surplus_revenue=0, upfront_cost=10000, aids=0,
+        monthly_payment=0, payment_months=0, years=25, rate_increase=0, degradation=0,
+    )
+    inputs.update(overrides)
+    return server.project_cash_flows(**inputs)
+
+
+def test_payback_of_a_cash_purchase():
+    assert project()["payback_years"][0] == pytest.approx(10.0)
+
+
+def test_payback_is_interpolated_within_the_year():
+    assert project(upfront_cost=10500)["payback_years"][0] == pytest.approx(10.5)
+
+
+def test_aids_are_received_the_first_year():
+    assert project(aids=2000)["payback_years"][0] == pytest.approx(8.0)
+
+
+def test_never_negative_balance_pays_back_immediately():
+    assert project(upfront_cost=0)["payback_years"][0] == 0
+
+
+def test_not_paid_back_within_the_projection_is_nan():
+    assert np.isnan(project(upfront_cost=30000)["payback_years"][0])
+
+
+def test_loan_payments_are_spread_over_the_months():
+    payments = project(upfront_cost=0, monthly_payment=100, payment_months=30)["payments"][0]
+    assert payments[:4].tolist() == [1200, 1200, 600, 0]
+
+
+def test_escalation_and_degradation_apply_to_savings():
+    savings = project(rate_increase=0.1, degradation=0.5, surplus_revenue=100)["savings"][0]
+    assert savings[0] == pytest.approx(1100)
+    # Self-consumption savings escalate with the EDF rate, surplus sales do not
+    assert savings[1] == pytest.approx((1000 * 1.1 + 100) * 0.5)
+
+
+def test_batch_matches_single_projections():
+    batch = project(self_consumption_savings=[1000, 800], upfront_cost=[10000, 12000], rate_increase=0.03)
+    for index, (savings, cost) in enumerate([(1000, 10000), (800, 12000)]):
+        single = project(self_consumption_savings=savings, upfront_cost=cost, rate_increase=0.03)
+        np.testing.assert_allclose(batch["cumulative"][index], single["cumulative"][0])
+        np.testing.assert_allclose(batch["payback_years"][index], single["payback_years"][0])
+
+
+def test_roi_without_outflows_is_nan():
+    result = project(upfront_cost=0)
+    assert np.isnan(result["roi"][0])
+    assert result["net_gain"][0] == pytest.approx(25000)
+
+
+def test_stored_calculation_is_reused_only_for_its_mode_and_price_level(monkeypatch):
+    computed = []
+
+    async def compute_professional_solution(client, price_level="base", client_mode=None, hourly_simulation=False):
+        computed.append(("professionnels", price_level))
+        return {"client_mode": "professionnels", "price_level": price_level}
+
+    async def compute_solar_solution(client, hourly_simulation=False, estimate=False, client_mode=None):
+        computed.append((client_mode, None))
+        return {"client_mode": client_mode}, {}
+
+    monkeypatch.setattr(server, "compute_professional_solution", compute_professional_solution)
+    monkeypatch.setattr(server, "compute_solar_solution", compute_solar_solution)
+    stored = {"client_mode": "professionnels", "price_level": "base"}
+    client = {"client_mode": "professionnels", "last_calculation": stored}
+    assert asyncio.run(server.get_client_calculation(client)) is stored
+    assert asyncio.run(server.get_client_calculation(client, price_level="remise_max"))["price_level"] == "remise_max"
+    assert asyncio.run(server.get_client_calculation(client, "particuliers"))["client_mode"] == "particuliers"
+    assert computed == [("professionnels", "remise_max"), ("particuliers", None)]
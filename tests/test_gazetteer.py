@@ -0,0 +1,71 @@
+import pytest
+
+import server
+
+COMMUNES = """Code_commune_INSEE;Nom_de_la_commune;Code_postal;Ligne_5;Libellé_d_acheminement;coordonnees_gps
+75101;PARIS 01;75001;;PARIS;48.8626,2.3363
+69123;LYON;69001;;LYON;45.7699,4.8292
+69123;LYON;69002;;LYON;45.7500,4.8270
+42218;ST ETIENNE;42000;;ST ETIENNE;45.4340,4.3900
+01004;AMBERIEU EN BUGEY;01500;;AMBERIEU EN BUGEY;45.9600,5.3700
+01007;AMBRONAY;01500;;AMBRONAY;46.0000,5.3600
+33063;BORDEAUX;33000;;BORDEAUX;44.8510,-0.5870
+40001;SAINT MARTIN;40100;;SAINT MARTIN;43.7000,-1.0500
+64001;SAINT MARTIN;64100;;SAINT MARTIN;43.3000,-1.4000
+99999;NOWHERE;ABCDE;;NOWHERE;1,2
+"""
+
+
+@pytest.fixture
+def gazetteer(tmp_path, monkeypatch):
+    source = tmp_path / "communes.csv"
+    source.write_text(COMMUNES, encoding="utf-8")
+    monkeypatch.setattr(server, "GAZETTEER_DIR", tmp_path / "gazetteer")
+    monkeypatch.setattr(server, "gazetteer", None)
+    monkeypatch.setattr(server, "gazetteer_checked", False)
+    return server.build_gazetteer(source, tmp_path / "gazetteer")
+
+
+def test_normalize_text():
+    assert server.normalize_text("  Saint-Étienne (Loire)!  ") == "saint etienne loire"
+
+
+def test_abbreviations_are_expanded():
+    assert server.normalize_commune_name("St-Étienne") == "saint etienne"
+
+
+def test_build_skips_invalid_rows_and_merges_postcodes(gazetteer):
+    assert gazetteer["communes"] == 8
+    assert gazetteer["postcodes"] == 9
+    lyon, = server.gazetteer_lookup_commune("Lyon")
+    assert server.gazetteer_commune(lyon)["latitude"] == pytest.approx((45.7699 + 45.75) / 2, abs=1e-4)
+
+
+def test_lookups(gazetteer):
+    assert [server.gazetteer_name(index) for index in server.gazetteer_prefix("amb")] == ["amberieu en bugey", "ambronay"]
+    assert len(server.gazetteer_lookup_commune("Saint Martin")) == 2
+    assert len(server.gazetteer_lookup_postcode("01500")) == 2
+    assert server.gazetteer_lookup_postcode("99999") == []
+
+
+def test_single_commune_postcode_is_confident(gazetteer):
+    match = server.gazetteer_resolve("3 cours de l'Intendance 33000")
+    assert match["commune"] == "Bordeaux" and match["confident"]
+
+
+def test_commune_named_within_its_postcode_is_confident(gazetteer):
+    match = server.gazetteer_resolve("2 place de la Mairie 01500 Ambronay")
+    assert match["commune"] == "Ambronay" and match["confident"]
+
+
+def test_homonyms_are_not_confident(gazetteer):
+    assert not server.gazetteer_resolve("1 rue Haute, Saint-Martin")["confident"]
+
+
+def test_misspelt_commune_is_a_fuzzy_match(gazetteer):
+    match = server.gazetteer_resolve("10 rue de la Paix, Bordaux")
+    assert match["commune"] == "Bordeaux" and not match["confident"]
+
+
+def test_unknown_commune(gazetteer):
+    assert server.gazetteer_resolve("1 rue de Nulle Part, Xyzzy") is None
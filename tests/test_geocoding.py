@@ -0,0 +1,38 @@
+import asyncio
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("address", [
+    "1 rue de l'Église, Paris 75001",
+    "1 Rue de l Eglise 75001 PARIS",
+    "  1, RUE DE L'ÉGLISE  -  75001  Paris ",
+])
+def test_address_variants_share_a_cache_key(address):
+    assert server.normalize_address(address) == ("75001 1 rue de l eglise paris", "75001")
+
+
+def test_address_without_postcode():
+    assert server.normalize_address("Place Bellecour, Lyon") == ("place bellecour lyon", None)
+
+
+def test_street_numbers_are_not_postcodes():
+    assert server.normalize_address("123 avenue du Prado 13008 Marseille") == ("13008 123 avenue du prado marseille", "13008")
+
+
+def test_cache_failures_do_not_fail_the_geocoding(monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise ConnectionError("Mongo unavailable")
+
+    async def geocode_with_provider(address):
+        return {"latitude": 48.85, "longitude": 2.35, "provider": "test", "fallback_city": None}
+
+    monkeypatch.setattr(server, "db", SimpleNamespace(geocode_cache=SimpleNamespace(find_one=unavailable, update_one=unavailable)))
+    monkeypatch.setattr(server, "geocode_cache", OrderedDict())
+    monkeypatch.setattr(server, "geocode_with_provider", geocode_with_provider)
+    result = asyncio.run(server.resolve_address("1 rue de Rivoli 75001 Paris"))
+    assert (result["latitude"], result["longitude"], result["cached"]) == (48.85, 2.35, False)
@@ -0,0 +1,72 @@
+import asyncio
+
+from pymongo.errors import BulkWriteError
+
+import server
+
+HEADER = ("first_name;last_name;address;roof_surface;roof_orientation;velux_count;heating_system;"
+          "water_heating_system;annual_consumption_kwh;monthly_edf_payment;annual_edf_payment\n")
+
+
+class Body:
+    """Request stand-in streaming its body in small chunks, so that lines and characters span chunks"""
+
+    def __init__(self, text: str, chunk_size: int = 7):
+        self.data = text.encode("utf-8")
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+
+def client_row(first_name: str, address: str) -> str:
+    return f'{first_name};Dupont;{address};40;Sud;0;Radiateurs électriques;Ballon électrique standard;6500;150;1800\n'
+
+
+def read_rows(text: str):
+    async def collect():
+        return [row async for row in server.iter_import_rows(Body(text), "csv")]
+    return asyncio.run(collect())
+
+
+def test_quoted_fields_may_span_lines():
+    rows = read_rows(HEADER + client_row("Jean", '"1 rue de Rivoli\nBâtiment B; 2e étage\n75001 Paris"') + "\n" + client_row("Marie", "2 rue X 69001 Lyon"))
+    assert [number for number, _ in rows] == [1, 2]
+    assert rows[0][1]["address"] == "1 rue de Rivoli\nBâtiment B; 2e étage\n75001 Paris"
+    assert rows[1][1]["first_name"] == "Marie"
+
+
+def test_escaped_quotes_and_comma_delimiter():
+    text = 'first_name,last_name,address\nJean,"Du ""Pont""","1 rue X,\nParis"\n'
+    rows = read_rows(text)
+    assert rows == [(1, {"first_name": "Jean", "last_name": 'Du "Pont"', "address": "1 rue X,\nParis"})]
+
+
+def test_unterminated_quote_is_reported():
+    rows = read_rows(HEADER + client_row("Jean", "1 rue X") + 'Marie;"Dupont;2 rue Y\n')
+    assert rows[0][1]["first_name"] == "Jean"
+    assert rows[1][0] == 2 and rows[1][1].startswith("Invalid CSV")
+
+
+class FailingClients:
+    async def insert_many(self, documents, ordered=True):
+        raise BulkWriteError({
+            "nInserted": len(documents) - 1,
+            "writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000 duplicate key error"}],
+        })
+
+
+def test_failed_inserts_are_reported(monkeypatch):
+    async def resolve_address(address):
+        return {"latitude": 48.85, "longitude": 2.35, "provider": "test", "key": address, "cached": False}
+    monkeypatch.setattr(server, "resolve_address", resolve_address)
+    monkeypatch.setattr(server, "db", type("Db", (), {"clients": FailingClients()})())
+    rows = [
+        (number, server.ClientInfoCreate(**row))
+        for number, row in read_rows(HEADER + "".join(client_row(name, f"{index} rue X 75001 Paris") for index, name in enumerate(["A", "B", "C"])))
+    ]
+    report = {"rows": 3, "imported": 0, "failed": 0, "distinct_addresses": 0, "geocode_cache_hits": 0, "errors": []}
+    asyncio.run(server.import_client_chunk(rows, asyncio.Semaphore(1), report))
+    assert report["imported"] == 2 and report["failed"] == 1
+    assert report["errors"] == [{"row": 2, "errors": [{"field": None, "message": "E11000 duplicate key error"}]}]
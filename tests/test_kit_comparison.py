@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+def compare(client, client_mode="particuliers"):
+    return asyncio.run(server.compare_kits(client, client_mode))
+
+
+def test_every_kit_of_the_catalog_is_evaluated(stored_client):
+    result = compare(stored_client())
+    assert [kit["kit_power"] for kit in result["kits"]] == sorted(server.get_solar_kits_by_mode("particuliers"))
+    assert result["yield_source"] == "calculation"
+    assert sum(kit["recommended"] for kit in result["kits"]) == 1
+
+
+def test_kits_match_the_single_kit_functions(stored_client, specific_yield):
+    aids_config = server.get_aids_by_mode("particuliers")
+    for kit in compare(stored_client())["kits"]:
+        production = kit["kit_power"] * specific_yield
+        assert kit["estimated_production"] == pytest.approx(production)
+        savings = production * (aids_config["autoconsumption_rate"] * aids_config["edf_rate"]
+                                + (1 - aids_config["autoconsumption_rate"]) * aids_config["surplus_sale_rate"])
+        assert kit["estimated_savings"] == pytest.approx(savings, abs=0.01)
+        loan = server.calculate_financing_with_aids(kit["kit_price"], kit["total_aids"], kit["monthly_savings"])
+        assert kit["financing_with_aids"]["monthly_payment"] == pytest.approx(loan["monthly_payment"], abs=0.01)
+
+
+def test_roof_windows_reduce_the_usable_surface(stored_client):
+    result = compare(stored_client(roof_surface=20, velux_count=2))
+    assert result["usable_roof_surface"] == 20 - 2 * server.VELUX_SURFACE_M2
+    for kit in result["kits"]:
+        assert kit["fits_roof"] == (kit["surface"] <= result["usable_roof_surface"])
+
+
+def test_professional_kits_get_their_leasing_fit(stored_client):
+    for kit in compare(stored_client(), "professionnels")["kits"]:
+        if kit["leasing"]:
+            assert kit["leasing"]["monthly_benefit"] == pytest.approx(kit["monthly_savings"] - kit["leasing"]["monthly_payment"], abs=0.01)
@@ -0,0 +1,65 @@
+import asyncio
+import math
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def roof_surface():
+    """Larger roof than the comparison tests, more kits fit and compete in the ranking"""
+    return 60
+
+
+def optimise(client, objective="net_savings", client_mode="particuliers", **options):
+    return asyncio.run(server.optimise_kit(client, objective, client_mode, **options))
+
+
+def test_kits_are_ranked_by_net_gain(stored_client):
+    result = optimise(stored_client(), financing="cash")
+    gains = [kit["net_gain"] for kit in result["kits"]]
+    assert gains == sorted(gains, reverse=True)
+    assert result["best_kit"] == result["kits"][0] and result["best_kit"]["rank"] == 1
+
+
+def test_net_gain_matches_the_cash_flow_projection(stored_client):
+    best = optimise(stored_client(), financing="cash")["best_kit"]
+    kit = next(kit for kit in asyncio.run(server.compare_kits(stored_client()))["kits"] if kit["kit_power"] == best["kit_power"])
+    aids_config = server.get_aids_by_mode("particuliers")
+    production = kit["estimated_production"]
+    projection = server.project_cash_flows(
+        production * aids_config["autoconsumption_rate"] * aids_config["edf_rate"],
+        production * (1 - aids_config["autoconsumption_rate"]) * aids_config["surplus_sale_rate"],
+        kit["kit_price"], kit["total_aids"], 0, 0,
+    )
+    assert best["net_gain"] == pytest.approx(float(projection["net_gain"][0]), abs=0.01)
+
+
+def test_payback_objective(stored_client):
+    paybacks = [kit["payback_years"] for kit in optimise(stored_client(), "payback", financing="cash")["kits"]]
+    finite = [payback for payback in paybacks if payback is not None]
+    assert finite == sorted(finite)
+    # Kits never paid back come last
+    assert paybacks[:len(finite)] == finite
+
+
+def test_kits_larger_than_the_roof_are_excluded(stored_client):
+    result = optimise(stored_client(roof_surface=20, velux_count=2))
+    usable = 20 - 2 * server.VELUX_SURFACE_M2
+    assert result["excluded_kits"] > 0
+    assert all(kit["surface"] <= usable for kit in result["kits"])
+
+
+def test_financing_fit_can_be_required(stored_client):
+    result = optimise(stored_client(), financing="credit", require_financing_fit=True)
+    assert all(kit["financing_fit"] for kit in result["kits"])
+    assert all(kit["monthly_payment"] <= kit["monthly_savings"] for kit in result["kits"])
+
+
+def test_leasing_benefit_is_for_professionals(stored_client):
+    with pytest.raises(server.HTTPException) as error:
+        optimise(stored_client(), "leasing_benefit")
+    assert error.value.status_code == 400
+    benefits = [kit["leasing_benefit"] for kit in optimise(stored_client(), "leasing_benefit", "professionnels")["kits"]]
+    assert benefits == sorted(benefits, key=lambda benefit: -math.inf if benefit is None else benefit, reverse=True)
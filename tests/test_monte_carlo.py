@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import server
+
+CALCULATION = {
+    "client_mode": "particuliers",
+    "kit_price": 14900,
+    "total_aids": 1680,
+    "monthly_savings": 96.5,
+    "estimated_production": 6610,
+    "autoconsumption_kwh": 4620,
+    "surplus_kwh": 1990,
+}
+
+
+def simulate(kit_price, financing="cash"):
+    return server.simulate_monte_carlo(dict(CALCULATION, kit_price=kit_price), financing, draws=2000, seed=1)
+
+
+def test_payback_beyond_horizon_is_none():
+    # Paid back in about 40% of the draws: P50 and P90 fall beyond the projection
+    result = simulate(60000)
+    json.dumps(result, allow_nan=False)  # The endpoint response must stay encodable
+    assert result["payback_years"]["p10"] is not None
+    assert result["payback_years"]["p50"] is None and result["payback_years"]["p90"] is None
+    assert 0 < result["probability_paid_back"] < 0.5
+
+
+def test_never_paid_back():
+    result = simulate(150000, "credit")
+    json.dumps(result, allow_nan=False)
+    assert result["payback_years"] == {"p10": None, "p50": None, "p90": None}
+    assert result["probability_paid_back"] == 0
+
+
+def test_payback_bands_are_ordered():
+    bands = simulate(14900)["payback_years"]
+    assert None not in bands.values()
+    assert bands["p10"] <= bands["p50"] <= bands["p90"]
+
+
+def test_savings_bands_follow_solar_convention():
+    result = simulate(14900)
+    production = result["first_year_production"]
+    # P90 is exceeded in 90% of the draws, so it is the lowest value
+    assert production["p90"] <= production["p50"] <= production["p10"]
+    assert production["p50"] == pytest.approx(CALCULATION["estimated_production"], rel=0.02)
+
+
+def test_seed_makes_draws_reproducible():
+    assert simulate(14900) == simulate(14900)
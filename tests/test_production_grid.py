@@ -0,0 +1,25 @@
+import pytest
+
+import server
+
+
+def test_sites_snap_to_the_cell_centre():
+    assert server.snap_to_production_cell(48.8566, 2.3522, 0.05) == pytest.approx((48.875, 2.375))
+
+
+def test_neighbouring_sites_share_a_cell():
+    assert server.snap_to_production_cell(48.851, 2.301, 0.05) == server.snap_to_production_cell(48.899, 2.349, 0.05)
+    assert server.snap_to_production_cell(48.849, 2.35, 0.05) != server.snap_to_production_cell(48.851, 2.35, 0.05)
+
+
+def test_negative_coordinates_snap_downwards():
+    assert server.snap_to_production_cell(43.31, -1.474, 0.05) == pytest.approx((43.325, -1.475))
+
+
+def test_zero_cell_disables_snapping():
+    assert server.snap_to_production_cell(48.8566, 2.3522, 0) == (48.8566, 2.3522)
+
+
+def test_default_cell_comes_from_configuration(monkeypatch):
+    monkeypatch.setattr(server, "PRODUCTION_GRID_CELL_DEGREES", 0.5)
+    assert server.snap_to_production_cell(48.8566, 2.3522) == pytest.approx((48.75, 2.25))
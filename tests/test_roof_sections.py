@@ -0,0 +1,63 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import server
+
+
+def test_surface_fills_the_best_sections_first():
+    allocation = server.allocate_roof_surface(
+        np.array([10.0, 30.0, 80.0]), np.array([20.0, 25.0, 15.0]), np.array([900.0, 1200.0, 1000.0])
+    )
+    np.testing.assert_allclose(allocation, [[0, 10, 0], [0, 25, 5], [20, 25, 15]])
+
+
+def test_shares_of_a_kit_larger_than_the_roof():
+    allocation = np.array([[0.0, 10.0, 0.0], [20.0, 25.0, 15.0], [0.0, 0.0, 0.0]])
+    shares = server.roof_section_shares(allocation)
+    np.testing.assert_allclose(shares, [[0, 1, 0], [1 / 3, 5 / 12, 1 / 4], [0, 0, 0]])
+
+
+def test_calibration_keeps_the_shape_and_matches_the_monthly_yields():
+    profile = server.synthetic_hourly_profile(48.85, 0, server.PANEL_TILT)
+    monthly = np.linspace(40, 150, 12)
+    calibrated = server.calibrate_hourly_profile(profile, monthly)
+    np.testing.assert_allclose(np.add.reduceat(calibrated, server.MONTH_START_HOURS), monthly)
+    # Within a month the hours keep their relative weights
+    january = slice(0, 31 * 24)
+    np.testing.assert_allclose(calibrated[january] / monthly[0], profile[january] / profile[january].sum())
+
+
+def test_calibration_leaves_months_without_production_at_zero():
+    profile = np.zeros(server.HOURS_PER_YEAR)
+    calibrated = server.calibrate_hourly_profile(profile, np.full(12, 100.0))
+    assert not calibrated.any()
+
+
+def client(**overrides):
+    base = {
+        "roof_orientation": "Sud", "roof_surface": 30, "latitude": 48.85, "longitude": 2.35,
+        "last_calculation": {
+            "kit_power": 6, "estimated_production": 7200, "orientation": "Sud",
+            "roof_geometry": [{"name": "Sud", "surface": 30, "tilt": server.PANEL_TILT, "aspect": 0}],
+        },
+    }
+    base.update(overrides)
+    return base
+
+
+@pytest.fixture
+def roof_pvgis(monkeypatch):
+    async def get_roof_pvgis_data(client, kit_power, client_mode="particuliers"):
+        return {"specific_production": 1000.0}
+    monkeypatch.setattr(server, "get_roof_pvgis_data", get_roof_pvgis_data)
+
+
+def test_site_yield_reuses_the_calculation_of_the_same_roof(roof_pvgis):
+    assert asyncio.run(server.get_site_specific_yield(client())) == (1200, "calculation")
+
+
+@pytest.mark.parametrize("overrides", [{"roof_aspect": 45}, {"roof_tilt": 15}, {"roof_surface": 50}])
+def test_site_yield_ignores_the_calculation_of_another_geometry(roof_pvgis, overrides):
+    assert asyncio.run(server.get_site_specific_yield(client(**overrides))) == (1000.0, "pvgis")
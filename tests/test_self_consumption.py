@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import server
+
+
+def test_utc_series_moves_to_civil_time():
+    utc = np.zeros(server.HOURS_PER_YEAR)
+    utc[12] = 1.0  # 1 January 12:00 UTC -> 13:00 in winter
+    utc[181 * 24 + 12] = 1.0  # 1 July 12:00 UTC -> 14:00 in summer
+    civil = server.utc_to_civil_profile(utc)
+    assert civil[13] == 1.0 and civil[181 * 24 + 14] == 1.0
+    assert civil.sum() == 2.0
+
+
+def test_dst_changes_keep_the_total():
+    utc = np.arange(server.HOURS_PER_YEAR, dtype=np.float64)
+    civil = server.utc_to_civil_profile(utc)
+    assert civil.sum() == pytest.approx(utc.sum())
+    # 31 March 2019: 02:00 does not exist, 27 October 2019: 02:00 happens twice
+    assert civil[89 * 24 + 2] == 0
+    assert civil[299 * 24 + 2] == utc[299 * 24] + utc[299 * 24 + 1]
+
+
+def test_synthetic_profile_peaks_at_civil_solar_noon():
+    days = server.synthetic_hourly_profile(48.85, 0, server.PANEL_TILT, lon=2.35).reshape(365, 24)
+    hours = np.arange(24) + 0.5
+    # Solar noon in Paris is around 12:50 in winter and 13:50 in summer
+    assert (days[15] * hours).sum() / days[15].sum() == pytest.approx(12.9, abs=0.15)
+    assert (days[180] * hours).sum() / days[180].sum() == pytest.approx(13.9, abs=0.15)
+
+
+def test_self_consumption_balances():
+    production = server.synthetic_hourly_profile(48.85, 0, server.PANEL_TILT, lon=2.35) * 6
+    load = server.build_load_profile(6500, "Radiateurs électriques", "Ballon électrique standard")
+    result = server.simulate_self_consumption(production, load)
+    assert result["annual_consumption"] == pytest.approx(6500)
+    assert result["autoconsumption_kwh"] + result["surplus_kwh"] == pytest.approx(result["annual_production"])
+    assert result["autoconsumption_kwh"] + result["grid_import_kwh"] == pytest.approx(6500)
+    assert sum(month["production"] for month in result["monthly"]) == pytest.approx(result["annual_production"])
+    assert 0 < result["autoconsumption_rate"] < 1 and 0 < result["autonomy_rate"] < 1
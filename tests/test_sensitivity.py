@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import server
+
+CALCULATION = {
+    "client_mode": "particuliers",
+    "kit_price": 14900,
+    "total_aids": 1680,
+    "tva_refund": 0,
+    "monthly_savings": 96.5,
+    "estimated_production": 6610,
+    "autoconsumption_kwh": 4620,
+    "surplus_kwh": 1990,
+}
+
+
+def test_loan_payments_match_the_financing_functions():
+    loan = server.calculate_financing_with_aids(14900, 1680, 96.5)
+    payment = server.loan_monthly_payments(14900 - 1680, server.TAEG_CREDIT_WITH_AIDS, loan["duration_months"])
+    assert float(payment) == pytest.approx(loan["monthly_payment"], abs=0.01)
+
+
+def test_interest_free_loan():
+    np.testing.assert_allclose(server.loan_monthly_payments([1200, 2400], 0, 12), [100, 200])
+
+
+def parameters(result):
+    return {entry["parameter"]: entry for entry in result["parameters"]}
+
+
+def test_one_input_moves_at_a_time():
+    result = server.run_sensitivity_analysis(CALCULATION, "cash")
+    assert set(parameters(result)) == {"edf_rate", "surplus_sale_rate", "autoconsumption_rate", "kit_price"}
+    edf = parameters(result)["edf_rate"]
+    savings_per_step = 4620 * server.get_aids_by_mode("particuliers")["edf_rate"] / 12
+    assert [scenario["change"] for scenario in edf["scenarios"]] == server.SENSITIVITY_STEPS
+    for scenario in edf["scenarios"]:
+        assert scenario["monthly_savings_delta"] == pytest.approx(savings_per_step * scenario["change"], abs=0.01)
+
+
+def test_price_changes_payback_not_savings():
+    kit_price = parameters(server.run_sensitivity_analysis(CALCULATION, "cash"))["kit_price"]
+    assert all(scenario["monthly_savings_delta"] == 0 for scenario in kit_price["scenarios"])
+    paybacks = [scenario["payback_years"] for scenario in kit_price["scenarios"]]
+    assert paybacks == sorted(paybacks)
+
+
+def test_credit_adds_the_rate_and_sorts_by_swing():
+    result = server.run_sensitivity_analysis(CALCULATION, "credit")
+    assert "taeg" in parameters(result)
+    swings = [entry["monthly_savings_swing"] for entry in result["parameters"]]
+    assert swings == sorted(swings, reverse=True)
+    assert result["base"]["monthly_payment"] == pytest.approx(
+        server.calculate_financing_with_aids(14900, 1680, 96.5)["monthly_payment"], abs=0.01
+    )
+
+
+def test_autoconsumption_rate_is_capped():
+    calculation = dict(CALCULATION, autoconsumption_kwh=6000)
+    rates = [scenario["value"] for scenario in parameters(server.run_sensitivity_analysis(calculation, "cash"))["autoconsumption_rate"]["scenarios"]]
+    assert max(rates) == 1
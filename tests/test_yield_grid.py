@@ -0,0 +1,37 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import server
+
+
+def test_grid_node_is_returned_alone():
+    assert server.yield_grid_nodes(0, server.PANEL_TILT) == [(0.0, float(server.PANEL_TILT), 1.0)]
+
+
+def test_bilinear_weights():
+    nodes = server.yield_grid_nodes(-20, 32)
+    assert {(aspect, tilt) for aspect, tilt, _ in nodes} == {(-30, 30), (-30, 35), (-15, 30), (-15, 35)}
+    weights = {(aspect, tilt): weight for aspect, tilt, weight in nodes}
+    assert weights[(-15, 30)] == pytest.approx(2 / 3 * 3 / 5)
+    assert sum(weights.values()) == pytest.approx(1)
+
+
+def test_aspects_wrap_around_north():
+    nodes = server.yield_grid_nodes(175, server.PANEL_TILT)
+    assert {aspect for aspect, _, _ in nodes} == {165, -180}
+    assert server.yield_grid_nodes(-185, server.PANEL_TILT) == server.yield_grid_nodes(175, server.PANEL_TILT)
+
+
+def test_tilts_are_clipped():
+    assert server.yield_grid_nodes(0, 95) == [(0.0, 90.0, 1.0)]
+    assert server.yield_grid_nodes(0, -5) == [(0.0, 0.0, 1.0)]
+
+
+def test_interpolation_combines_node_arrays_and_sources():
+    async def get_node(aspect, tilt):
+        return np.full(12, aspect + tilt), "local" if aspect == -15 else "cache"
+    values, source = asyncio.run(server.interpolate_yield_grid(get_node, -20, 32))
+    np.testing.assert_allclose(values, np.full(12, -20 + 32))
+    assert source == "local"  # The least reliable source wins
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import server
+
+
+@pytest.fixture
+def raster():
+    """Raster whose monthly values are latitude + longitude + tilt, so that linear interpolation is exact"""
+    lat, lon, _, tilt = np.meshgrid(
+        server.YIELD_RASTER_LATITUDES, server.YIELD_RASTER_LONGITUDES, server.YIELD_RASTER_ASPECTS, server.YIELD_RASTER_TILTS,
+        indexing="ij"
+    )
+    return np.repeat((lat + lon + tilt)[..., None], 12, axis=-1).astype(np.float32)
+
+
+def test_lookup_interpolates_position_and_tilt(raster):
+    monthly = server.lookup_yield_raster(raster, 48.85, 2.35, 0, 30)
+    np.testing.assert_allclose(monthly, np.full(12, 48.85 + 2.35 + 30), rtol=1e-6)
+
+
+def test_lookup_interpolates_aspect_across_north(raster):
+    raster[:, :, 0] = 0  # -180 (north)
+    raster[:, :, -1] = 100  # 135 (north-west)
+    monthly = server.lookup_yield_raster(raster, 48.85, 2.35, 157.5, server.PANEL_TILT)
+    assert monthly[0] == pytest.approx(50)
+
+
+def test_lookup_clips_sites_outside_the_raster(raster):
+    inside = server.lookup_yield_raster(raster, 51.5, 10.0, 0, 90)
+    np.testing.assert_allclose(server.lookup_yield_raster(raster, 60, 20, 0, 120), inside)
+
+
+def test_missing_nodes_are_left_out(raster):
+    raster[:] = 100
+    raster[15:, 15:] = np.nan
+    monthly = server.lookup_yield_raster(raster, 41 + 15 * server.YIELD_RASTER_STEP - 0.1, -5.5 + 15 * server.YIELD_RASTER_STEP - 0.1, 0, 35)
+    np.testing.assert_allclose(monthly, np.full(12, 100))
+
+
+def test_site_without_nodes_has_no_estimate(raster):
+    raster[:] = np.nan
+    assert server.lookup_yield_raster(raster, 48.85, 2.35, 0, 35) is None
+
+
+def test_estimate_hourly_production_matches_the_monthly_estimate():
+    client = {"latitude": 48.85, "longitude": 2.35}
+    monthly = np.linspace(200, 700, 12)
+    estimate = {
+        "monthly_data": [{"month": month + 1, "E_m": value} for month, value in enumerate(monthly)],
+        "roof_sections": [{"aspect": -90, "tilt": 30, "kit_power": 3}, {"aspect": 90, "tilt": 30, "kit_power": 3}],
+    }
+    production = server.estimate_hourly_production(client, estimate)
+    np.testing.assert_allclose(np.add.reduceat(production, server.MONTH_START_HOURS), monthly)